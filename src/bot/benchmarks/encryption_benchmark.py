@@ -0,0 +1,55 @@
+# Compares the encryption modes of the claim data, run it from the bot directory:
+# python -m benchmarks.encryption_benchmark
+import copy
+import timeit
+from typing import List
+
+import bson
+from cryptography.fernet import Fernet
+
+from encryption import DataEncryptor, ENCRYPTION_MODES
+
+ROUNDS: int = 1000
+
+CLAIM_DATA: dict = {
+    "user_id": 123456789,
+    "claim_theme": "Восстановление на работе",
+    "claim_data": {
+        "head": {
+            "user_name": "Иванов Иван Иванович",
+            "user_post_code": "123456",
+            "chosen_city": "Москва",
+            "chosen_street": "Ленинградский проспект",
+            "house_chosen": "12к3",
+            "apartment_chosen": "45",
+            "chosen_employer_name": "ООО Ромашка",
+            "chosen_employer_address": "Москва, ул. Тверская, д. 1"
+        },
+        "story": {
+            "start_work_date": "01.02.2020",
+            "user_position": "инженер",
+            "user_salary": "50000"
+        }
+    }
+}
+
+
+def main():
+    key: str = Fernet.generate_key().decode()
+    print(f"{'mode':<10}{'bytes':>8}{'crypto calls':>14}{'encrypt, ms':>14}{'decrypt, ms':>14}")
+    for mode in sorted(ENCRYPTION_MODES):
+        encryptor: DataEncryptor = DataEncryptor([key], mode)
+        encrypted_data: dict = encryptor.encrypt_data(copy.deepcopy(CLAIM_DATA))
+        document_size: int = len(bson.encode(encrypted_data))
+        crypto_calls: int = encryptor.crypto_calls
+
+        encrypt_times: List[float] = timeit.repeat(lambda: encryptor.encrypt_data(copy.deepcopy(CLAIM_DATA)),
+                                                   number=ROUNDS, repeat=3)
+        decrypt_times: List[float] = timeit.repeat(lambda: encryptor.decrypt_data(copy.deepcopy(encrypted_data)),
+                                                   number=ROUNDS, repeat=3)
+        print(f"{mode:<10}{document_size:>8}{crypto_calls:>14}"
+              f"{min(encrypt_times) / ROUNDS * 1000:>14.3f}{min(decrypt_times) / ROUNDS * 1000:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
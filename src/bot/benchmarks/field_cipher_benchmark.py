@@ -0,0 +1,34 @@
+# Compares the field ciphers, run it from the bot directory:
+# python -m benchmarks.field_cipher_benchmark
+import timeit
+from typing import List
+
+import bson
+from cryptography.fernet import Fernet
+
+from field_cipher import FIELD_CIPHERS, FieldCipher, EncryptedValue, create_field_cipher
+
+ROUNDS: int = 10000
+
+FIELD_VALUE: str = "Ленинградский проспект"
+
+
+def main():
+    key: str = Fernet.generate_key().decode()
+    value: bytes = FIELD_VALUE.encode()
+    # the size of the value in the document, i.e. with the bson type and length
+    plain_size: int = len(bson.encode({"v": FIELD_VALUE}))
+    print(f"Field value: {len(value)} bytes, stored plain: {plain_size} bytes")
+    print(f"{'cipher':<20}{'bytes':>8}{'encrypt, ops/s':>16}{'decrypt, ops/s':>16}")
+    for name in FIELD_CIPHERS.keys():
+        cipher: FieldCipher = create_field_cipher(name, key)
+        encrypted_value: EncryptedValue = cipher.encrypt(value)
+        stored_size: int = len(bson.encode({"v": encrypted_value}))
+
+        encrypt_times: List[float] = timeit.repeat(lambda: cipher.encrypt(value), number=ROUNDS, repeat=3)
+        decrypt_times: List[float] = timeit.repeat(lambda: cipher.decrypt(encrypted_value), number=ROUNDS, repeat=3)
+        print(f"{name:<20}{stored_size:>8}{ROUNDS / min(encrypt_times):>16.0f}{ROUNDS / min(decrypt_times):>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Compares the FSM storages on a claim dialog, run it from the bot directory:
+# python -m benchmarks.fsm_storage_benchmark
+# The db is replaced by a counter of the requests, so only the overhead of the storage and the number of the db
+# requests are measured.
+import asyncio
+import time
+from typing import List, Optional
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+from cryptography.fernet import Fernet
+
+from encryption import DataEncryptor, ENVELOPE_MODE
+from fsm_storage import MongoWriteBehindStorage, BoundedMemoryStorage
+
+USERS_COUNT: int = 100
+# the state and the data are read and updated on every message of the dialog
+MESSAGES_COUNT: int = 50
+
+
+class CountingRepository:
+    def __init__(self):
+        self.encryptor: DataEncryptor = DataEncryptor([Fernet.generate_key().decode()], ENVELOPE_MODE)
+        self.requests_count: int = 0
+
+    def encrypt_data(self, data: dict) -> dict:
+        return self.encryptor.encrypt_data(data)
+
+    def decrypt_data(self, data: dict) -> dict:
+        return self.encryptor.decrypt_data(data)
+
+    async def get_fsm_record(self, key: str) -> Optional[dict]:
+        self.requests_count += 1
+        return None
+
+    async def bulk_write(self, collection_name: str, requests: list, ordered: bool = False):
+        self.requests_count += 1
+
+
+async def run_dialogs(storage: BaseStorage):
+    for message_index in range(MESSAGES_COUNT):
+        for user_id in range(USERS_COUNT):
+            await storage.get_state(chat=user_id, user=user_id)
+            await storage.update_data(chat=user_id, user=user_id, data={"user_name": "Иванов Иван Иванович",
+                                                                        f"field_{message_index}": "значение"})
+            await storage.set_state(chat=user_id, user=user_id, state=f"state_{message_index}")
+        # the users answer concurrently, the flush happens between the messages
+        await asyncio.sleep(0)
+    await storage.close()
+
+
+def main():
+    print(f"{'storage':<26}{'operations':>12}{'time, ms':>12}{'us per op':>12}{'db requests':>14}")
+    operations_count: int = USERS_COUNT * MESSAGES_COUNT * 3
+    repository: CountingRepository = CountingRepository()
+    storages: List[BaseStorage] = [
+        MemoryStorage(),
+        BoundedMemoryStorage(),
+        MongoWriteBehindStorage(flush_interval_sec=0.01, repository=repository)
+    ]
+    for storage in storages:
+        loop = asyncio.new_event_loop()
+        started_at: float = time.perf_counter()
+        loop.run_until_complete(run_dialogs(storage))
+        elapsed_sec: float = time.perf_counter() - started_at
+        loop.close()
+        requests_count: int = repository.requests_count if isinstance(storage, MongoWriteBehindStorage) else 0
+        print(f"{type(storage).__name__:<26}{operations_count:>12}{elapsed_sec * 1000:>12.1f}"
+              f"{elapsed_sec / operations_count * 1e6:>12.2f}{requests_count:>14}")
+    print(f"write-through would make {USERS_COUNT * MESSAGES_COUNT * 2} db requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,32 +2,43 @@ import argparse
 import logging
 
 from aiogram import executor, Dispatcher
-from dotenv import dotenv_values
 
 from handlers import start_menu, head_part_handler, story_part_handler, essence_part_handler, proofs_part_handler, \
     claims_part_handler, additions_part_handler, download_doc_handler, admin_actions_handler
 from init_bot import init_bot
+from key_rotation import start_key_rotation_sweep, stop_key_rotation_sweep
+from repository import close_mongo_client, get_pool_stats
+from statistics import start_statistics_buffer, statistics_buffer
+from statistics_retention import start_statistics_retention, stop_statistics_retention
+from webhook import start_webhook
 import bot_config
 
 
 logging.basicConfig(level=logging.INFO)
 
 
+async def startup(dispatcher: Dispatcher):
+    start_key_rotation_sweep()
+    start_statistics_buffer()
+    start_statistics_retention()
+
+
 async def shutdown(dispatcher: Dispatcher):
+    await stop_key_rotation_sweep()
+    await stop_statistics_retention()
+    await statistics_buffer.stop()
     await dispatcher.storage.close()
     await dispatcher.storage.wait_closed()
+    logging.info(f"Mongo connection pool stats: {get_pool_stats()}")
+    close_mongo_client()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-e", "--environment", type=str, help="Environment name: dev or prod.", choices=["dev", "prod"])
+    parser.add_argument("-m", "--mode", type=str, help="Updates receiving mode: polling or webhook.",
+                        choices=["polling", "webhook"], default="polling")
     args = parser.parse_args()
-    bot_config.ENV = args.environment
-    if bot_config.ENV == "prod":
-        config = dotenv_values(".env")
-    elif bot_config.ENV == "dev":
-        config = dotenv_values(".env-dev")
-    else:
-        raise EnvironmentError("Provided environment name is not allowed.")
+    config = bot_config.load_config(args.environment)
 
     dp = init_bot(config["API_TOKEN"])
 
@@ -40,4 +51,7 @@ if __name__ == "__main__":
     additions_part_handler.register_handlers(dp)
     download_doc_handler.register_handlers(dp)
     admin_actions_handler.register_handlers(dp)
-    executor.start_polling(dp, skip_updates=True, on_shutdown=shutdown)
+    if args.mode == "webhook":
+        start_webhook(dp, on_startup=startup, on_shutdown=shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=startup, on_shutdown=shutdown)
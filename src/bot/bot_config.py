@@ -1 +1,35 @@
+from typing import Dict, Optional
+
+from dotenv import dotenv_values
+
 ENV: str
+CONFIG: Optional[Dict[str, Optional[str]]] = None
+
+ENV_FILES: Dict[str, str] = {
+    "prod": ".env",
+    "dev": ".env-dev"
+}
+
+
+def load_config(env: str) -> Dict[str, Optional[str]]:
+    global ENV, CONFIG
+    if env not in ENV_FILES:
+        raise EnvironmentError("Provided environment name is not allowed.")
+
+    ENV = env
+    CONFIG = dotenv_values(ENV_FILES[env])
+    return CONFIG
+
+
+def get_config() -> Dict[str, Optional[str]]:
+    # the env file is parsed only once per process, see load_config
+    if CONFIG is None:
+        return load_config(ENV)
+    return CONFIG
+
+
+def get_int(name: str, default: int) -> int:
+    value_raw: Optional[str] = get_config().get(name)
+    if value_raw is None or value_raw.isdigit() is False:
+        return default
+    return int(value_raw)
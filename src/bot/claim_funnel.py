@@ -0,0 +1,139 @@
+import bisect
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Callable
+
+from aiogram import types
+from aiogram.dispatcher import FSMContext
+
+# the step from the template choice to the document download
+DOCUMENT_STEP: str = "document"
+# the step of the head part from the user address to the chosen court
+COURT_STEP: str = "head:court"
+
+# the upper bounds of the histogram buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS: List[float] = [1, 2, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count: int = 0
+        self.total_sec: float = 0
+
+    def add(self, latency_sec: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, latency_sec)] += 1
+        self.count += 1
+        self.total_sec += latency_sec
+
+    def get_percentile(self, percentile: float) -> Optional[float]:
+        # the upper bound of the bucket, which contains the percentile
+        if self.count == 0:
+            return None
+
+        rank: float = self.count * percentile
+        bucket_count: int = 0
+        for index, count in enumerate(self.buckets[:-1]):
+            bucket_count += count
+            if bucket_count >= rank:
+                return LATENCY_BUCKETS[index]
+        return float("inf")
+
+    def get_mean(self) -> float:
+        return self.total_sec / self.count if self.count > 0 else 0
+
+
+class ClaimFunnelSession:
+    def __init__(self, claim_theme: str, started_at: float):
+        self.claim_theme: str = claim_theme
+        self.started_at: float = started_at
+        self.steps_started_at: Dict[str, float] = {}
+
+
+# The step timestamps of the claims in progress and the latency histograms of the steps by the template. Everything is
+# kept in memory, the number of the tracked claims is bounded, the least recently active ones are forgotten.
+class ClaimFunnel:
+    def __init__(self, max_sessions: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.max_sessions: int = max_sessions
+        self.clock: Callable[[], float] = clock
+        self.sessions: "OrderedDict[int, ClaimFunnelSession]" = OrderedDict()
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.started_steps: Dict[Tuple[str, str], int] = {}
+
+    def _get_session(self, user_id: int) -> Optional[ClaimFunnelSession]:
+        session: Optional[ClaimFunnelSession] = self.sessions.get(user_id)
+        if session is not None:
+            self.sessions.move_to_end(user_id)
+        return session
+
+    def _add_latency(self, claim_theme: str, step: str, latency_sec: float):
+        self.histograms.setdefault((claim_theme, step), LatencyHistogram()).add(latency_sec)
+
+    def start_claim(self, user_id: int, claim_theme: str):
+        session: Optional[ClaimFunnelSession] = self._get_session(user_id)
+        # the user can come back to the claim in progress
+        if session is not None and session.claim_theme == claim_theme:
+            return
+
+        self.sessions[user_id] = ClaimFunnelSession(claim_theme, self.clock())
+        self.sessions.move_to_end(user_id)
+        self.started_steps[(claim_theme, DOCUMENT_STEP)] = self.started_steps.get((claim_theme, DOCUMENT_STEP), 0) + 1
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def start_step(self, user_id: int, step: str):
+        session: Optional[ClaimFunnelSession] = self._get_session(user_id)
+        if session is None:
+            return
+
+        # the repeated start of the step (e.g. the part is edited again) restarts it
+        session.steps_started_at[step] = self.clock()
+        self.started_steps[(session.claim_theme, step)] = self.started_steps.get((session.claim_theme, step), 0) + 1
+
+    def complete_step(self, user_id: int, step: str):
+        session: Optional[ClaimFunnelSession] = self._get_session(user_id)
+        if session is None or step not in session.steps_started_at.keys():
+            return
+
+        self._add_latency(session.claim_theme, step, self.clock() - session.steps_started_at.pop(step))
+
+    def finish_claim(self, user_id: int):
+        session: Optional[ClaimFunnelSession] = self.sessions.pop(user_id, None)
+        if session is None:
+            return
+
+        self._add_latency(session.claim_theme, DOCUMENT_STEP, self.clock() - session.started_at)
+
+    def get_report(self) -> Dict[str, List[Tuple[str, int, LatencyHistogram]]]:
+        # the steps of every template with the number of the starts, the longest steps in total go first
+        report: Dict[str, List[Tuple[str, int, LatencyHistogram]]] = {}
+        for (claim_theme, step), started_count in self.started_steps.items():
+            histogram: LatencyHistogram = self.histograms.get((claim_theme, step), LatencyHistogram())
+            report.setdefault(claim_theme, []).append((step, started_count, histogram))
+        for steps in report.values():
+            steps.sort(key=lambda s: (s[0] != DOCUMENT_STEP, -s[2].total_sec, s[0]))
+        return report
+
+
+claim_funnel: ClaimFunnel = ClaimFunnel()
+
+
+def format_latency(latency_sec: Optional[float]) -> str:
+    if latency_sec is None:
+        return "-"
+    if latency_sec == float("inf"):
+        return f"> {LATENCY_BUCKETS[-1] // 3600} ч"
+    if latency_sec < 60:
+        return f"{latency_sec:.0f} с"
+    if latency_sec < 3600:
+        return f"{latency_sec / 60:.0f} мин"
+    return f"{latency_sec / 3600:.1f} ч"
+
+
+def track_claim_step(step: str):
+    def track(handler):
+        async def wrapper(message: types.Message, state: FSMContext):
+            claim_funnel.start_step(message.from_user.id, step)
+            await handler(message, state)
+        return wrapper
+    return track
@@ -0,0 +1,221 @@
+import copy
+import logging
+from typing import Optional, List, Dict, Set, MutableMapping
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.mixins import ContextInstanceMixin
+
+from claim_funnel import claim_funnel
+from common.claim_progress import PROGRESS_FIELD, get_claim_data_progress, get_progress_parts, \
+    get_update_progress_mask
+from claim_tmp_cache import get_claim_tmp_version
+from repository import AsyncRepository, get_tmp_part_values
+
+# aggregated over all processed updates, see ClaimSessionMiddleware
+session_stats: Dict[str, int] = {
+    "updates": 0,
+    "round_trips": 0,
+    "max_round_trips": 0,
+    "failed_writes": 0
+}
+
+SAVE_FAILED_MESSAGE: str = "Не удалось сохранить данные раздела. Пожалуйста, попробуйте отправить ответ еще раз."
+
+
+# Claim data of the user for the current update. The claim document and the template are loaded lazily at most
+# once per update. The changes are collected and written with a single atomic update by the claim key in the end of
+# the update by ClaimSessionMiddleware, or earlier, if the claim is read before it's loaded.
+class ClaimSession(ContextInstanceMixin):
+    def __init__(self, user_id: int, is_write_behind: bool = False):
+        self.user_id: int = user_id
+        # the standalone session (e.g. in scripts) isn't flushed by the middleware, so it writes at once
+        self.is_write_behind: bool = is_write_behind
+        self.repository: AsyncRepository = AsyncRepository()
+        self._claim_data: Optional[MutableMapping] = None
+        self._is_claim_data_loaded: bool = False
+        self._pending_update: dict = {}
+
+    @property
+    def round_trips(self) -> int:
+        return self.repository.round_trips
+
+    async def get_claim_data(self) -> Optional[MutableMapping]:
+        if not self._is_claim_data_loaded and any(self._pending_update):
+            # the pending changes are written by the same call, which returns the updated claim
+            await self.flush()
+        if not self._is_claim_data_loaded:
+            self._claim_data = await self.repository.get_claim_data(self.user_id)
+            self._is_claim_data_loaded = True
+        return self._claim_data
+
+    async def get_filled_parts(self) -> Set[str]:
+        if not self._is_claim_data_loaded and not any(self._pending_update):
+            claim_progress: Optional[dict] = await self.repository.get_claim_progress(self.user_id)
+            if claim_progress is not None and claim_progress.get(PROGRESS_FIELD) is not None:
+                return get_progress_parts(claim_progress[PROGRESS_FIELD])
+            # the claims created before the progress field are checked by the whole document
+
+        claim_data: Optional[MutableMapping] = await self.get_claim_data()
+        if claim_data is None:
+            return set()
+        return get_progress_parts(get_claim_data_progress(claim_data))
+
+    async def get_claim_theme(self) -> Optional[str]:
+        claim_data: Optional[MutableMapping] = await self.get_claim_data()
+        if claim_data is not None:
+            return claim_data["claim_theme"]
+        else:
+            return None
+
+    async def get_claim_tmp(self) -> Optional[dict]:
+        claim_theme: Optional[str] = await self.get_claim_theme()
+        if claim_theme is None:
+            return None
+        return await self.repository.get_claim_tmp(claim_theme)
+
+    async def get_claim_tmp_version(self) -> Optional[str]:
+        claim_tmp: Optional[dict] = await self.get_claim_tmp()
+        if claim_tmp is None:
+            return None
+        return get_claim_tmp_version(claim_tmp)
+
+    async def get_chosen_claim_tmp_options(self, part: str) -> Optional[List[str]]:
+        # the options of the template version, which the chosen options of the part refer to
+        claim_data: Optional[MutableMapping] = await self.get_claim_data()
+        claim_tmp: Optional[dict] = await self.get_claim_tmp()
+        if claim_data is None or claim_tmp is None:
+            return None
+
+        tmp_version: Optional[str] = claim_data.get("claim_data", {}).get(part, {}).get("tmp_version")
+        if tmp_version is not None and tmp_version != get_claim_tmp_version(claim_tmp):
+            versioned_claim_tmp: Optional[dict] = await self.repository.get_claim_tmp_history(claim_tmp["theme"],
+                                                                                              tmp_version)
+            if versioned_claim_tmp is not None:
+                claim_tmp = versioned_claim_tmp
+            else:
+                logging.getLogger("CLAIM_SESSION").warning(f"Template '{claim_tmp['theme']}' of version "
+                                                           f"'{tmp_version}' is not found, the current one is used.")
+        return get_tmp_part_values(claim_tmp, part, "options")
+
+    async def get_claim_tmp_examples(self, part: str) -> Optional[List[str]]:
+        return get_tmp_part_values(await self.get_claim_tmp(), part, "examples")
+
+    async def get_claim_tmp_options(self, part: str) -> Optional[List[str]]:
+        return get_tmp_part_values(await self.get_claim_tmp(), part, "options")
+
+    async def get_claim_tmp_actions(self, part: str) -> Optional[List[str]]:
+        return get_tmp_part_values(await self.get_claim_tmp(), part, "actions")
+
+    async def choose_claim(self, claim_theme: str) -> bool:
+        # the pending changes belong to the previous current claim
+        await self.flush()
+        is_created: bool = await self.repository.choose_claim(self.user_id, claim_theme)
+        claim_funnel.start_claim(self.user_id, claim_theme)
+        # the current claim is resolved by the db on the next read
+        self._claim_data = None
+        self._is_claim_data_loaded = False
+        return is_created
+
+    async def update_claim_data(self, new_value: dict):
+        for part_name in get_progress_parts(get_update_progress_mask(new_value)):
+            claim_funnel.complete_step(self.user_id, part_name)
+        if self._is_claim_data_loaded:
+            if self._claim_data is None:
+                return
+
+            # keep the loaded document up to date, so the rest of the update can read the changes
+            for path, value in new_value.items():
+                target: MutableMapping = self._claim_data
+                *parents, key = path.split(".")
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target[key] = value
+
+        self._pending_update.update(new_value)
+        if not self.is_write_behind:
+            await self.flush()
+
+    async def save_claim_data(self, new_value: dict) -> bool:
+        # The filled part is written before the user is told about it. If the write fails, the loaded document is
+        # dropped, so it's read again with the stored values, and the dialog state is kept to send the answer again.
+        try:
+            await self.update_claim_data(new_value)
+            await self.flush()
+        except Exception:
+            session_stats["failed_writes"] += 1
+            logging.getLogger("CLAIM_SESSION").exception(f"Failed to write the claim changes of user {self.user_id}.")
+            self._claim_data = None
+            self._is_claim_data_loaded = False
+            return False
+        return True
+
+    async def flush(self):
+        if not any(self._pending_update):
+            return
+
+        # the values are encrypted in place, so the loaded document must not be affected
+        pending_update: dict = copy.deepcopy(self._pending_update)
+        self._pending_update = {}
+        if not self._is_claim_data_loaded:
+            # the updated claim is returned by the same call, so the rest of the update doesn't read it again
+            self._claim_data = await self.repository.update_current_claim_data(self.user_id, pending_update)
+            self._is_claim_data_loaded = True
+        elif self._claim_data is not None:
+            await self.repository.update_claim_data(self.user_id, self._claim_data["claim_theme"], pending_update)
+
+    async def remove_claim_data(self):
+        self._pending_update = {}
+        claim_data: Optional[MutableMapping] = await self.get_claim_data()
+        if claim_data is None:
+            return
+
+        await self.repository.remove_item("claim-data", claim_data["_id"])
+        self._claim_data = None
+
+
+def get_claim_session(user_id: int) -> ClaimSession:
+    # outside of the middleware (e.g. in scripts) a standalone session is used
+    claim_session: Optional[ClaimSession] = ClaimSession.get_current()
+    if claim_session is None or claim_session.user_id != user_id:
+        claim_session = ClaimSession(user_id)
+    return claim_session
+
+
+class ClaimSessionMiddleware(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        self.logger = logging.getLogger("CLAIM_SESSION")
+
+    @staticmethod
+    def _open_session(user: types.User):
+        ClaimSession.set_current(ClaimSession(user.id, is_write_behind=True))
+
+    async def _close_session(self):
+        claim_session: Optional[ClaimSession] = ClaimSession.get_current()
+        if claim_session is None:
+            return
+
+        try:
+            await claim_session.flush()
+        except Exception:
+            # the filled parts are written by the handlers (see save_claim_data), the rest of the changes is lost
+            session_stats["failed_writes"] += 1
+            self.logger.exception(f"Failed to write the claim changes of user {claim_session.user_id}.")
+
+        session_stats["updates"] += 1
+        session_stats["round_trips"] += claim_session.round_trips
+        session_stats["max_round_trips"] = max(session_stats["max_round_trips"], claim_session.round_trips)
+        self.logger.debug(f"Update of user {claim_session.user_id} made {claim_session.round_trips} db round trips.")
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self._open_session(message.from_user)
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict):
+        await self._close_session()
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self._open_session(callback_query.from_user)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results: list, data: dict):
+        await self._close_session()
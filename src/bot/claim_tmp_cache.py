@@ -0,0 +1,80 @@
+import hashlib
+import json
+import time
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+CachedClaimTmp = namedtuple("CachedClaimTmp", ["version", "claim_tmp", "loaded_at"])
+
+
+def get_claim_tmp_version(claim_tmp: dict) -> str:
+    # the seeded templates carry their version, otherwise the version is a hash of the template content
+    if claim_tmp.get("version") is not None:
+        return claim_tmp["version"]
+
+    content: dict = {key: value for key, value in claim_tmp.items() if key != "_id"}
+    content_raw: bytes = json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode()
+    return hashlib.sha256(content_raw).hexdigest()[:16]
+
+
+class ClaimTmpCache:
+    def __init__(self, ttl_sec: int = 0):
+        # ttl_sec = 0 means that the templates are kept until explicit invalidation
+        self.ttl_sec: int = ttl_sec
+        self.claim_tmps: Dict[str, CachedClaimTmp] = {}
+        self.themes: Optional[List[str]] = None
+        self.themes_loaded_at: float = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def _is_expired(self, loaded_at: float) -> bool:
+        return self.ttl_sec > 0 and time.monotonic() - loaded_at > self.ttl_sec
+
+    def get(self, theme: str) -> Optional[CachedClaimTmp]:
+        cached_tmp: Optional[CachedClaimTmp] = self.claim_tmps.get(theme)
+        if cached_tmp is None or self._is_expired(cached_tmp.loaded_at):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return cached_tmp
+
+    def put(self, claim_tmp: dict) -> CachedClaimTmp:
+        cached_tmp: CachedClaimTmp = CachedClaimTmp(version=get_claim_tmp_version(claim_tmp),
+                                                    claim_tmp=claim_tmp,
+                                                    loaded_at=time.monotonic())
+        self.claim_tmps[claim_tmp["theme"]] = cached_tmp
+        return cached_tmp
+
+    def put_all(self, claim_tmps: List[dict]):
+        self.claim_tmps = {}
+        for claim_tmp in claim_tmps:
+            self.put(claim_tmp)
+        self.themes = [claim_tmp["theme"] for claim_tmp in claim_tmps]
+        self.themes_loaded_at = time.monotonic()
+
+    def get_themes(self) -> Optional[List[str]]:
+        if self.themes is None or self._is_expired(self.themes_loaded_at):
+            return None
+        return self.themes
+
+    def get_version(self, theme: str) -> Optional[str]:
+        cached_tmp: Optional[CachedClaimTmp] = self.claim_tmps.get(theme)
+        return cached_tmp.version if cached_tmp is not None else None
+
+    def invalidate(self, theme: Optional[str] = None):
+        if theme is None:
+            self.claim_tmps = {}
+        else:
+            self.claim_tmps.pop(theme, None)
+        self.themes = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "templates": len(self.claim_tmps),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+claim_tmp_cache: ClaimTmpCache = ClaimTmpCache()
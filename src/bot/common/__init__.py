@@ -1,3 +1,7 @@
 from .court_resolver import CourtInfo, resolve_court_address
 from .oof_profit_calculator import calc_oof_profit, calc_months_diff, calc_work_days_in_month, OOFCalculation
 from .payoff_profit_calculator import calc_payoff_profit, PayOffCalculation, calc_paydays_count
+from .region_index import RegionIndex, region_index
+from .claim_progress import PART_NAMES, get_progress_parts
+from .hyperloglog import HLL_STANDARD_ERROR, get_hll_register, merge_hll_registers, estimate_hll_cardinality, \
+    pack_hll_registers, unpack_hll_registers
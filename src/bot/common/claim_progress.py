@@ -0,0 +1,31 @@
+from typing import List, Set
+
+PART_NAMES: List[str] = ["head", "story", "essence", "proofs", "claims", "additions"]
+# the progress of the claim is stored as a bit mask of the filled parts, a bit per part of PART_NAMES
+PROGRESS_FIELD: str = "progress"
+
+
+def get_part_mask(part_name: str) -> int:
+    return 1 << PART_NAMES.index(part_name)
+
+
+def get_update_progress_mask(new_value: dict) -> int:
+    # the parts which are written by the update, e.g. {"claim_data.head": {...}}
+    mask: int = 0
+    for path in new_value.keys():
+        path_parts: List[str] = path.split(".")
+        if len(path_parts) == 2 and path_parts[0] == "claim_data" and path_parts[1] in PART_NAMES:
+            mask |= get_part_mask(path_parts[1])
+    return mask
+
+
+def get_claim_data_progress(claim_data: dict) -> int:
+    mask: int = 0
+    for part_name in (claim_data.get("claim_data") or {}).keys():
+        if part_name in PART_NAMES:
+            mask |= get_part_mask(part_name)
+    return mask
+
+
+def get_progress_parts(progress: int) -> Set[str]:
+    return {part_name for part_name in PART_NAMES if progress & get_part_mask(part_name)}
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from typing import List, Optional, Tuple, Dict
 
 import pymorphy2
 from docx import Document
@@ -9,10 +9,14 @@ from docx.text.paragraph import Paragraph
 
 from common import calc_oof_profit, PayOffCalculation, calc_payoff_profit
 from common.oof_profit_calculator import OOFCalculation
-from repository import Repository
 
 
-def convert_to_doc(data: dict) -> Document:
+# the parts, which options are chosen from the template
+OPTION_PART_NAMES: List[str] = ["essence", "proofs", "additions"]
+
+
+def convert_to_doc(data: dict, law_data: Optional[List[str]],
+                   tmp_options: Optional[Dict[str, Optional[List[str]]]] = None) -> Document:
     claim_doc: Document = Document()
 
     # common doc settings
@@ -48,14 +52,14 @@ def convert_to_doc(data: dict) -> Document:
 
     # essence
     essence: Paragraph = claim_doc.add_paragraph()
-    essence_options: List[str] = data["claim_data"]["essence"]["chosen_options"]
+    essence_options: List[str] = get_chosen_options(data["claim_data"], "essence", tmp_options)
     essence.add_run(", ".join(essence_options))
     essence.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
     essence.paragraph_format.first_line_indent = Inches(0.5)
 
     # proofs
     proofs: Paragraph = claim_doc.add_paragraph()
-    proofs_data: List[str] = data["claim_data"]["proofs"]["chosen_options"]
+    proofs_data: List[str] = get_chosen_options(data["claim_data"], "proofs", tmp_options)
     proofs.text = "Доводы, указанные в исковом заявлении подтверждаются следующими " + \
                   f"доказательствами: {', '.join(proofs_data)}."
     proofs.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
@@ -63,7 +67,7 @@ def convert_to_doc(data: dict) -> Document:
 
     # law
     law: Paragraph = claim_doc.add_paragraph()
-    law.text = get_law_text(data["claim_theme"])
+    law.text = get_law_text(law_data)
     law.alignment = WD_PARAGRAPH_ALIGNMENT.JUSTIFY
     law.paragraph_format.first_line_indent = Inches(0.5)
 
@@ -83,7 +87,7 @@ def convert_to_doc(data: dict) -> Document:
     pre_additions.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
 
     additions: Paragraph = claim_doc.add_paragraph()
-    for i, addition_data in enumerate(data["claim_data"]["additions"]["chosen_options"], start=1):
+    for i, addition_data in enumerate(get_chosen_options(data["claim_data"], "additions", tmp_options), start=1):
         additions.add_run(f"{i}. {addition_data}\n")
 
     # footer
@@ -94,6 +98,19 @@ def convert_to_doc(data: dict) -> Document:
     return claim_doc
 
 
+def get_chosen_options(claim_data: dict, part: str,
+                       tmp_options: Optional[Dict[str, Optional[List[str]]]] = None) -> List[str]:
+    # the options chosen from the template are stored as indexes of the template options, the own options as text
+    options: List[str] = (tmp_options or {}).get(part) or []
+    chosen_options: List[str] = []
+    for chosen_option in claim_data[part]["chosen_options"]:
+        if isinstance(chosen_option, str):
+            chosen_options.append(chosen_option)
+        elif 0 <= chosen_option < len(options):
+            chosen_options.append(options[chosen_option])
+    return chosen_options
+
+
 def get_footer_text(head_data: dict) -> str:
     short_user_name: str = get_short_user_name(head_data['user_name'])
     claim_date: datetime = datetime.now()
@@ -143,9 +160,7 @@ def get_full_employee_name(head_data: dict) -> str:
         return f"{head_data['chosen_employer_name']} (ИНН {head_data['inn']})"
 
 
-def get_law_text(claim_theme: str) -> str:
-    repository: Repository = Repository()
-    law_data: Optional[List[str]] = repository.get_claim_tmp_options(claim_theme, "law")
+def get_law_text(law_data: Optional[List[str]]) -> str:
     if law_data is None:
         return ""
 
@@ -0,0 +1,57 @@
+import math
+import zlib
+from typing import Dict, Tuple
+
+# HyperLogLog sketch of the unique users. The registers are stored sparsely as {index: rank}, only the registers
+# touched by some user are present, so the sketch of a small day is small. The sketches are merged by the max rank
+# of every register, so the sketch of a range of days counts every user once.
+#
+# The standard error of the estimation is 1.04 / sqrt(HLL_REGISTERS_COUNT), about 3.25%: the estimation is within
+# ±3.25% of the real number in about 68% of cases and within ±6.5% in about 95% of cases, independently of the number
+# of the merged days. Up to 2.5 * HLL_REGISTERS_COUNT users the linear counting is used, which is almost exact for
+# a few hundreds of users.
+HLL_PRECISION: int = 10
+HLL_REGISTERS_COUNT: int = 1 << HLL_PRECISION
+HLL_STANDARD_ERROR: float = 1.04 / math.sqrt(HLL_REGISTERS_COUNT)
+
+
+def get_hll_register(hash_hex: str) -> Tuple[int, int]:
+    # the hash must be uniformly distributed, e.g. get_user_id_hash
+    hash_bits: int = len(hash_hex) * 4 - HLL_PRECISION
+    hash_value: int = int(hash_hex, 16)
+    index: int = hash_value >> hash_bits
+    rest: int = hash_value & ((1 << hash_bits) - 1)
+    # the position of the leftmost 1 bit of the rest
+    rank: int = hash_bits - rest.bit_length() + 1
+    return index, rank
+
+
+def merge_hll_registers(*registers: Dict[int, int]) -> Dict[int, int]:
+    merged_registers: Dict[int, int] = {}
+    for sketch_registers in registers:
+        for index, rank in sketch_registers.items():
+            if rank > merged_registers.get(index, 0):
+                merged_registers[index] = rank
+    return merged_registers
+
+
+def pack_hll_registers(registers: Dict[int, int]) -> bytes:
+    # the compact form of the sketch for the archive, a byte per register; mostly empty sketches are compressed well
+    packed_registers: bytearray = bytearray(HLL_REGISTERS_COUNT)
+    for index, rank in registers.items():
+        packed_registers[index] = rank
+    return zlib.compress(bytes(packed_registers), 9)
+
+
+def unpack_hll_registers(packed_registers: bytes) -> Dict[int, int]:
+    return {index: rank for index, rank in enumerate(zlib.decompress(packed_registers)) if rank > 0}
+
+
+def estimate_hll_cardinality(registers: Dict[int, int]) -> int:
+    alpha: float = 0.7213 / (1 + 1.079 / HLL_REGISTERS_COUNT)
+    empty_registers_count: int = HLL_REGISTERS_COUNT - len(registers)
+    harmonic_sum: float = empty_registers_count + sum(2.0 ** -rank for rank in registers.values())
+    estimation: float = alpha * HLL_REGISTERS_COUNT ** 2 / harmonic_sum
+    if estimation <= 2.5 * HLL_REGISTERS_COUNT and empty_registers_count > 0:
+        estimation = HLL_REGISTERS_COUNT * math.log(HLL_REGISTERS_COUNT / empty_registers_count)
+    return round(estimation)
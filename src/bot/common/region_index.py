@@ -0,0 +1,31 @@
+import json
+from typing import Dict, List
+
+REGIONS_FILE_PATH: str = "resources/regions.json"
+UNKNOWN_REGION_CODE: str = "-1"
+
+
+class RegionIndex:
+    def __init__(self):
+        self.region_codes: Dict[str, str] = {}
+
+    def load(self, regions_info: List[dict]):
+        region_codes: Dict[str, str] = {}
+        for region in regions_info:
+            for post_code_prefix in region["post"]:
+                # some prefixes belong to several regions, the first one wins as it was in the db lookup
+                region_codes.setdefault(post_code_prefix, str(region["code"]))
+        # the index is replaced at once, so the lookups never see a partially built index
+        self.region_codes = region_codes
+
+    def load_file(self, file_path: str = REGIONS_FILE_PATH):
+        with open(file_path) as regions_file:
+            regions_info: List[dict] = json.load(regions_file)
+            self.load(regions_info)
+
+    def get_region_code(self, post_code: str) -> str:
+        post_code_prefix: str = post_code[:3]
+        return self.region_codes.get(post_code_prefix, UNKNOWN_REGION_CODE)
+
+
+region_index: RegionIndex = RegionIndex()
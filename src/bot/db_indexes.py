@@ -0,0 +1,152 @@
+import logging
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional, Iterable, Tuple, Any
+
+import pytz
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from repository import AsyncRepository, CURRENT_CLAIM_SORT
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "claim-data": [
+        IndexModel([("user_id", ASCENDING), ("claim_theme", ASCENDING)], name="user_id_claim_theme", unique=True),
+        # the current claim of the user, see CURRENT_CLAIM_SORT
+        # the progress is included, so the parts keyboard is rendered from the index only
+        IndexModel([("user_id", ASCENDING), ("chosen", DESCENDING), ("_id", DESCENDING), ("progress", ASCENDING)],
+                   name="user_id_chosen"),
+        # used by clear_db_daemon
+        IndexModel([("created", ASCENDING)], name="created")
+    ],
+    "statistics": [
+        IndexModel([("date", ASCENDING), ("user", ASCENDING)], name="date_user", unique=True)
+    ],
+    "statistics-rollups": [
+        IndexModel([("period", ASCENDING), ("date", ASCENDING)], name="period_date", unique=True)
+    ],
+    "fsm-states": [
+        # used by clear_db_daemon
+        IndexModel([("updated", ASCENDING)], name="updated")
+    ],
+    "regions": [
+        # used by db_seed, the region codes are looked up by common.region_index
+        IndexModel([("name", ASCENDING)], name="name")
+    ],
+    "claim-tmps": [
+        IndexModel([("theme", ASCENDING)], name="theme", unique=True)
+    ],
+    "claim-tmps-history": [
+        IndexModel([("theme", ASCENDING), ("version", ASCENDING)], name="theme_version", unique=True)
+    ]
+}
+
+# the indexes which are replaced by the other ones
+OBSOLETE_INDEXES: Dict[str, List[str]] = {
+    # the statistics were stored by the day
+    "statistics": ["date"],
+    # the region codes were looked up in the db
+    "regions": ["post"]
+}
+
+HotQuery = namedtuple("HotQuery", ["name", "collection_name", "find_filter", "sort", "index_name"])
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("get_claim_data", "claim-data", {"user_id": 0}, CURRENT_CLAIM_SORT, "user_id_chosen"),
+    HotQuery("get_claim_data by theme", "claim-data", {"user_id": 0, "claim_theme": ""}, CURRENT_CLAIM_SORT,
+             "user_id_claim_theme"),
+    HotQuery("clear_db_daemon", "claim-data", {"created": {"$lt": datetime(1970, 1, 1, tzinfo=pytz.UTC)}}, None,
+             "created"),
+    HotQuery("clear_db_daemon fsm-states", "fsm-states",
+             {"updated": {"$lt": datetime(1970, 1, 1, tzinfo=pytz.UTC)}}, None, "updated"),
+    HotQuery("count_statistics_event", "statistics", {"date": datetime(1970, 1, 1, tzinfo=pytz.UTC), "user": ""}, None,
+             "date_user"),
+    HotQuery("get_statistics_rollups", "statistics-rollups",
+             {"$or": [{"period": "month", "date": {"$in": [datetime(1970, 1, 1, tzinfo=pytz.UTC)]}},
+                      {"period": "day", "date": {"$in": [datetime(1970, 2, 1, tzinfo=pytz.UTC)]}}]},
+             None, "period_date"),
+    HotQuery("get_claim_tmp", "claim-tmps", {"theme": ""}, None, "theme")
+]
+
+
+def get_plan_index_names(plan: dict) -> List[str]:
+    index_names: List[str] = []
+    if plan.get("stage") == "IXSCAN":
+        index_names.append(plan["indexName"])
+    if "inputStage" in plan.keys():
+        index_names.extend(get_plan_index_names(plan["inputStage"]))
+    for input_stage in plan.get("inputStages", []):
+        index_names.extend(get_plan_index_names(input_stage))
+    return index_names
+
+
+def get_index_keys(keys: Iterable[Tuple[str, Any]]) -> List[Tuple[str, Any]]:
+    # the server can return the direction as float
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in keys]
+
+
+async def drop_changed_indexes(repository: AsyncRepository, collection_name: str, indexes: List[IndexModel]):
+    # the obsolete indexes are dropped and an existing index with the same name and other keys or options
+    # (e.g. not unique) must be rebuilt
+    logger = logging.getLogger("DB_INDEXES")
+    index_information: dict = await repository.get_index_information(collection_name)
+    for index_name in OBSOLETE_INDEXES.get(collection_name, []):
+        if index_name in index_information.keys():
+            logger.warning(f"Index '{index_name}' of '{collection_name}' is obsolete, it will be dropped.")
+            await repository.drop_index(collection_name, index_name)
+
+    for index in indexes:
+        existing_index: Optional[dict] = index_information.get(index.document["name"])
+        if existing_index is None:
+            continue
+
+        if get_index_keys(existing_index["key"]) != get_index_keys(index.document["key"].items()) or \
+                existing_index.get("unique", False) != index.document.get("unique", False):
+            logger.warning(f"Index '{index.document['name']}' of '{collection_name}' is changed, it will be rebuilt.")
+            await repository.drop_index(collection_name, index.document["name"])
+
+
+async def ensure_indexes(repository: AsyncRepository):
+    logger = logging.getLogger("DB_INDEXES")
+    # the unique claim key can't be built while there are duplicates
+    removed_count: int = await repository.remove_claim_duplicates()
+    if removed_count > 0:
+        logger.warning(f"Removed {removed_count} duplicate claims.")
+
+    for collection_name, indexes in INDEXES.items():
+        await drop_changed_indexes(repository, collection_name, indexes)
+        try:
+            await repository.create_indexes(collection_name, indexes)
+        except OperationFailure as ex:
+            # e.g. the unique index can't be built while the collection contains duplicates
+            logger.error(f"Failed to create indexes for '{collection_name}': {ex}")
+
+        existing_index_names: List[str] = await repository.get_index_names(collection_name)
+        missing_index_names: List[str] = [index.document["name"] for index in indexes
+                                          if index.document["name"] not in existing_index_names]
+        if any(missing_index_names):
+            logger.error(f"Collection '{collection_name}' has no indexes: {', '.join(missing_index_names)}.")
+        else:
+            logger.info(f"Collection '{collection_name}' indexes are verified.")
+
+
+async def report_hot_queries(repository: AsyncRepository) -> Dict[str, Optional[str]]:
+    logger = logging.getLogger("DB_INDEXES")
+    report: Dict[str, Optional[str]] = {}
+    for query in HOT_QUERIES:
+        try:
+            explanation: dict = await repository.explain_find(query.collection_name, query.find_filter, query.sort)
+        except Exception:
+            # the report is only diagnostics, it must not break the bot start
+            logger.exception(f"Failed to explain query '{query.name}'")
+            continue
+
+        index_names: List[str] = get_plan_index_names(explanation["queryPlanner"]["winningPlan"])
+        used_index_name: Optional[str] = index_names[0] if any(index_names) else None
+        report[query.name] = used_index_name
+        if query.index_name in index_names:
+            logger.info(f"Query '{query.name}' on '{query.collection_name}' uses index '{query.index_name}'.")
+        else:
+            logger.warning(f"Query '{query.name}' on '{query.collection_name}' doesn't use index "
+                           f"'{query.index_name}', winning plan index: {used_index_name}.")
+    return report
@@ -0,0 +1,83 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, List, Tuple, Any
+
+import pytz
+from pymongo import ReplaceOne, DeleteMany, UpdateOne
+
+from claim_tmp_cache import get_claim_tmp_version
+from common.region_index import REGIONS_FILE_PATH
+from repository import AsyncRepository
+
+CLAIM_TMPS_PATTERN: str = "resources/claim_templates/*.json"
+
+
+def load_seed_file(path: str) -> Tuple[str, Any]:
+    # the version of the seed is the hash of the file content
+    with open(path, "rb") as seed_file:
+        content: bytes = seed_file.read()
+    return hashlib.sha256(content).hexdigest()[:16], json.loads(content.decode())
+
+
+def get_claim_tmp_requests(claim_tmps: List[dict]) -> List[ReplaceOne]:
+    return [ReplaceOne({"theme": claim_tmp["theme"]}, claim_tmp, upsert=True) for claim_tmp in claim_tmps]
+
+
+def get_claim_tmp_history_requests(claim_tmps: List[dict]) -> List[ReplaceOne]:
+    # the claims refer to the options of the template version, so all the seeded versions are kept
+    return [ReplaceOne({"theme": claim_tmp["theme"], "version": claim_tmp["version"]}, claim_tmp, upsert=True)
+            for claim_tmp in claim_tmps]
+
+
+def get_regions_requests(regions: List[dict]) -> List[Any]:
+    requests: List[Any] = [ReplaceOne({"name": region["name"]}, region, upsert=True) for region in regions]
+    requests.append(DeleteMany({"name": {"$nin": [region["name"] for region in regions]}}))
+    return requests
+
+
+async def seed_db(repository: AsyncRepository) -> Dict[str, str]:
+    # Only the changed seed files are written to the db, so the start is fast when nothing is changed.
+    # Returns the seeded versions by the seed name.
+    logger = logging.getLogger("DB_SEED")
+    seed_versions: Dict[str, str] = await repository.get_seed_versions()
+    seeded_versions: Dict[str, str] = {}
+
+    changed_claim_tmps: List[dict] = []
+    for path in sorted(glob.glob(CLAIM_TMPS_PATTERN)):
+        seed_name: str = f"claim_templates/{os.path.basename(path)}"
+        version, claim_tmp = load_seed_file(path)
+        if seed_versions.get(seed_name) == version:
+            continue
+
+        # the version is used by the templates cache, see get_claim_tmp_version
+        claim_tmp["version"] = version
+        changed_claim_tmps.append(claim_tmp)
+        seeded_versions[seed_name] = version
+
+    if any(changed_claim_tmps):
+        # the stored versions are kept too, they could be seeded before the history or without the version field
+        stored_claim_tmps: List[dict] = [{**claim_tmp, "version": get_claim_tmp_version(claim_tmp)}
+                                         for claim_tmp in await repository.get_claim_tmps()]
+        await repository.bulk_write("claim-tmps-history",
+                                    get_claim_tmp_history_requests(stored_claim_tmps + changed_claim_tmps))
+        await repository.bulk_write("claim-tmps", get_claim_tmp_requests(changed_claim_tmps))
+
+    regions_version, regions = load_seed_file(REGIONS_FILE_PATH)
+    if seed_versions.get("regions.json") != regions_version:
+        await repository.bulk_write("regions", get_regions_requests(regions))
+        seeded_versions["regions.json"] = regions_version
+
+    if any(seeded_versions):
+        now: datetime = datetime.now(tz=pytz.UTC)
+        await repository.bulk_write("seed-versions", [
+            UpdateOne({"_id": seed_name}, {"$set": {"version": version, "seeded": now}}, upsert=True)
+            for seed_name, version in seeded_versions.items()
+        ])
+        logger.info(f"Seeded: {seeded_versions}.")
+    else:
+        logger.info("Seed data is up to date.")
+    return seeded_versions
@@ -0,0 +1,223 @@
+import json
+import zlib
+from collections.abc import MutableMapping
+from typing import Dict, Set, List, Optional, Tuple, Any, Iterator
+
+from cryptography.fernet import InvalidToken
+
+from field_cipher import FieldCipher, EncryptedValue, AES_GCM_CIPHER, FIELD_CIPHERS, create_field_cipher
+
+SENSITIVE_FIELDS: Set[str] = {"user_name", "user_post_code", "chosen_city", "chosen_street", "house_chosen",
+                              "apartment_chosen"}
+# the sensitive fields of a section are stored together in this field in the envelope mode
+SEALED_FIELD: str = "_sealed"
+
+ENVELOPE_MODE: str = "envelope"
+FIELD_MODE: str = "field"
+ENCRYPTION_MODES: Set[str] = {ENVELOPE_MODE, FIELD_MODE}
+
+# the first byte of a sealed payload
+RAW_PAYLOAD: bytes = b"j"
+COMPRESSED_PAYLOAD: bytes = b"z"
+
+# the plain values are always text, the encrypted ones are text or binary depending on the cipher
+ENCRYPTED_TYPES: Tuple[type, ...] = (str, bytes)
+
+
+# The data is always encrypted with the newest key and the configured cipher. The old keys and the other ciphers are
+# only used for decryption until all the documents are re-encrypted, see key_rotation.
+class DataEncryptor:
+    def __init__(self, keys: List[str], mode: str = ENVELOPE_MODE, cipher_name: str = AES_GCM_CIPHER):
+        if mode not in ENCRYPTION_MODES:
+            raise ValueError(f"Unknown encryption mode '{mode}'.")
+
+        self.keys_count: int = len(keys)
+        self.ciphers: List[FieldCipher] = [create_field_cipher(name, key) for name in FIELD_CIPHERS.keys()
+                                           for key in keys]
+        self.cipher: FieldCipher = create_field_cipher(cipher_name, keys[0])
+        self.mode: str = mode
+        self.crypto_calls: int = 0
+        # see LazyDecryptedDict
+        self.lazy_stats: Dict[str, int] = {
+            "deferred": 0,
+            "decrypted": 0
+        }
+
+    def _decrypt_token(self, token: EncryptedValue) -> Tuple[bytes, bool]:
+        # returns the payload and whether it was encrypted with an old key or another cipher
+        ciphers: List[FieldCipher] = [cipher for cipher in self.ciphers if cipher.is_key_value(token)]
+        for index, cipher in enumerate(ciphers):
+            self.crypto_calls += 1
+            try:
+                payload: bytes = cipher.decrypt(token)
+            except InvalidToken:
+                if index == len(ciphers) - 1:
+                    raise
+                continue
+            return payload, cipher.name != self.cipher.name or cipher.key_id != self.cipher.key_id
+        raise InvalidToken()
+
+    def encrypt(self, value: str) -> EncryptedValue:
+        self.crypto_calls += 1
+        return self.cipher.encrypt(value.encode())
+
+    def decrypt(self, value: EncryptedValue) -> str:
+        return self._decrypt_token(value)[0].decode()
+
+    def seal(self, fields: Dict[str, str]) -> EncryptedValue:
+        payload: bytes = json.dumps(fields, ensure_ascii=False, separators=(",", ":")).encode()
+        compressed_payload: bytes = zlib.compress(payload, 9)
+        # short values are not always compressible, so the smaller variant is stored
+        if len(compressed_payload) < len(payload):
+            payload = COMPRESSED_PAYLOAD + compressed_payload
+        else:
+            payload = RAW_PAYLOAD + payload
+
+        self.crypto_calls += 1
+        return self.cipher.encrypt(payload)
+
+    def unseal(self, token: EncryptedValue) -> Dict[str, str]:
+        return self._unseal(token)[0]
+
+    def _unseal(self, token: EncryptedValue) -> Tuple[Dict[str, str], bool]:
+        payload, is_old_key = self._decrypt_token(token)
+        if payload[:1] == COMPRESSED_PAYLOAD:
+            return json.loads(zlib.decompress(payload[1:]).decode()), is_old_key
+        return json.loads(payload[1:].decode()), is_old_key
+
+    def encrypt_data(self, data: dict) -> dict:
+        # the data is encrypted in place
+        sensitive_values: Dict[str, str] = {}
+        for key, value in data.items():
+            if key in SENSITIVE_FIELDS and isinstance(value, str):
+                sensitive_values[key] = value
+            if isinstance(value, dict):
+                self.encrypt_data(value)
+
+        if not sensitive_values:
+            return data
+
+        if self.mode == ENVELOPE_MODE:
+            for key in sensitive_values.keys():
+                del data[key]
+            data[SEALED_FIELD] = self.seal(sensitive_values)
+        else:
+            for key, value in sensitive_values.items():
+                data[key] = self.encrypt(value)
+        return data
+
+    def decrypt_data(self, data: dict) -> dict:
+        self.decrypt_and_check(data)
+        return data
+
+    def decrypt_and_check(self, data: dict) -> bool:
+        # Decrypts the data in place and returns True if it should be re-encrypted: some value was encrypted with an
+        # old key or another cipher or is stored in the format of the other mode. Both formats are supported, so the
+        # documents written before the envelope mode are still readable.
+        is_stale: bool = False
+        for key, value in list(data.items()):
+            if key == SEALED_FIELD and isinstance(value, ENCRYPTED_TYPES):
+                del data[key]
+                sensitive_values, is_old_key = self._unseal(value)
+                data.update(sensitive_values)
+                is_stale = is_stale or is_old_key or self.mode != ENVELOPE_MODE
+            elif key in SENSITIVE_FIELDS and isinstance(value, ENCRYPTED_TYPES):
+                payload, is_old_key = self._decrypt_token(value)
+                data[key] = payload.decode()
+                is_stale = is_stale or is_old_key or self.mode != FIELD_MODE
+            elif isinstance(value, dict):
+                is_stale = self.decrypt_and_check(value) or is_stale
+        return is_stale
+
+    def may_be_stale(self, data: dict) -> bool:
+        # the old keys can be detected only by the decryption, the other mode and cipher are seen without it
+        if self.keys_count > 1:
+            return True
+        for key, value in data.items():
+            if (key == SEALED_FIELD or key in SENSITIVE_FIELDS) and isinstance(value, ENCRYPTED_TYPES) and \
+                    not self.cipher.is_cipher_value(value):
+                return True
+            if self.mode == ENVELOPE_MODE and key in SENSITIVE_FIELDS and isinstance(value, ENCRYPTED_TYPES):
+                return True
+            if self.mode == FIELD_MODE and key == SEALED_FIELD and isinstance(value, ENCRYPTED_TYPES):
+                return True
+            if isinstance(value, dict) and self.may_be_stale(value):
+                return True
+        return False
+
+    def decrypt_lazily(self, data: dict) -> "LazyDecryptedDict":
+        self.lazy_stats["deferred"] += get_encrypted_values_count(data)
+        return LazyDecryptedDict(data, self)
+
+    def get_lazy_stats(self) -> Dict[str, int]:
+        return {**self.lazy_stats, "avoided": self.lazy_stats["deferred"] - self.lazy_stats["decrypted"]}
+
+
+def get_encrypted_values_count(data: dict) -> int:
+    count: int = 0
+    for key, value in data.items():
+        if (key == SEALED_FIELD or key in SENSITIVE_FIELDS) and isinstance(value, ENCRYPTED_TYPES):
+            count += 1
+        elif isinstance(value, dict):
+            count += get_encrypted_values_count(value)
+    return count
+
+
+# A view of the encrypted document. The sensitive values are decrypted only when they are accessed, e.g. reading
+# claim_theme or a story value doesn't decrypt anything. The sealed fields of a section are decrypted together.
+class LazyDecryptedDict(MutableMapping):
+    def __init__(self, data: dict, encryptor: DataEncryptor):
+        self._data: dict = data
+        self._encryptor: DataEncryptor = encryptor
+        self._encrypted_keys: Set[str] = {key for key, value in data.items()
+                                          if key in SENSITIVE_FIELDS and isinstance(value, ENCRYPTED_TYPES)}
+        self._sealed: Optional[EncryptedValue] = data.pop(SEALED_FIELD) \
+            if isinstance(data.get(SEALED_FIELD), ENCRYPTED_TYPES) else None
+
+    def _unseal(self):
+        if self._sealed is None:
+            return
+
+        sensitive_values: Dict[str, str] = self._encryptor.unseal(self._sealed)
+        self._encryptor.lazy_stats["decrypted"] += 1
+        self._sealed = None
+        for key, value in sensitive_values.items():
+            # the value which is set after the load is kept
+            self._data.setdefault(key, value)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._data and key in SENSITIVE_FIELDS:
+            self._unseal()
+
+        value: Any = self._data[key]
+        if key in self._encrypted_keys:
+            value = self._encryptor.decrypt(value)
+            self._encryptor.lazy_stats["decrypted"] += 1
+            self._encrypted_keys.discard(key)
+            self._data[key] = value
+        elif isinstance(value, dict):
+            value = LazyDecryptedDict(value, self._encryptor)
+            self._data[key] = value
+        return value
+
+    def __setitem__(self, key: str, value: Any):
+        self._data[key] = value
+        self._encrypted_keys.discard(key)
+
+    def __delitem__(self, key: str):
+        self._unseal()
+        del self._data[key]
+        self._encrypted_keys.discard(key)
+
+    def __contains__(self, key: object) -> bool:
+        if key not in self._data and key in SENSITIVE_FIELDS:
+            self._unseal()
+        return key in self._data
+
+    def __iter__(self) -> Iterator[str]:
+        self._unseal()
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        self._unseal()
+        return len(self._data)
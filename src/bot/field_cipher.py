@@ -0,0 +1,130 @@
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, Union, Type
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+FERNET_CIPHER: str = "fernet"
+AES_GCM_CIPHER: str = "aes-gcm"
+CHACHA20_POLY1305_CIPHER: str = "chacha20-poly1305"
+
+# Fernet values are stored as text and have no prefix. The values of the other ciphers are stored as binary:
+# format version (1 byte) + key id (4 bytes) + nonce (12 bytes) + ciphertext with the tag.
+KEY_ID_SIZE: int = 4
+NONCE_SIZE: int = 12
+HEADER_SIZE: int = 1 + KEY_ID_SIZE + NONCE_SIZE
+
+EncryptedValue = Union[str, bytes]
+
+
+def get_key_id(key: str) -> bytes:
+    return hashlib.sha256(key.encode()).digest()[:KEY_ID_SIZE]
+
+
+class FieldCipher(ABC):
+    name: str
+
+    def __init__(self, key: str):
+        self.key_id: bytes = get_key_id(key)
+
+    @abstractmethod
+    def encrypt(self, payload: bytes) -> EncryptedValue:
+        pass
+
+    @abstractmethod
+    def decrypt(self, value: EncryptedValue) -> bytes:
+        pass
+
+    @abstractmethod
+    def is_cipher_value(self, value: EncryptedValue) -> bool:
+        pass
+
+    @abstractmethod
+    def is_key_value(self, value: EncryptedValue) -> bool:
+        pass
+
+
+class FernetCipher(FieldCipher):
+    name: str = FERNET_CIPHER
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        self.fernet: Fernet = Fernet(key)
+
+    def encrypt(self, payload: bytes) -> EncryptedValue:
+        return self.fernet.encrypt(payload).decode()
+
+    def decrypt(self, value: EncryptedValue) -> bytes:
+        return self.fernet.decrypt(value.encode())
+
+    def is_cipher_value(self, value: EncryptedValue) -> bool:
+        return isinstance(value, str)
+
+    def is_key_value(self, value: EncryptedValue) -> bool:
+        # the key of the fernet token is known only after the decryption
+        return self.is_cipher_value(value)
+
+
+class AeadCipher(FieldCipher):
+    version: int
+    aead_type: Type
+
+    def __init__(self, key: str):
+        super().__init__(key)
+        # the 256 bits key is derived from the fernet key, so the same ENCRYPT_KEY is used by all the ciphers
+        aead_key: bytes = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                               info=f"claimant {self.name}".encode()).derive(key.encode())
+        self.aead = self.aead_type(aead_key)
+        self.header_prefix: bytes = bytes([self.version]) + self.key_id
+
+    def encrypt(self, payload: bytes) -> EncryptedValue:
+        nonce: bytes = os.urandom(NONCE_SIZE)
+        # the header is authenticated, so the version and the key id can't be replaced
+        header: bytes = self.header_prefix + nonce
+        return header + self.aead.encrypt(nonce, payload, header)
+
+    def decrypt(self, value: EncryptedValue) -> bytes:
+        if not self.is_key_value(value):
+            raise InvalidToken()
+
+        header: bytes = value[:HEADER_SIZE]
+        try:
+            return self.aead.decrypt(header[-NONCE_SIZE:], value[HEADER_SIZE:], header)
+        except InvalidTag:
+            raise InvalidToken()
+
+    def is_cipher_value(self, value: EncryptedValue) -> bool:
+        return isinstance(value, bytes) and value[:1] == self.header_prefix[:1]
+
+    def is_key_value(self, value: EncryptedValue) -> bool:
+        return isinstance(value, bytes) and value[:1 + KEY_ID_SIZE] == self.header_prefix
+
+
+class AesGcmCipher(AeadCipher):
+    name: str = AES_GCM_CIPHER
+    version: int = 1
+    aead_type: Type = AESGCM
+
+
+class ChaCha20Poly1305Cipher(AeadCipher):
+    name: str = CHACHA20_POLY1305_CIPHER
+    version: int = 2
+    aead_type: Type = ChaCha20Poly1305
+
+
+FIELD_CIPHERS: Dict[str, Type[FieldCipher]] = {
+    FERNET_CIPHER: FernetCipher,
+    AES_GCM_CIPHER: AesGcmCipher,
+    CHACHA20_POLY1305_CIPHER: ChaCha20Poly1305Cipher
+}
+
+
+def create_field_cipher(name: str, key: str) -> FieldCipher:
+    if name not in FIELD_CIPHERS:
+        raise ValueError(f"Unknown field cipher '{name}'.")
+    return FIELD_CIPHERS[name](key)
@@ -0,0 +1,435 @@
+import asyncio
+import copy
+import logging
+import time
+import typing
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Set, Any, List, Callable
+
+import bson
+import pytz
+from aiogram.dispatcher.storage import BaseStorage
+from cryptography.fernet import InvalidToken
+from pymongo import ReplaceOne, DeleteOne
+
+from common import CourtInfo
+from repository import AsyncRepository
+
+# the types of the values, which are stored in the FSM data besides the BSON ones
+FSM_TYPES: Dict[str, type] = {
+    "CourtInfo": CourtInfo
+}
+
+
+def encode_fsm_value(value: Any) -> Any:
+    for type_name, value_type in FSM_TYPES.items():
+        if isinstance(value, value_type):
+            return {"_type": type_name, "_fields": [encode_fsm_value(field) for field in value]}
+    if isinstance(value, dict):
+        return {key: encode_fsm_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_fsm_value(item) for item in value]
+    return value
+
+
+def decode_fsm_value(value: Any) -> Any:
+    if isinstance(value, dict) and value.get("_type") in FSM_TYPES.keys():
+        return FSM_TYPES[value["_type"]](*[decode_fsm_value(field) for field in value["_fields"]])
+    if isinstance(value, dict):
+        return {key: decode_fsm_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode_fsm_value(item) for item in value]
+    return value
+
+
+def get_empty_record() -> dict:
+    return {"state": None, "data": {}, "bucket": {}}
+
+
+# the approximate memory of an entry besides the encoded values: the key, the entry object and the dict slot
+ENTRY_OVERHEAD_BYTES: int = 250
+
+
+class BoundedMemoryEntry:
+    __slots__ = ("state", "data", "bucket", "accessed_at")
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        # the data and the bucket are kept encoded as BSON, it's several times less than the dicts
+        self.data: Optional[bytes] = None
+        self.bucket: Optional[bytes] = None
+        self.accessed_at: float = 0
+
+    def get_size(self) -> int:
+        return ENTRY_OVERHEAD_BYTES + len(self.state or "") + len(self.data or b"") + len(self.bucket or b"")
+
+
+def encode_fsm_dict(value: Optional[dict]) -> Optional[bytes]:
+    return bson.encode(encode_fsm_value(value)) if value else None
+
+
+def decode_fsm_dict(value: Optional[bytes]) -> dict:
+    return decode_fsm_value(bson.decode(value)) if value is not None else {}
+
+
+# FSM storage in memory, which doesn't grow with the number of the users. The states, which aren't accessed for the TTL,
+# and the least recently used states over the size limit are evicted, so the user of the evicted state starts again.
+class BoundedMemoryStorage(BaseStorage):
+    def __init__(self, ttl_sec: float = 2 * 3600, max_bytes: int = 64 * 1024 * 1024,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_sec: float = ttl_sec
+        self.max_bytes: int = max_bytes
+        self.clock: Callable[[], float] = clock
+        # the least recently used entries go first
+        self.entries: "OrderedDict[str, BoundedMemoryEntry]" = OrderedDict()
+        self.size_bytes: int = 0
+        self.stats: Dict[str, int] = {
+            "expired": 0,
+            "evicted": 0
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"entries": len(self.entries), "bytes": self.size_bytes, **self.stats}
+
+    def _get_key(self, chat: typing.Union[str, int, None], user: typing.Union[str, int, None]) -> str:
+        chat, user = self.check_address(chat=chat, user=user)
+        return f"{chat}:{user}"
+
+    def _get_entry(self, key: str) -> Optional[BoundedMemoryEntry]:
+        self._expire()
+        entry: Optional[BoundedMemoryEntry] = self.entries.get(key)
+        if entry is not None:
+            entry.accessed_at = self.clock()
+            self.entries.move_to_end(key)
+        return entry
+
+    def _expire(self):
+        # the entries are ordered by the access time, so only the expired ones are checked
+        expired_at: float = self.clock() - self.ttl_sec
+        while any(self.entries) and next(iter(self.entries.values())).accessed_at < expired_at:
+            _, entry = self.entries.popitem(last=False)
+            self.size_bytes -= entry.get_size()
+            self.stats["expired"] += 1
+
+    def _update_entry(self, key: str, **values):
+        entry: Optional[BoundedMemoryEntry] = self._get_entry(key)
+        if entry is None:
+            entry = BoundedMemoryEntry()
+        else:
+            self.size_bytes -= entry.get_size()
+            del self.entries[key]
+
+        for name, value in values.items():
+            setattr(entry, name, value)
+        if entry.state is None and entry.data is None and entry.bucket is None:
+            return
+
+        entry.accessed_at = self.clock()
+        self.entries[key] = entry
+        self.size_bytes += entry.get_size()
+        # the updated entry is the last one, so it's evicted only if it alone exceeds the limit
+        while self.size_bytes > self.max_bytes and any(self.entries):
+            _, evicted_entry = self.entries.popitem(last=False)
+            self.size_bytes -= evicted_entry.get_size()
+            self.stats["evicted"] += 1
+
+    async def close(self):
+        self.entries.clear()
+        self.size_bytes = 0
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        entry: Optional[BoundedMemoryEntry] = self._get_entry(self._get_key(chat, user))
+        return entry.state if entry is not None and entry.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        entry: Optional[BoundedMemoryEntry] = self._get_entry(self._get_key(chat, user))
+        return decode_fsm_dict(entry.data if entry is not None else None)
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        self._update_entry(self._get_key(chat, user), state=self.resolve_state(state))
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        self._update_entry(self._get_key(chat, user), data=encode_fsm_dict(data))
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        current_data: dict = await self.get_data(chat=chat, user=user)
+        current_data.update(data if data is not None else {}, **kwargs)
+        await self.set_data(chat=chat, user=user, data=current_data)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        entry: Optional[BoundedMemoryEntry] = self._get_entry(self._get_key(chat, user))
+        return decode_fsm_dict(entry.bucket if entry is not None else None)
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        self._update_entry(self._get_key(chat, user), bucket=encode_fsm_dict(bucket))
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        current_bucket: dict = await self.get_bucket(chat=chat, user=user)
+        current_bucket.update(bucket if bucket is not None else {}, **kwargs)
+        await self.set_bucket(chat=chat, user=user, bucket=current_bucket)
+
+
+# FSM storage, which keeps the states in memory and writes the changed ones to the db in the background. The changes of
+# a user made between the flushes are written by one request. The states, which are not in memory (e.g. after
+# a restart), are loaded from the db on the first access. The sensitive fields of the data are encrypted in the db.
+# The states are written with the update time, so the abandoned ones are removed by clear_db_daemon with claim-data.
+# The cached states aren't invalidated and a flush replaces the whole document, so the states of a user must be served
+# by one process: the bot runs as a single process (or the updates of a user are always routed to the same one).
+class MongoWriteBehindStorage(BaseStorage):
+    def __init__(self, flush_interval_sec: float = 1, lifetime_sec: float = 2 * 3600,
+                 repository: Optional[AsyncRepository] = None):
+        self.flush_interval_sec: float = flush_interval_sec
+        # the states, which aren't accessed for this time, are dropped from memory
+        self.lifetime_sec: float = lifetime_sec
+        self.repository: AsyncRepository = repository if repository is not None else AsyncRepository()
+        self.records: Dict[str, dict] = {}
+        self.accessed_at: Dict[str, float] = {}
+        self.dirty_keys: Set[str] = set()
+        self.flush_requested: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.is_closing: bool = False
+        self.logger = logging.getLogger("FSM_STORAGE")
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "written": 0,
+            "flushes": 0,
+            "failed": 0,
+            "evicted": 0,
+            "undecryptable": 0
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.stats, "cached": len(self.records), "dirty": len(self.dirty_keys)}
+
+    def _get_key(self, chat: typing.Union[str, int, None], user: typing.Union[str, int, None]) -> str:
+        chat, user = self.check_address(chat=chat, user=user)
+        return f"{chat}:{user}"
+
+    async def _get_record(self, key: str) -> dict:
+        self.accessed_at[key] = time.monotonic()
+        record: Optional[dict] = self.records.get(key)
+        if record is not None:
+            self.stats["hits"] += 1
+            return record
+
+        self.stats["misses"] += 1
+        document: Optional[dict] = await self.repository.get_fsm_record(key)
+        # the record could be loaded or changed by another update in the meantime
+        if key in self.records.keys():
+            return self.records[key]
+
+        record = get_empty_record()
+        self.records[key] = record
+        if document is None:
+            return record
+
+        try:
+            # the document is decrypted as a whole, like it's done by the key rotation sweep
+            self.repository.decrypt_data(document)
+        except InvalidToken:
+            # e.g. the key was removed before the sweep, the chat starts again instead of failing on every update
+            self.stats["undecryptable"] += 1
+            self.logger.error(f"Failed to decrypt FSM state {key}, it's reset.")
+            self._mark_dirty(key)
+            return record
+
+        record["state"] = document.get("state")
+        record["data"] = decode_fsm_value(document.get("data", {}))
+        record["bucket"] = decode_fsm_value(document.get("bucket", {}))
+        return record
+
+    def _mark_dirty(self, key: str):
+        self.dirty_keys.add(key)
+        if self.task is None and not self.is_closing:
+            self.flush_requested = asyncio.Event()
+            self.task = asyncio.ensure_future(self._run())
+
+    def _get_document(self, key: str, record: dict) -> dict:
+        chat, user = key.split(":")
+        # the values are encrypted in place, the encoding makes the new dicts, so the cached data isn't affected
+        return self.repository.encrypt_data({
+            "_id": key,
+            "chat": chat,
+            "user": user,
+            "state": record["state"],
+            "data": encode_fsm_value(record["data"]),
+            "bucket": encode_fsm_value(record["bucket"]),
+            "updated": datetime.utcnow().replace(tzinfo=pytz.UTC)
+        })
+
+    async def _run(self):
+        while not self.is_closing:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.flush_interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+            self._evict()
+
+    def _evict(self):
+        expired_at: float = time.monotonic() - self.lifetime_sec
+        for key, accessed_at in list(self.accessed_at.items()):
+            if accessed_at < expired_at and key not in self.dirty_keys:
+                self.records.pop(key, None)
+                del self.accessed_at[key]
+                self.stats["evicted"] += 1
+
+    async def flush(self):
+        if not any(self.dirty_keys):
+            return
+
+        keys: List[str] = list(self.dirty_keys)
+        self.dirty_keys.clear()
+        requests: List[Any] = []
+        for key in keys:
+            record: Optional[dict] = self.records.get(key)
+            if record is None or record == get_empty_record():
+                requests.append(DeleteOne({"_id": key}))
+            else:
+                requests.append(ReplaceOne({"_id": key}, self._get_document(key, record), upsert=True))
+
+        try:
+            await self.repository.bulk_write("fsm-states", requests)
+        except Exception:
+            # the states are written by the next flush, unless they are changed again
+            self.dirty_keys.update(keys)
+            self.stats["failed"] += 1
+            self.logger.exception(f"Failed to write {len(keys)} FSM states")
+            return
+
+        self.stats["written"] += len(keys)
+        self.stats["flushes"] += 1
+
+    async def close(self):
+        self.is_closing = True
+        if self.task is not None:
+            self.flush_requested.set()
+            await self.task
+            self.task = None
+        # the rest of the changes must not be lost on shutdown
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record: dict = await self._get_record(self._get_key(chat, user))
+        state: Optional[str] = record["state"]
+        return state if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[typing.Dict] = None) -> typing.Dict:
+        record: dict = await self._get_record(self._get_key(chat, user))
+        return copy.deepcopy(record["data"])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        key: str = self._get_key(chat, user)
+        record: dict = await self._get_record(key)
+        record["state"] = self.resolve_state(state)
+        self._mark_dirty(key)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        key: str = self._get_key(chat, user)
+        record: dict = await self._get_record(key)
+        record["data"] = copy.deepcopy(data) if data is not None else {}
+        self._mark_dirty(key)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        key: str = self._get_key(chat, user)
+        record: dict = await self._get_record(key)
+        record["data"].update(copy.deepcopy(data) if data is not None else {}, **kwargs)
+        self._mark_dirty(key)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        await self.set_state(chat=chat, user=user, state=None)
+        if with_data:
+            await self.set_data(chat=chat, user=user, data={})
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record: dict = await self._get_record(self._get_key(chat, user))
+        return copy.deepcopy(record["bucket"])
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        key: str = self._get_key(chat, user)
+        record: dict = await self._get_record(key)
+        record["bucket"] = copy.deepcopy(bucket) if bucket is not None else {}
+        self._mark_dirty(key)
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None,
+                            **kwargs):
+        key: str = self._get_key(chat, user)
+        record: dict = await self._get_record(key)
+        record["bucket"].update(copy.deepcopy(bucket) if bucket is not None else {}, **kwargs)
+        self._mark_dirty(key)
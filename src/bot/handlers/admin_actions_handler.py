@@ -1,21 +1,27 @@
-from datetime import datetime
-from typing import List, Optional, Dict
+import os
+import tempfile
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 
 import pytz
 from aiogram import types, Dispatcher
-from dotenv import dotenv_values
 
 import bot_config
-from repository import Repository
+from claim_funnel import claim_funnel, format_latency
+from claim_session import session_stats
+from claim_tmp_cache import claim_tmp_cache
+from common import region_index, HLL_STANDARD_ERROR, estimate_hll_cardinality
+from fsm_storage import MongoWriteBehindStorage, BoundedMemoryStorage
+from key_rotation import rotation_stats
+from repository import AsyncRepository, get_pool_stats
+from statistics import statistics_buffer, get_covering_rollup_keys, merge_rollups, export_statistics, \
+    ALL_USERS_SKETCH
+from statistics_retention import retention_stats, get_compacted_before, get_compacted_range
+from webhook import get_webhook_stats
 
 
 def get_admin_ids() -> List[int]:
-    config: dict = {}
-    if bot_config.ENV == "prod":
-        config = dotenv_values(".env")
-    elif bot_config.ENV == "dev":
-        config = dotenv_values(".env-dev")
-
+    config: dict = bot_config.get_config()
     admin_ids_raw: Optional[str] = config.get("ADMIN_IDS")
     if admin_ids_raw is None:
         return []
@@ -25,24 +31,6 @@ def get_admin_ids() -> List[int]:
     return admin_ids
 
 
-def aggregate_events(stat: List[dict]) -> Dict[datetime, dict]:
-    result = {}
-    stat.sort(key=lambda s: s["date"])
-    for day_stat in stat:
-        date = day_stat["date"]
-        day_agg = {
-            "unique_users": len(day_stat["unique_users"].keys()),
-            "events_count": {}
-        }
-        for user_id_hash, events in day_stat["unique_users"].items():
-            for event, count in events.items():
-                day_agg["events_count"][event] = day_agg["events_count"].get(event, 0) + count
-
-        result[date] = day_agg
-
-    return result
-
-
 async def show_statistics(message: types.Message):
     admin_ids: List[int] = get_admin_ids()
     if message.from_user.id not in admin_ids:
@@ -50,12 +38,14 @@ async def show_statistics(message: types.Message):
         return
 
     arguments = message.get_args()
-    repository: Repository = Repository()
+    repository: AsyncRepository = AsyncRepository()
+    current_date: datetime = datetime.utcnow().replace(tzinfo=pytz.UTC, hour=0, minute=0, second=0, microsecond=0)
+    date_to: datetime = current_date
     if not arguments:
-        stat = repository.get_statistics_slice()
+        date_from: datetime = current_date - timedelta(days=29)
     elif arguments.isdigit():
         day_filter: int = int(arguments)
-        stat = repository.get_statistics_slice(day_filter)
+        date_from = current_date - timedelta(days=day_filter - 1)
     else:
         try:
             date_filter: datetime = datetime.strptime(arguments, "%d.%m.%Y").replace(tzinfo=pytz.UTC)
@@ -63,24 +53,171 @@ async def show_statistics(message: types.Message):
             await message.reply("Пожалуйста, введите дату в формате день.месяц.год. Например: 23.02.2022")
             return
 
-        date_stat = repository.get_statistics(date_filter)
-        if date_stat is None:
-            await message.reply("За данное число не найдено статистики.")
+        date_from = date_to = date_filter
+
+    # the days of the compacted months are counted only by the whole months
+    compacted_before: Optional[datetime] = await get_compacted_before(repository)
+    requested_range: Tuple[datetime, datetime] = (date_from, date_to)
+    date_from, date_to = get_compacted_range(date_from, date_to, compacted_before)
+
+    # the period is read by its day, week and month rollups at once, see statistics.build_statistics_rollups
+    rollups: List[dict] = await repository.get_statistics_rollups(get_covering_rollup_keys(date_from, date_to))
+    if not any(rollups):
+        await message.reply("За данный период не найдено статистики.")
+        return
+
+    # the unique users are estimated by the sketches, see common.hyperloglog
+    events_count, sketches = merge_rollups(rollups)
+    stat_messages: List[str] = [
+        f"Период: {date_from.strftime('%d.%m.%Y')} - {date_to.strftime('%d.%m.%Y')}",
+        f"Уникальных пользователей (±{HLL_STANDARD_ERROR:.2%}): "
+        f"{estimate_hll_cardinality(sketches.get(ALL_USERS_SKETCH, {}))}",
+        "Использованные команды (количество, пользователей):"
+    ]
+    if (date_from, date_to) != requested_range:
+        stat_messages.insert(1, f"Статистика до {compacted_before.strftime('%d.%m.%Y')} хранится только по месяцам, "
+                                f"поэтому период расширен до целых месяцев.")
+    for event, count in sorted(events_count.items(), key=lambda e: (-e[1], e[0])):
+        stat_messages.append(f"{event}: {count}, {estimate_hll_cardinality(sketches.get(event, {}))}")
+    await message.answer("\n".join(stat_messages))
+
+
+async def export_statistics_file(message: types.Message):
+    admin_ids: List[int] = get_admin_ids()
+    if message.from_user.id not in admin_ids:
+        await message.reply("Данная команда доступна только администраторам бота.")
+        return
+
+    try:
+        date_from_arg, date_to_arg = message.get_args().split()
+        date_from: datetime = datetime.strptime(date_from_arg, "%d.%m.%Y").replace(tzinfo=pytz.UTC)
+        date_to: datetime = datetime.strptime(date_to_arg, "%d.%m.%Y").replace(tzinfo=pytz.UTC)
+    except ValueError:
+        await message.reply("Пожалуйста, введите период в формате день.месяц.год. Например: "
+                            "/stats_export 01.01.2022 31.12.2022")
+        return
+
+    if date_from > date_to:
+        await message.reply("Начало периода должно быть не позже его конца.")
+        return
+
+    # the statistics by the user of the compacted months are removed, see statistics_retention
+    compacted_before: Optional[datetime] = await get_compacted_before(AsyncRepository())
+    compacted_note: str = ""
+    if compacted_before is not None and date_from < compacted_before:
+        compacted_note = f"\nСтатистика по пользователям до {compacted_before.strftime('%d.%m.%Y')} удалена при " \
+                         f"сжатии и не выгружается."
+
+    file_name: str = f"statistics_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.csv"
+    # the rows are streamed from the db to the file, so the memory doesn't depend on the period length
+    with tempfile.TemporaryDirectory() as export_dir:
+        export_path: str = os.path.join(export_dir, file_name)
+        with open(export_path, "w", newline="", encoding="utf-8") as export_file:
+            rows_count: int = await export_statistics(AsyncRepository(), date_from, date_to, export_file)
+
+        if rows_count == 0:
+            await message.reply("За данный период не найдено статистики." + compacted_note)
             return
-        else:
-            stat = [date_stat]
-
-    agg_stat: Dict[datetime, dict] = aggregate_events(stat)
-    for day, day_stat in agg_stat.items():
-        stat_messages = [
-            f"Дата: {day.strftime('%d.%m.%Y')}",
-            f"Уникальных пользователей: {day_stat.get('unique_users', 0)}",
-            "Использованные команды:"
+
+        with open(export_path, "rb") as export_file:
+            await message.answer_document(document=types.InputFile(export_file, filename=file_name),
+                                          caption=f"Строк: {rows_count}{compacted_note}",
+                                          disable_content_type_detection=True)
+
+
+async def show_claim_funnel(message: types.Message):
+    admin_ids: List[int] = get_admin_ids()
+    if message.from_user.id not in admin_ids:
+        await message.reply("Данная команда доступна только администраторам бота.")
+        return
+
+    # the steps are measured since the bot start, the latencies are the upper bounds of the histogram buckets
+    report = claim_funnel.get_report()
+    if not any(report):
+        await message.reply("С момента запуска бота заявления еще не заполнялись.")
+        return
+
+    for claim_theme, steps in report.items():
+        stat_messages: List[str] = [
+            f"Шаблон: {claim_theme}",
+            "Этап: начато, завершено, медиана (не более), 90% (не более), среднее"
         ]
-        for event, count in day_stat["events_count"].items():
-            stat_messages.append(f"{event}: {count}")
+        for step, started_count, histogram in steps:
+            stat_messages.append(f"{step}: {started_count}, {histogram.count}, "
+                                 f"{format_latency(histogram.get_percentile(0.5))}, "
+                                 f"{format_latency(histogram.get_percentile(0.9))}, "
+                                 f"{format_latency(histogram.get_mean() if histogram.count > 0 else None)}")
         await message.answer("\n".join(stat_messages))
 
 
+async def show_db_stats(message: types.Message):
+    admin_ids: List[int] = get_admin_ids()
+    if message.from_user.id not in admin_ids:
+        await message.reply("Данная команда доступна только администраторам бота.")
+        return
+
+    stat_messages: List[str] = ["Пул соединений MongoDB:"]
+    for counter, value in get_pool_stats().items():
+        stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Запросы к MongoDB при обработке сообщений:")
+    for counter, value in session_stats.items():
+        stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Кэш шаблонов:")
+    for counter, value in claim_tmp_cache.get_stats().items():
+        stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Буфер статистики:")
+    for counter, value in statistics_buffer.stats.items():
+        stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Архивация статистики:")
+    for counter, value in retention_stats.items():
+        stat_messages.append(f"{counter}: {value}")
+    storage = Dispatcher.get_current().storage
+    if isinstance(storage, (MongoWriteBehindStorage, BoundedMemoryStorage)):
+        stat_messages.append("Хранилище состояний:")
+        for counter, value in storage.get_stats().items():
+            stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Вебхук:")
+    for counter, value in get_webhook_stats().items():
+        stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Отложенная расшифровка данных:")
+    for counter, value in AsyncRepository().encryptor.get_lazy_stats().items():
+        stat_messages.append(f"{counter}: {value}")
+    stat_messages.append("Перешифрование данных:")
+    for counter, value in rotation_stats.items():
+        stat_messages.append(f"{counter}: {value}")
+    await message.answer("\n".join(stat_messages))
+
+
+async def reload_claim_tmps(message: types.Message):
+    admin_ids: List[int] = get_admin_ids()
+    if message.from_user.id not in admin_ids:
+        await message.reply("Данная команда доступна только администраторам бота.")
+        return
+
+    claim_tmp_cache.invalidate()
+    repository: AsyncRepository = AsyncRepository()
+    claim_tmps: List[dict] = await repository.load_claim_tmps()
+    tmp_versions: List[str] = [f"{claim_tmp['theme']}: {claim_tmp_cache.get_version(claim_tmp['theme'])}"
+                               for claim_tmp in claim_tmps]
+    await message.answer("Шаблоны перезагружены:\n" + "\n".join(tmp_versions))
+
+
+async def reload_regions(message: types.Message):
+    admin_ids: List[int] = get_admin_ids()
+    if message.from_user.id not in admin_ids:
+        await message.reply("Данная команда доступна только администраторам бота.")
+        return
+
+    repository: AsyncRepository = AsyncRepository()
+    regions_info: List[dict] = await repository.get_regions()
+    region_index.load(regions_info)
+    await message.answer(f"Регионы перезагружены. Число почтовых префиксов: {len(region_index.region_codes)}")
+
+
 def register_handlers(dp: Dispatcher):
     dp.register_message_handler(show_statistics, commands=["stats"])
+    dp.register_message_handler(export_statistics_file, commands=["stats_export"])
+    dp.register_message_handler(show_claim_funnel, commands=["funnel"])
+    dp.register_message_handler(show_db_stats, commands=["db_stats"])
+    dp.register_message_handler(reload_claim_tmps, commands=["reload_templates"])
+    dp.register_message_handler(reload_regions, commands=["reload_regions"])
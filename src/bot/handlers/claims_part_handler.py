@@ -12,7 +12,8 @@ from common.oof_profit_calculator import OOFCalculation
 from common.payoff_profit_calculator import PayOffCalculation
 from handlers.common_actions_handlers import process_complete_part_editing
 from keyboards import emojis, get_claim_parts_kb
-from repository import Repository
+from claim_funnel import track_claim_step
+from claim_session import ClaimSession
 from statistics import collect_statistic
 
 CLAIM_PART: str = "claims"
@@ -23,19 +24,20 @@ class ClaimsPart(StatesGroup):
 
 
 @collect_statistic(event_name="claims:start")
+@track_claim_step(CLAIM_PART)
 async def claims_start(message: types.Message, state: FSMContext):
-    repository: Repository = Repository()
-    claim_data: dict = repository.get_claim_data(message.from_user.id)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    claim_data: dict = await claim_session.get_claim_data()
     required_parts: List[str] = ["head", "story"]
     if claim_data.get("claim_data") is None or \
             not any([part_name in claim_data["claim_data"].keys() for part_name in required_parts]):
-        claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+        claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
         await message.reply("Пожалуйста, сперва заполните все разделы 'шапка' и 'фабула'.",
                             reply_markup=claim_parts_kb)
         return
 
-    claim_theme: Optional[str] = repository.get_current_claim_theme(message.from_user.id)
-    options: Optional[List[str]] = repository.get_claim_tmp_options(claim_theme, CLAIM_PART)
+    claim_theme: Optional[str] = await claim_session.get_claim_theme()
+    options: Optional[List[str]] = await claim_session.get_claim_tmp_options(CLAIM_PART)
     await process_claim_options(claim_theme, options, claim_data, message, state)
 
 
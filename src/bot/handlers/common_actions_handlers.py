@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from aiogram import types
 from aiogram.dispatcher import FSMContext
@@ -10,7 +10,7 @@ from common import calc_oof_profit, calc_payoff_profit
 from common.oof_profit_calculator import OOFCalculation
 from common.payoff_profit_calculator import PayOffCalculation
 from keyboards import get_next_actions_kb, example_btn, get_claim_parts_kb, emojis
-from repository import Repository
+from claim_session import ClaimSession, SAVE_FAILED_MESSAGE
 
 TERM_DISPLAY_NAME_MAP: dict = {
     "essence": "суть нарушения",
@@ -23,7 +23,7 @@ TERM_DISPLAY_NAME_MAP: dict = {
 async def process_manual_enter(message: types.Message, state: FSMContext, state_groups):
     manual_entered_value: str = message.text
     user_data = await state.get_data()
-    chosen_options: List[str]
+    chosen_options: List[Union[int, str]]
     if "chosen_options" in user_data.keys():
         chosen_options = user_data["chosen_options"]
         chosen_options.append(manual_entered_value)
@@ -40,10 +40,9 @@ async def process_manual_enter(message: types.Message, state: FSMContext, state_
                          reply_markup=next_actions_kb)
 
 
-async def process_option_selection(message: types.Message, claim_part: str, state_groups):
-    repository: Repository = Repository()
-    claim_theme: Optional[str] = repository.get_current_claim_theme(message.from_user.id)
-    options: Optional[List[str]] = repository.get_claim_tmp_options(claim_theme, claim_part)
+async def process_option_selection(message: types.Message, state: FSMContext, claim_part: str, state_groups):
+    claim_session: ClaimSession = ClaimSession.get_current()
+    options: Optional[List[str]] = await claim_session.get_claim_tmp_options(claim_part)
     if options is None or len(options) == 0:
         await state_groups.waiting_for_user_action.set()
         kb = ReplyKeyboardMarkup(resize_keyboard=True)
@@ -52,6 +51,17 @@ async def process_option_selection(message: types.Message, claim_part: str, stat
                             "Введите свой вариант", reply_markup=kb)
         return
 
+    # the chosen indexes refer to the options of the shown template version
+    tmp_version: Optional[str] = await claim_session.get_claim_tmp_version()
+    user_data = await state.get_data()
+    chosen_options: List[Union[int, str]] = user_data.get("chosen_options", [])
+    if user_data.get("tmp_version") not in (None, tmp_version) and \
+            any(isinstance(chosen_option, int) for chosen_option in chosen_options):
+        # the template is reloaded, the indexes chosen before can't be resolved by the new options
+        chosen_options = [chosen_option for chosen_option in chosen_options if isinstance(chosen_option, str)]
+        await message.answer("Шаблон был обновлен, выбранные ранее опции сброшены. Выберите их заново.")
+    await state.update_data(chosen_options=chosen_options, tmp_version=tmp_version)
+
     options_kb = InlineKeyboardMarkup()
     options_text = []
     for i, option in enumerate(options):
@@ -67,32 +77,34 @@ async def process_option_selection(message: types.Message, claim_part: str, stat
 
 
 async def claim_tmp_option_chosen(callback_query: types.CallbackQuery, state: FSMContext, claim_part: str):
-    chosen_option_index: int = int(callback_query.data.split(" ")[1])
-    repository: Repository = Repository()
-    claim_theme: Optional[str] = repository.get_current_claim_theme(callback_query.from_user.id)
-    options: Optional[List[str]] = repository.get_claim_tmp_options(claim_theme, claim_part)
-    chosen_option: str = options[chosen_option_index]
-
+    # The options are stored as indexes of the template options and are resolved to the text in the document only.
+    # The template version is recorded, when the options are shown, so the click on the options of another version
+    # (e.g. the templates are reloaded in the meantime) or a stale index is rejected.
+    claim_session: ClaimSession = ClaimSession.get_current()
+    options: Optional[List[str]] = await claim_session.get_claim_tmp_options(claim_part)
+    tmp_version: Optional[str] = await claim_session.get_claim_tmp_version()
     user_data = await state.get_data()
-    chosen_options: List[str]
-    if "chosen_options" in user_data.keys():
-        chosen_options = user_data["chosen_options"]
-        if chosen_option not in chosen_options:
-            chosen_options.append(chosen_option)
-            await callback_query.answer(text="Опциональный вариант успешно добавлен.", show_alert=True)
-        else:
-            await callback_query.answer(text="Данная опция уже была добавлена ранее.", show_alert=True)
-    else:
-        chosen_options = [chosen_option]
+    chosen_option_index_raw: str = callback_query.data.split(" ")[-1]
+    if options is None or user_data.get("tmp_version") != tmp_version or not chosen_option_index_raw.isdigit() or \
+            int(chosen_option_index_raw) >= len(options):
+        await callback_query.answer(text="Список опций устарел. Откройте его заново с помощью клавиатуры.",
+                                    show_alert=True)
+        return
+
+    chosen_option_index: int = int(chosen_option_index_raw)
+    chosen_options: List[Union[int, str]] = user_data.get("chosen_options", [])
+    if chosen_option_index not in chosen_options:
+        chosen_options.append(chosen_option_index)
         await callback_query.answer(text="Опциональный вариант успешно добавлен.", show_alert=True)
+    else:
+        await callback_query.answer(text="Данная опция уже была добавлена ранее.", show_alert=True)
 
     await state.update_data(chosen_options=chosen_options)
 
 
 async def show_claim_tmp_example(message: types.Message, claim_part):
-    repository: Repository = Repository()
-    claim_theme: Optional[str] = repository.get_current_claim_theme(message.from_user.id)
-    examples: Optional[List[str]] = repository.get_claim_tmp_examples(claim_theme, claim_part)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    examples: Optional[List[str]] = await claim_session.get_claim_tmp_examples(claim_part)
     next_actions_kb: ReplyKeyboardMarkup = get_next_actions_kb()
     if examples is None or len(examples) == 0:
         await message.reply("Для данной части примеров не найдено.")
@@ -101,7 +113,7 @@ async def show_claim_tmp_example(message: types.Message, claim_part):
                              reply_markup=next_actions_kb)
         return
 
-    claim_data = repository.get_claim_data(message.from_user.id, claim_theme)
+    claim_data: Optional[dict] = await claim_session.get_claim_data()
     placeholders = get_placeholders(claim_data["claim_data"])
     for i, example in enumerate(examples):
         await message.reply(f"Пример №{i+1}:\n{example.format(**placeholders)}")
@@ -113,25 +125,26 @@ async def show_claim_tmp_example(message: types.Message, claim_part):
 
 async def process_complete_part_editing(message: types.Message, state: FSMContext, claim_part: str):
     display_name: str = TERM_DISPLAY_NAME_MAP[claim_part]
-    user_id = message.from_user.id
     user_data = await state.get_data()
 
-    # check empty user entry
-    if not any(user_data):
+    # check empty user entry, the template version is recorded even if no option is chosen
+    if not any(value for key, value in user_data.items() if key != "tmp_version"):
         await message.answer(f"{emojis.red_exclamation_mark}Вы не выбрали опцию или свой вариант в этом разделе. "
                              f"Необходимо заполнить все разделы, чтобы получить сгенерированное заявление.",
                              reply_markup=ReplyKeyboardRemove())
     else:
-        repository: Repository = Repository()
-        claim_data: Optional[dict] = repository.get_claim_data(user_id)
+        claim_session: ClaimSession = ClaimSession.get_current()
         new_claim_data: dict = {
             f"claim_data.{claim_part}": user_data
         }
-        repository.update_record("claim-data", claim_data["_id"], new_claim_data)
+        if not await claim_session.save_claim_data(new_claim_data):
+            await message.answer(SAVE_FAILED_MESSAGE)
+            return
+
         await message.answer(f"Данные раздела '{display_name}' успешно заполнены.", reply_markup=ReplyKeyboardRemove())
 
     await state.finish()
-    claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+    claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
     await message.answer("Выберите часть искового заявления для заполнения", reply_markup=claim_parts_kb)
 
 
@@ -1,28 +1,34 @@
 from io import BytesIO
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import filters
 from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove
 from docx.document import Document
 
-from common.data_converter import convert_to_doc, get_oof_profit_calculation, get_payoff_profit_calculation
+from common.data_converter import convert_to_doc, get_oof_profit_calculation, get_payoff_profit_calculation, \
+    OPTION_PART_NAMES
 from keyboards import emojis, get_start_menu_kb
 from keyboards.claim_parts import PART_NAMES, get_claim_parts_kb
-from repository import Repository
+from claim_funnel import claim_funnel
+from claim_session import ClaimSession
 from statistics import count_event
 
 
 async def download_doc(message: types.Message):
-    repository: Repository = Repository()
-    claim_data: dict = repository.get_claim_data(message.from_user.id)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    claim_data: dict = await claim_session.get_claim_data()
     if claim_data.get("claim_data") is None or \
             not all([part_name in claim_data["claim_data"].keys() for part_name in PART_NAMES]):
-        claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+        claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
         await message.reply("Пожалуйста, сперва заполните все разделы.", reply_markup=claim_parts_kb)
         return
 
-    claim_doc: Document = convert_to_doc(claim_data)
+    law_data: Optional[List[str]] = await claim_session.get_claim_tmp_options("law")
+    tmp_options: Dict[str, Optional[List[str]]] = {
+        part_name: await claim_session.get_chosen_claim_tmp_options(part_name) for part_name in OPTION_PART_NAMES
+    }
+    claim_doc: Document = convert_to_doc(claim_data, law_data, tmp_options)
     with BytesIO() as claim_doc_file:
         claim_doc.save(claim_doc_file)
         claim_doc_file.seek(0)
@@ -39,8 +45,7 @@ async def download_doc(message: types.Message):
                                       disable_content_type_detection=True,
                                       reply_markup=ReplyKeyboardRemove())
 
-    claim_theme: Optional[str] = repository.get_current_claim_theme(message.from_user.id)
-    actions: Optional[List[str]] = repository.get_claim_tmp_actions(claim_theme, "story")
+    actions: Optional[List[str]] = await claim_session.get_claim_tmp_actions("story")
     if actions is not None and "enter_end_date" in actions:
         calc_doc: Document = get_oof_profit_calculation(claim_data["claim_data"])
         with BytesIO() as calc_doc_file:
@@ -63,15 +68,14 @@ async def download_doc(message: types.Message):
                                           disable_content_type_detection=True,
                                           reply_markup=ReplyKeyboardRemove())
 
+    claim_funnel.finish_claim(message.from_user.id)
     try:
-        count_event("download_doc", message.from_user.id)
+        await count_event("download_doc", message.from_user.id)
     except Exception as ex:
         print(f"Error occurred while collection statistics: {ex}")
 
     # remove data from db
-    previous_claim_data: Optional[dict] = repository.get_claim_data(message.from_user.id, claim_data["claim_theme"])
-    if previous_claim_data is not None:
-        repository.remove_item("claim-data", previous_claim_data["_id"])
+    await claim_session.remove_claim_data()
 
     start_menu_kb: ReplyKeyboardMarkup = get_start_menu_kb()
     await message.answer("Выберите одну из следующих команд:", reply_markup=start_menu_kb)
@@ -8,7 +8,8 @@ from aiogram.types import ReplyKeyboardMarkup
 from handlers.common_actions_handlers import process_manual_enter, process_option_selection, \
     process_complete_part_editing, claim_tmp_option_chosen, show_claim_tmp_example
 from keyboards import emojis, get_common_start_kb, get_next_actions_kb, get_claim_parts_kb
-from repository import Repository
+from claim_funnel import track_claim_step
+from claim_session import ClaimSession
 from statistics import collect_statistic
 
 CLAIM_PART: str = "essence"
@@ -20,13 +21,14 @@ class EssencePart(StatesGroup):
 
 
 @collect_statistic(event_name="essence:start")
+@track_claim_step(CLAIM_PART)
 async def essence_start(message: types.Message, state: FSMContext):
-    repository: Repository = Repository()
-    claim_data: dict = repository.get_claim_data(message.from_user.id)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    claim_data: dict = await claim_session.get_claim_data()
     required_parts: List[str] = ["story"]
     if claim_data.get("claim_data") is None or \
             not any([part_name in claim_data["claim_data"].keys() for part_name in required_parts]):
-        claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+        claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
         await message.reply("Пожалуйста, сперва заполните раздел 'фабула'.",
                             reply_markup=claim_parts_kb)
         return
@@ -47,7 +49,7 @@ async def show_example(message: types.Message, state: FSMContext):
 async def action_selected(message: types.Message, state: FSMContext):
     option: Optional[str] = message.text
     if option.endswith("выбрать из списка") or option.endswith("добавить еще из списка"):
-        await process_option_selection(message, CLAIM_PART, EssencePart)
+        await process_option_selection(message, state, CLAIM_PART, EssencePart)
         return
     if option.endswith("закончить заполнение"):
         await process_complete_part_editing(message, state, CLAIM_PART)
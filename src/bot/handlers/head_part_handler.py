@@ -9,9 +9,10 @@ from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButt
 import aiogram.utils.markdown as fmt
 
 from keyboards import emojis, get_claim_parts_kb
-from repository import Repository
+from claim_funnel import claim_funnel, track_claim_step, COURT_STEP
+from claim_session import ClaimSession, SAVE_FAILED_MESSAGE
 
-from common import CourtInfo, resolve_court_address
+from common import CourtInfo, resolve_court_address, region_index
 from statistics import collect_statistic, count_event
 
 
@@ -30,6 +31,7 @@ class HeadPart(StatesGroup):
 
 
 @collect_statistic(event_name="header:start")
+@track_claim_step("head")
 async def header_start(message: types.Message, state: FSMContext):
     await message.reply("Для заполнения шапки заявления необходимо указать:\n"
                         "- ФИО и адрес истца\n"
@@ -101,10 +103,10 @@ async def apartment_chosen(message: types.Message, state: FSMContext):
     else:
         await state.update_data(apartment_chosen=apartment)
     user_data = await state.get_data()
-    repository: Repository = Repository()
-    region_code: str = repository.get_region_code(user_data["user_post_code"])
+    region_code: str = region_index.get_region_code(user_data["user_post_code"])
 
     await message.answer(f"{emojis.magnifying_glass_tilted_left} Поиск подходящего суда...")
+    claim_funnel.start_step(message.from_user.id, COURT_STEP)
     court_info: List[CourtInfo] = await resolve_court_address(city=user_data["chosen_city"],
                                                               court_subj=region_code, street=user_data["chosen_street"])
     if len(court_info) == 0:
@@ -128,6 +130,7 @@ async def apartment_chosen(message: types.Message, state: FSMContext):
             sep="\n"
         ), parse_mode="HTML")
         await state.update_data(chosen_court=court_info[0])
+        claim_funnel.complete_step(message.from_user.id, COURT_STEP)
         await HeadPart.waiting_for_employer_name.set()
         await message.answer("Введите название организации и её ИНН, в которой вы работаете. "
                              "Если не знаете ИНН, введите просто название.\n"
@@ -183,6 +186,7 @@ async def court_entered(message: types.Message, state: FSMContext):
         address: str = f"{post_code[0]}, {court_info_agg[1]}"
         chosen_court: CourtInfo = CourtInfo(name=court_info_agg[0], address=address, note="")
         await state.update_data(chosen_court=chosen_court)
+        claim_funnel.complete_step(message.from_user.id, COURT_STEP)
         await HeadPart.waiting_for_employer_name.set()
         await message.answer("Введите название организации и её ИНН, в которой вы работаете. "
                              "Если не знаете ИНН, введите просто название.\n"
@@ -203,11 +207,12 @@ async def court_chosen(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer(text=f"Суд '{chosen_court.name}' выбран.", show_alert=True)
 
     try:
-        count_event("header:court_auto_chosen", callback_query.from_user.id)
+        await count_event("header:court_auto_chosen", callback_query.from_user.id)
     except Exception as ex:
         print(f"Error occurred while collection statistics: {ex}")
 
     await state.update_data(chosen_court=chosen_court)
+    claim_funnel.complete_step(callback_query.from_user.id, COURT_STEP)
     await HeadPart.waiting_for_employer_name.set()
     await callback_query.message.answer("Введите название организации и её ИНН, в которой вы работаете. "
                                         "Если не знаете ИНН, введите просто название.\n"
@@ -234,16 +239,17 @@ async def employer_address_chosen(message: types.Message, state: FSMContext):
     await state.update_data(chosen_employer_address=employer_address)
     user_data = await state.get_data()
     # TODO: print entered data for checking?
-    await message.answer("Данные раздела 'шапка' успешно заполнены.")
-    user_id = message.from_user.id
-    repository: Repository = Repository()
-    claim_data: Optional[dict] = repository.get_claim_data(user_id)
+    claim_session: ClaimSession = ClaimSession.get_current()
     head_data: dict = {
         "claim_data.head": user_data
     }
-    repository.update_record("claim-data", claim_data["_id"], head_data)
+    if not await claim_session.save_claim_data(head_data):
+        await message.answer(SAVE_FAILED_MESSAGE)
+        return
+
+    await message.answer("Данные раздела 'шапка' успешно заполнены.")
     await state.finish()
-    claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+    claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
     await message.answer("Выберите часть искового заявления для заполнения", reply_markup=claim_parts_kb)
 
 
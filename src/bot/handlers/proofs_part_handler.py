@@ -8,6 +8,7 @@ from aiogram.types import ReplyKeyboardMarkup
 from handlers.common_actions_handlers import process_option_selection, process_complete_part_editing, \
     process_manual_enter, claim_tmp_option_chosen, show_claim_tmp_example
 from keyboards import emojis, get_common_start_kb, get_next_actions_kb
+from claim_funnel import track_claim_step
 from statistics import collect_statistic
 
 CLAIM_PART: str = "proofs"
@@ -19,6 +20,7 @@ class ProofsPart(StatesGroup):
 
 
 @collect_statistic(event_name="proofs:start")
+@track_claim_step(CLAIM_PART)
 async def proofs_start(message: types.Message, state: FSMContext):
     await ProofsPart.waiting_for_user_action.set()
     start_kb: ReplyKeyboardMarkup = get_common_start_kb()
@@ -35,7 +37,7 @@ async def show_example(message: types.Message, state: FSMContext):
 async def action_selected(message: types.Message, state: FSMContext):
     option: Optional[str] = message.text
     if option.endswith("выбрать из списка") or option.endswith("добавить еще из списка"):
-        await process_option_selection(message, CLAIM_PART, ProofsPart)
+        await process_option_selection(message, state, CLAIM_PART, ProofsPart)
         return
     if option.endswith("закончить заполнение"):
         await process_complete_part_editing(message, state, CLAIM_PART)
@@ -1,11 +1,10 @@
-from datetime import datetime
-from typing import List, Optional
+from typing import List
 
-import pytz
 from aiogram import types, Dispatcher, filters
 from aiogram.dispatcher import FSMContext
 from aiogram.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 
+from claim_session import ClaimSession
 from repository import Repository
 from keyboards import get_start_menu_kb, get_claim_tmps_list_kb, get_claim_parts_kb, emojis
 from statistics import collect_statistic, count_event
@@ -56,7 +55,7 @@ async def choose_claim_tmp(message: types.Message, state: FSMContext):
     if state is not None:
         await state.finish()
 
-    claim_tmps_list_kb: ReplyKeyboardMarkup = get_claim_tmps_list_kb()
+    claim_tmps_list_kb: ReplyKeyboardMarkup = await get_claim_tmps_list_kb()
     await message.reply("Выберите один из шаблонов для заполнения", reply_markup=claim_tmps_list_kb)
 
 
@@ -66,23 +65,16 @@ async def choose_claim_part(message: types.Message, state: FSMContext):
 
     temp_theme_raw: str = message.text
     temp_theme: str = temp_theme_raw.replace(emojis.page_facing_up, "").strip()
-    repository: Repository = Repository()
-    previous_claim_data: Optional[dict] = repository.get_claim_data(message.from_user.id, temp_theme)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    is_created: bool = await claim_session.choose_claim(temp_theme)
     # This is the first time when the user chose the claim template.
-    if previous_claim_data is None:
-        new_claim_data: dict = {
-            "user_id": message.from_user.id,
-            "claim_theme": temp_theme,
-            "created": datetime.utcnow().replace(tzinfo=pytz.UTC)
-        }
-        repository.insert_item("claim-data", new_claim_data)
-
+    if is_created:
         try:
-            count_event(f"claim_template:{temp_theme}", message.from_user.id)
+            await count_event(f"claim_template:{temp_theme}", message.from_user.id)
         except Exception as ex:
             print(f"Error occurred while collection statistics: {ex}")
 
-    claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+    claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
     await message.reply("Выберите часть искового заявления для заполнения", reply_markup=claim_parts_kb)
 
 
@@ -162,6 +154,7 @@ def register_handlers(dp: Dispatcher):
     dp.register_message_handler(choose_court_presentation,
                                 filters.Regexp(f"^{emojis.man_judge} выступление в суде|/presentation"))
 
+    # handlers are registered before the event loop starts, so the sync repository is used here
     repository: Repository = Repository()
     tmp_names: List[str] = repository.get_tmps_list()
     tmp_regex: str = f"^{emojis.page_facing_up} ({'|'.join([tn for tn in tmp_names])})$"
@@ -9,7 +9,8 @@ from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButt
 
 from common import telegram_calendar
 from keyboards import emojis, get_claim_parts_kb
-from repository import Repository
+from claim_funnel import track_claim_step
+from claim_session import ClaimSession, SAVE_FAILED_MESSAGE
 from statistics import collect_statistic
 
 example_btn = KeyboardButton(f"{emojis.red_question_mark} показать пример")
@@ -40,6 +41,7 @@ class StoryPart(StatesGroup):
 
 
 @collect_statistic(event_name="story:start")
+@track_claim_step(CLAIM_PART)
 async def story_start(message: types.Message, state: FSMContext):
     await StoryPart.waiting_for_start_work_date.set()
     calendar_kb = telegram_calendar.create_calendar()
@@ -57,9 +59,8 @@ async def start_work_date_entered(callback_query: types.CallbackQuery, state: FS
 
         await callback_query.answer(text=f"Выбрана дата: {start_work_date.strftime('%d.%m.%Y')}.", show_alert=True)
         await state.update_data(start_work_date=start_work_date)
-        repository: Repository = Repository()
-        claim_theme: Optional[str] = repository.get_current_claim_theme(callback_query.from_user.id)
-        actions: Optional[List[str]] = repository.get_claim_tmp_actions(claim_theme, CLAIM_PART)
+        claim_session: ClaimSession = ClaimSession.get_current()
+        actions: Optional[List[str]] = await claim_session.get_claim_tmp_actions(CLAIM_PART)
         if actions is not None and "enter_end_date" in actions:
             await StoryPart.waiting_for_end_work_date.set()
             calendar_kb = telegram_calendar.create_calendar()
@@ -119,9 +120,8 @@ async def user_salary_entered(message: types.Message, state: FSMContext):
     user_salary: Optional[str] = message.text
     await state.update_data(user_salary=user_salary)
 
-    repository: Repository = Repository()
-    claim_theme: Optional[str] = repository.get_current_claim_theme(message.from_user.id)
-    actions: Optional[List[str]] = repository.get_claim_tmp_actions(claim_theme, CLAIM_PART)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    actions: Optional[List[str]] = await claim_session.get_claim_tmp_actions(CLAIM_PART)
     if actions is not None and "enter_avr_salary" in actions:
         await StoryPart.waiting_for_avr_salary.set()
         await message.answer("Пожалуйста, укажите средних доход, который вы получаете за месяц работы, "
@@ -221,26 +221,25 @@ async def user_employer_discussion_entered(message: types.Message, state: FSMCon
         user_employer_discussion = ""
 
     await state.update_data(user_employer_discussion=user_employer_discussion)
-    await message.answer("Данные раздела 'фабула' успешно заполнены.", reply_markup=ReplyKeyboardRemove())
-
-    user_id = message.from_user.id
     user_data = await state.get_data()
-    repository: Repository = Repository()
-    claim_data: Optional[dict] = repository.get_claim_data(user_id)
+    claim_session: ClaimSession = ClaimSession.get_current()
     story_data: dict = {
         "claim_data.story": user_data
     }
-    repository.update_record("claim-data", claim_data["_id"], story_data)
+    if not await claim_session.save_claim_data(story_data):
+        await message.answer(SAVE_FAILED_MESSAGE)
+        return
+
+    await message.answer("Данные раздела 'фабула' успешно заполнены.", reply_markup=ReplyKeyboardRemove())
     await state.finish()
-    claim_parts_kb: ReplyKeyboardMarkup = get_claim_parts_kb(message.from_user.id)
+    claim_parts_kb: ReplyKeyboardMarkup = await get_claim_parts_kb(message.from_user.id)
     await message.answer("Выберите часть искового заявления для заполнения", reply_markup=claim_parts_kb)
 
 
 @collect_statistic(event_name="story:show_example")
 async def show_example(message: types.Message, state: FSMContext):
-    repository: Repository = Repository()
-    claim_theme: Optional[str] = repository.get_current_claim_theme(message.from_user.id)
-    claim_tmp: Optional[dict] = repository.get_claim_tmp(claim_theme)
+    claim_session: ClaimSession = ClaimSession.get_current()
+    claim_tmp: Optional[dict] = await claim_session.get_claim_tmp()
     story_examples: List[str]
     if claim_tmp is not None and "story" in claim_tmp.keys() and "examples" in claim_tmp["story"].keys():
         story_examples: List[str] = claim_tmp["story"]["examples"]
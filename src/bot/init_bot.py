@@ -1,36 +1,56 @@
-import json
-from typing import List
+import asyncio
+import logging
 
 from aiogram import Bot, Dispatcher
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
 
-from repository import Repository
+import bot_config
+from claim_session import ClaimSessionMiddleware
+from claim_tmp_cache import claim_tmp_cache
+from common import region_index
+from db_indexes import ensure_indexes, report_hot_queries
+from db_seed import seed_db
+from fsm_storage import MongoWriteBehindStorage, BoundedMemoryStorage
+from repository import AsyncRepository
+from statistics import migrate_legacy_statistics, build_statistics_rollups
 
 
 def init_bot(token: str) -> Dispatcher:
-    init_db()
-    storage: MemoryStorage = MemoryStorage()
+    # the db must be initialized before handlers registration, because they read the templates list
+    asyncio.get_event_loop().run_until_complete(init_db())
+    storage: BaseStorage = init_storage()
     bot: Bot = Bot(token=token)
     dp: Dispatcher = Dispatcher(bot, storage=storage)
+    dp.middleware.setup(ClaimSessionMiddleware())
     return dp
 
 
-def init_db():
-    repository: Repository = Repository()
+def init_storage() -> BaseStorage:
+    # the states are kept in the db by default, so a restart doesn't interrupt the users' claims
+    lifetime_sec: int = bot_config.get_int("DATA_LIFETIME_H", 2) * 3600
+    if bot_config.get_config().get("FSM_STORAGE") == "memory":
+        return BoundedMemoryStorage(ttl_sec=lifetime_sec,
+                                    max_bytes=bot_config.get_int("FSM_MAX_SIZE_MB", 64) * 1024 * 1024)
+    return MongoWriteBehindStorage(flush_interval_sec=bot_config.get_int("FSM_FLUSH_INTERVAL_SEC", 1),
+                                   lifetime_sec=lifetime_sec)
 
-    # init regions
-    if not repository.is_collection("regions"):
-        with open("resources/regions.json") as regions_file:
-            regions_info: List[dict] = json.load(regions_file)
-            for region in regions_info:
-                repository.insert_item("regions", region)
 
-    # init default template
-    if not repository.is_collection("claim-tmps"):
-        with open("resources/claim_templates/reinstatement.json") as claim_tmp_file:
-            claim_tmp_info: dict = json.load(claim_tmp_file)
-            repository.insert_item("claim-tmps", claim_tmp_info)
+async def init_db():
+    repository: AsyncRepository = AsyncRepository()
 
-        with open("resources/claim_templates/wages_recovery.json") as claim_tmp_file:
-            claim_tmp_info: dict = json.load(claim_tmp_file)
-            repository.insert_item("claim-tmps", claim_tmp_info)
+    await ensure_indexes(repository)
+    backfilled_count: int = await repository.backfill_claim_progress()
+    if backfilled_count > 0:
+        logging.getLogger("INIT_BOT").info(f"Progress of {backfilled_count} claims is computed.")
+    await migrate_legacy_statistics(repository)
+    await build_statistics_rollups(repository)
+    # the templates and the regions from the resources
+    await seed_db(repository)
+    await report_hot_queries(repository)
+
+    # the region codes are resolved in memory, see RegionIndex
+    region_index.load_file()
+
+    # warm up the templates cache
+    claim_tmp_cache.ttl_sec = bot_config.get_int("CLAIM_TMP_CACHE_TTL_SEC", 0)
+    await repository.load_claim_tmps()
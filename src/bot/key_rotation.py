@@ -0,0 +1,92 @@
+import asyncio
+import copy
+import logging
+from typing import Dict, List, Optional, Union
+
+from bson import ObjectId
+from cryptography.fernet import InvalidToken
+
+import bot_config
+from repository import AsyncRepository
+
+# the collections with the encrypted data, the FSM states are encrypted as the claim data, see fsm_storage
+ENCRYPTED_COLLECTIONS: List[str] = ["claim-data", "fsm-states"]
+
+# progress of the background re-encryption, see reencrypt_data
+rotation_stats: Dict[str, int] = {
+    "running": 0,
+    "scanned": 0,
+    "rotated": 0,
+    "changed_concurrently": 0,
+    "failed": 0
+}
+
+_sweep_task: Optional[asyncio.Task] = None
+
+
+async def reencrypt_collection(repository: AsyncRepository, collection_name: str, batch_size: int, delay_sec: float):
+    # The documents encrypted with the old keys are re-encrypted in small batches with a pause between them, so
+    # the rotation doesn't load the db. The documents which are read by the bot are re-encrypted on read anyway.
+    logger = logging.getLogger("KEY_ROTATION")
+    last_id: Optional[Union[ObjectId, str]] = None
+    while True:
+        batch: List[dict] = await repository.get_records_batch(collection_name, last_id, batch_size)
+        if not any(batch):
+            break
+
+        for encrypted_item in batch:
+            last_id = encrypted_item["_id"]
+            rotation_stats["scanned"] += 1
+            decrypted_item: dict = copy.deepcopy(encrypted_item)
+            try:
+                if not repository.encryptor.decrypt_and_check(decrypted_item):
+                    continue
+            except InvalidToken:
+                # the document is encrypted with a key which is not configured
+                rotation_stats["failed"] += 1
+                logger.error(f"Failed to decrypt {collection_name} {last_id}.")
+                continue
+
+            if await repository.reencrypt_record(collection_name, encrypted_item, decrypted_item):
+                rotation_stats["rotated"] += 1
+            else:
+                # it was updated by the user in the meantime and will be re-encrypted on the next write
+                rotation_stats["changed_concurrently"] += 1
+
+        logger.info(f"Re-encryption progress of {collection_name}: {rotation_stats}")
+        await asyncio.sleep(delay_sec)
+
+
+async def reencrypt_data(repository: AsyncRepository, batch_size: int, delay_sec: float):
+    logger = logging.getLogger("KEY_ROTATION")
+    rotation_stats["running"] = 1
+    try:
+        for collection_name in ENCRYPTED_COLLECTIONS:
+            await reencrypt_collection(repository, collection_name, batch_size, delay_sec)
+    finally:
+        rotation_stats["running"] = 0
+
+    logger.info(f"Re-encryption is finished: {rotation_stats}")
+
+
+def start_key_rotation_sweep():
+    global _sweep_task
+    if bot_config.get_int("KEY_ROTATION_SWEEP", 0) == 0 or _sweep_task is not None:
+        return
+
+    batch_size: int = bot_config.get_int("KEY_ROTATION_BATCH_SIZE", 50)
+    delay_sec: int = bot_config.get_int("KEY_ROTATION_DELAY_SEC", 1)
+    _sweep_task = asyncio.ensure_future(reencrypt_data(AsyncRepository(), batch_size, delay_sec))
+
+
+async def stop_key_rotation_sweep():
+    global _sweep_task
+    if _sweep_task is None:
+        return
+
+    _sweep_task.cancel()
+    try:
+        await _sweep_task
+    except asyncio.CancelledError:
+        pass
+    _sweep_task = None
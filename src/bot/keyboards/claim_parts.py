@@ -1,15 +1,13 @@
-from typing import List
+from typing import Set
 
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 from keyboards import emojis
-from repository import Repository
+from claim_session import ClaimSession, get_claim_session
+from common.claim_progress import PART_NAMES
 
 
-PART_NAMES: List[str] = ["head", "story", "essence", "proofs", "claims", "additions"]
-
-
-def get_claim_parts_kb(user_id: int) -> ReplyKeyboardMarkup:
-    parts_status: dict = get_claim_parts_status(user_id)
+async def get_claim_parts_kb(user_id: int) -> ReplyKeyboardMarkup:
+    parts_status: dict = await get_claim_parts_status(user_id)
     claim_parts_kb = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     claim_parts_kb\
         .add(KeyboardButton(f"{emojis.top_hat} шапка {emojis.check_mark if parts_status['head'] is True else ''}")) \
@@ -24,15 +22,7 @@ def get_claim_parts_kb(user_id: int) -> ReplyKeyboardMarkup:
     return claim_parts_kb
 
 
-def get_claim_parts_status(user_id: int) -> dict:
-    repository: Repository = Repository()
-    claim_data: dict = repository.get_claim_data(user_id)
-    if "claim_data" not in claim_data.keys():
-        return {pn: False for pn in PART_NAMES}
-    parts_status: dict = {}
-    for part_name in PART_NAMES:
-        if part_name in claim_data["claim_data"].keys():
-            parts_status.update(**{part_name: True})
-        else:
-            parts_status.update(**{part_name: False})
-    return parts_status
+async def get_claim_parts_status(user_id: int) -> dict:
+    claim_session: ClaimSession = get_claim_session(user_id)
+    filled_parts: Set[str] = await claim_session.get_filled_parts()
+    return {part_name: part_name in filled_parts for part_name in PART_NAMES}
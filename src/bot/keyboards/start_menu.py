@@ -1,6 +1,6 @@
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 
-from repository import Repository
+from repository import AsyncRepository
 from keyboards import emojis
 
 
@@ -17,9 +17,9 @@ def get_start_menu_kb() -> ReplyKeyboardMarkup:
     return start_menu_kb
 
 
-def get_claim_tmps_list_kb() -> ReplyKeyboardMarkup:
-    repository: Repository = Repository()
-    tmp_names = repository.get_tmps_list()
+async def get_claim_tmps_list_kb() -> ReplyKeyboardMarkup:
+    repository: AsyncRepository = AsyncRepository()
+    tmp_names = await repository.get_tmps_list()
     choose_claim_tmp_kb = ReplyKeyboardMarkup(resize_keyboard=True)
     for tmp_name in tmp_names:
         choose_claim_tmp_kb.add(KeyboardButton(f"{emojis.page_facing_up} {tmp_name}"))
@@ -1,158 +1,456 @@
-from datetime import datetime
-from typing import List, Optional, Set, Callable
+import copy
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Iterator, Tuple, MutableMapping, AsyncIterator, Union
 
 from bson import ObjectId
-from cryptography.fernet import Fernet
-
-from dotenv import dotenv_values
-from pymongo import MongoClient, DESCENDING
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+import pytz
 
 import bot_config
+from claim_tmp_cache import claim_tmp_cache, CachedClaimTmp
+from common.claim_progress import PROGRESS_FIELD, get_update_progress_mask, get_claim_data_progress
+from common.hyperloglog import unpack_hll_registers
+from encryption import DataEncryptor, ENVELOPE_MODE
+from field_cipher import AES_GCM_CIPHER
+
+CURRENT_CLAIM_SORT: List[Tuple[str, int]] = [("chosen", DESCENDING), ("_id", DESCENDING)]
 
 
-class Repository:
+# Counts pool events of the shared client, so connection reuse can be checked.
+class PoolStatsListener(monitoring.ConnectionPoolListener):
     def __init__(self):
-        if bot_config.ENV == "prod":
-            self.config = dotenv_values(".env")
-        if bot_config.ENV == "dev":
-            self.config = dotenv_values(".env-dev")
+        self.counters: Dict[str, int] = {
+            "pools_created": 0,
+            "connections_created": 0,
+            "connections_ready": 0,
+            "connections_closed": 0,
+            "checkouts": 0,
+            "checkout_failures": 0
+        }
+
+    def pool_created(self, event):
+        self.counters["pools_created"] += 1
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.counters["connections_created"] += 1
+
+    def connection_ready(self, event):
+        # the connection is ready after the handshake and SCRAM authentication were done
+        self.counters["connections_ready"] += 1
+
+    def connection_closed(self, event):
+        self.counters["connections_closed"] += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.counters["checkout_failures"] += 1
+
+    def connection_checked_out(self, event):
+        self.counters["checkouts"] += 1
+
+    def connection_checked_in(self, event):
+        pass
+
+
+pool_stats_listener: PoolStatsListener = PoolStatsListener()
+_mongo_client: Optional[MongoClient] = None
+_async_mongo_client: Optional[AsyncIOMotorClient] = None
+_data_encryptor: Optional[DataEncryptor] = None
+_lock: threading.Lock = threading.Lock()
+
+
+def get_mongo_client_options() -> dict:
+    config: dict = bot_config.get_config()
+    return {
+        "host": config["MONGO_HOST"],
+        "port": int(config["MONGO_PORT"]),
+        "username": config["MONGO_INITDB_USERNAME"],
+        "password": config["MONGO_INITDB_PASSWORD"],
+        "authSource": config["MONGO_INITDB_DATABASE"],
+        "authMechanism": "SCRAM-SHA-256",
+        "maxPoolSize": bot_config.get_int("MONGO_MAX_POOL_SIZE", 20),
+        "minPoolSize": bot_config.get_int("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": bot_config.get_int("MONGO_MAX_IDLE_TIME_MS", 5 * 60 * 1000),
+        "event_listeners": [pool_stats_listener]
+    }
+
+
+def get_mongo_client() -> MongoClient:
+    global _mongo_client
+    if _mongo_client is None:
+        with _lock:
+            if _mongo_client is None:
+                _mongo_client = MongoClient(**get_mongo_client_options())
+    return _mongo_client
+
+
+def get_async_mongo_client() -> AsyncIOMotorClient:
+    global _async_mongo_client
+    if _async_mongo_client is None:
+        _async_mongo_client = AsyncIOMotorClient(**get_mongo_client_options())
+    return _async_mongo_client
+
+
+def get_data_encryptor() -> DataEncryptor:
+    global _data_encryptor
+    if _data_encryptor is None:
+        config: dict = bot_config.get_config()
+        # the keys which are replaced by ENCRYPT_KEY, they are kept until all the data is re-encrypted
+        old_keys: List[str] = [key.strip() for key in (config.get("ENCRYPT_OLD_KEYS") or "").split(",") if key.strip()]
+        _data_encryptor = DataEncryptor([config["ENCRYPT_KEY"], *old_keys],
+                                        config.get("ENCRYPTION_MODE") or ENVELOPE_MODE,
+                                        config.get("FIELD_CIPHER") or AES_GCM_CIPHER)
+    return _data_encryptor
+
 
+def get_pool_stats() -> Dict[str, int]:
+    return dict(pool_stats_listener.counters)
+
+
+def close_mongo_client():
+    global _mongo_client, _async_mongo_client
+    with _lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+            _mongo_client = None
+        if _async_mongo_client is not None:
+            _async_mongo_client.close()
+            _async_mongo_client = None
+
+
+def get_progress_backfill_request(claim: dict) -> UpdateOne:
+    # the progress of the claim created before the progress field is computed by the whole document, the part names
+    # are the keys, which aren't encrypted
+    return UpdateOne({"_id": claim["_id"], PROGRESS_FIELD: {"$exists": False}},
+                     {"$set": {PROGRESS_FIELD: get_claim_data_progress(claim)}})
+
+
+def get_tmp_part_values(claim_tmp: Optional[dict], part: str, values_name: str) -> Optional[List[str]]:
+    values: Optional[List[str]] = None
+    if claim_tmp is not None and part in claim_tmp.keys() and values_name in claim_tmp[part].keys():
+        values = claim_tmp[part][values_name]
+    return values
+
+
+class BaseRepository:
+    def __init__(self):
+        self.config: dict = bot_config.get_config()
         self.db_name: str = self.config["MONGO_INITDB_DATABASE"]
-        self.key: str = self.config["ENCRYPT_KEY"]
-        self.fernet: Fernet = Fernet(self.key)
-        self.sensitive_fields: Set[str] = {"user_name", "user_post_code", "chosen_city", "chosen_street",
-                                           "house_chosen", "apartment_chosen"}
-
-    def _get_mongo_client(self):
-        return MongoClient(
-            host=self.config["MONGO_HOST"],
-            port=int(self.config["MONGO_PORT"]),
-            username=self.config["MONGO_INITDB_USERNAME"],
-            password=self.config["MONGO_INITDB_PASSWORD"],
-            authSource=self.db_name,
-            authMechanism="SCRAM-SHA-256"
-        )
+        self.encryptor: DataEncryptor = get_data_encryptor()
 
     def encrypt(self, value: str) -> str:
-        return self.fernet.encrypt(value.encode()).decode()
+        return self.encryptor.encrypt(value)
 
     def decrypt(self, value: str) -> str:
-        return self.fernet.decrypt(value.encode()).decode()
+        return self.encryptor.decrypt(value)
+
+    def encrypt_data(self, data: dict) -> dict:
+        return self.encryptor.encrypt_data(data)
+
+    def decrypt_data(self, data: dict) -> dict:
+        return self.encryptor.decrypt_data(data)
+
 
-    def process_data(self, data: dict, processor: Callable[[str], str]) -> dict:
-        for key, value in data.items():
-            if key in self.sensitive_fields and isinstance(value, str):
-                data[key] = processor(value)
-            if isinstance(value, dict):
-                data[key] = self.process_data(value, processor)
-        return data
+# Synchronous repository. It's used by the code which runs outside of the event loop.
+class Repository(BaseRepository):
+    @contextmanager
+    def _get_mongo_client(self) -> Iterator[MongoClient]:
+        # the client is shared by the whole process and must not be closed after each call
+        yield get_mongo_client()
 
     def get_tmps_list(self) -> List[str]:
         with self._get_mongo_client() as client:
             tmps: List[dict] = list(client[self.db_name]["claim-tmps"].find({}, {"theme": 1, "_id": 0}))
             return [tmp["theme"] for tmp in tmps]
 
-    def get_region_code(self, post_code: str) -> str:
-        post_code_prefix: str = post_code[:3]
-        with self._get_mongo_client() as client:
-            result = list(client[self.db_name]["regions"].find({"post": post_code_prefix}))
-            if len(result) > 0:
-                return result[0]["code"]
-            return "-1"
 
-    def insert_item(self, collection_name: str, item: dict):
-        encrypted_item: dict = self.process_data(item, self.encrypt)
-        with self._get_mongo_client() as client:
-            client[self.db_name][collection_name].insert_one(encrypted_item)
+# Asynchronous repository. It's used by the handlers, so a slow query doesn't block the event loop.
+class AsyncRepository(BaseRepository):
+    def __init__(self):
+        super().__init__()
+        self.round_trips: int = 0
 
-    def remove_item(self, collection_name: str, item_id: ObjectId):
-        with self._get_mongo_client() as client:
-            client[self.db_name][collection_name].delete_one({"_id": item_id})
+    @property
+    def db(self) -> AsyncIOMotorDatabase:
+        # every method accesses the db once per request, so it's a cheap way to count round trips
+        self.round_trips += 1
+        return get_async_mongo_client()[self.db_name]
+
+    async def load_claim_tmps(self) -> List[dict]:
+        claim_tmps: List[dict] = await self.db["claim-tmps"].find().to_list(length=None)
+        claim_tmp_cache.put_all(claim_tmps)
+        return claim_tmps
+
+    async def get_claim_tmps(self) -> List[dict]:
+        # the stored templates without caching them, e.g. before they are replaced by the seed
+        return await self.db["claim-tmps"].find({}, {"_id": 0}).to_list(length=None)
 
-    def get_claim_data(self, user_id: int, claim_theme: Optional[str] = None) -> Optional[dict]:
+    async def get_tmps_list(self) -> List[str]:
+        themes: Optional[List[str]] = claim_tmp_cache.get_themes()
+        if themes is None:
+            claim_tmps: List[dict] = await self.load_claim_tmps()
+            themes = [claim_tmp["theme"] for claim_tmp in claim_tmps]
+        return themes
+
+    async def get_regions(self) -> List[dict]:
+        return await self.db["regions"].find({}, {"_id": 0}).to_list(length=None)
+
+    async def insert_item(self, collection_name: str, item: dict):
+        encrypted_item: dict = self.encrypt_data(item)
+        await self.db[collection_name].insert_one(encrypted_item)
+
+    async def remove_item(self, collection_name: str, item_id: ObjectId):
+        await self.db[collection_name].delete_one({"_id": item_id})
+
+    async def get_claim_data(self, user_id: int, claim_theme: Optional[str] = None) -> Optional[MutableMapping]:
         find_filter: dict = {"user_id": user_id}
         if claim_theme is not None:
             find_filter.update(**{"claim_theme": claim_theme})
 
-        with self._get_mongo_client() as client:
-            search_result = list(client[self.db_name]["claim-data"].find(find_filter))
-            # there can be only one :)
-            result: dict
-            if len(search_result) == 1:
-                result = search_result[0]
-            if len(search_result) == 0:
-                return None
-            if len(search_result) > 1:
-                # TODO: how to hande this? Take latest?
-                result = search_result[0]
-
-            decrypted_item: dict = self.process_data(result, self.decrypt)
-            return decrypted_item
-
-    def update_record(self, collection_name: str, item_id: ObjectId, new_value: dict):
-        encrypted_value: dict = self.process_data(new_value, self.encrypt)
-        with self._get_mongo_client() as client:
-            client[self.db_name][collection_name].update_one({"_id": item_id}, {"$set": encrypted_value}, upsert=False)
+        # the claim is unique by the user and the theme, the last chosen one is the current claim
+        result: Optional[dict] = await self.db["claim-data"].find_one(find_filter, sort=CURRENT_CLAIM_SORT)
+        return await self._decrypt_claim_data(result)
+
+    async def _decrypt_claim_data(self, result: Optional[dict]) -> Optional[MutableMapping]:
+        if result is None:
+            return None
+
+        if not self.encryptor.may_be_stale(result):
+            # most of the callers don't need the sensitive fields, so they are decrypted on access
+            return self.encryptor.decrypt_lazily(result)
+
+        decrypted_item: dict = copy.deepcopy(result)
+        if self.encryptor.decrypt_and_check(decrypted_item):
+            await self.reencrypt_record("claim-data", result, decrypted_item)
+        return decrypted_item
+
+    async def choose_claim(self, user_id: int, claim_theme: str) -> bool:
+        # makes the claim current and creates it if there is no claim with the theme yet, returns True if it's created
+        now: datetime = datetime.utcnow().replace(tzinfo=pytz.UTC)
+        claim_key: dict = {"user_id": user_id, "claim_theme": claim_theme}
+        try:
+            result = await self.db["claim-data"].update_one(
+                claim_key, {"$set": {"chosen": now}, "$setOnInsert": {"created": now, PROGRESS_FIELD: 0}}, upsert=True)
+        except DuplicateKeyError:
+            # the same claim was created concurrently
+            return False
+        return result.upserted_id is not None
+
+    def _get_claim_update(self, new_value: dict) -> dict:
+        # the progress of the claim is updated together with the written parts
+        progress_mask: int = get_update_progress_mask(new_value)
+        claim_update: dict = {"$set": self.encrypt_data(new_value)}
+        if progress_mask > 0:
+            claim_update["$bit"] = {PROGRESS_FIELD: {"or": progress_mask}}
+        return claim_update
+
+    async def update_claim_data(self, user_id: int, claim_theme: str, new_value: dict):
+        await self.db["claim-data"].update_one({"user_id": user_id, "claim_theme": claim_theme},
+                                               self._get_claim_update(new_value), upsert=False)
+
+    async def update_current_claim_data(self, user_id: int, new_value: dict) -> Optional[MutableMapping]:
+        # updates the current claim and returns it in the same round trip
+        result: Optional[dict] = await self.db["claim-data"].find_one_and_update(
+            {"user_id": user_id}, self._get_claim_update(new_value), sort=CURRENT_CLAIM_SORT,
+            return_document=ReturnDocument.AFTER)
+        return await self._decrypt_claim_data(result)
+
+    async def get_claim_progress(self, user_id: int) -> Optional[dict]:
+        # the projection is covered by user_id_chosen index, so the claim document itself isn't read
+        return await self.db["claim-data"].find_one({"user_id": user_id}, {PROGRESS_FIELD: 1, "_id": 0},
+                                                    sort=CURRENT_CLAIM_SORT)
+
+    async def backfill_claim_progress(self) -> int:
+        # $bit of a part update creates the missing progress with the bit of the written part only, so the claims
+        # without the progress must get it before the bot starts updating them
+        claims: List[dict] = await self.db["claim-data"].find({PROGRESS_FIELD: {"$exists": False}},
+                                                              {"claim_data": 1}).to_list(length=None)
+        if not any(claims):
+            return 0
+
+        await self.bulk_write("claim-data", [get_progress_backfill_request(claim) for claim in claims])
+        return len(claims)
 
-    def get_current_claim_theme(self, user_id: int) -> Optional[str]:
-        result = self.get_claim_data(user_id)
+    async def remove_claim_duplicates(self) -> int:
+        # only the last chosen claim of the same user and theme is kept, see the unique claim key
+        pipeline: List[dict] = [
+            {"$sort": {"chosen": DESCENDING, "_id": DESCENDING}},
+            {"$group": {"_id": {"user_id": "$user_id", "claim_theme": "$claim_theme"}, "ids": {"$push": "$_id"}}},
+            {"$match": {"ids.1": {"$exists": True}}}
+        ]
+        duplicate_ids: List[ObjectId] = []
+        async for group in self.db["claim-data"].aggregate(pipeline):
+            duplicate_ids.extend(group["ids"][1:])
+        if not any(duplicate_ids):
+            return 0
+
+        result = await self.db["claim-data"].delete_many({"_id": {"$in": duplicate_ids}})
+        return result.deleted_count
+
+    async def reencrypt_record(self, collection_name: str, encrypted_item: dict, decrypted_item: dict) -> bool:
+        # the document is replaced only if it wasn't changed since it was read
+        reencrypted_item: dict = self.encrypt_data(copy.deepcopy(decrypted_item))
+        result = await self.db[collection_name].replace_one(encrypted_item, reencrypted_item)
+        return result.modified_count == 1
+
+    async def get_records_batch(self, collection_name: str, last_id: Optional[Union[ObjectId, str]],
+                                batch_size: int) -> List[dict]:
+        find_filter: dict = {} if last_id is None else {"_id": {"$gt": last_id}}
+        return await self.db[collection_name].find(find_filter).sort("_id").limit(batch_size).to_list(length=None)
+
+    async def update_record(self, collection_name: str, item_id: ObjectId, new_value: dict):
+        encrypted_value: dict = self.encrypt_data(new_value)
+        await self.db[collection_name].update_one({"_id": item_id}, {"$set": encrypted_value}, upsert=False)
+
+    async def get_current_claim_theme(self, user_id: int) -> Optional[str]:
+        result = await self.get_claim_data(user_id)
         if result is not None:
             return result["claim_theme"]
         else:
             return None
 
-    def get_claim_tmp(self, claim_theme: str) -> Optional[dict]:
-        with self._get_mongo_client() as client:
-            result = list(client[self.db_name]["claim-tmps"].find({"theme": claim_theme}))
-            # there can be only one :)
-            if len(result) == 1:
-                return result[0]
-            if len(result) == 0:
-                return None
-            if len(result) > 1:
-                # TODO: how to hande this? Take latest?
-                return result[0]
-
-    def get_claim_tmp_examples(self, claim_theme: str, part: str) -> Optional[List[str]]:
-        claim_tmp: Optional[dict] = self.get_claim_tmp(claim_theme)
-        examples: Optional[List[str]] = None
-        if claim_tmp is not None and part in claim_tmp.keys() and "examples" in claim_tmp[part].keys():
-            examples = claim_tmp[part]["examples"]
-        return examples
-
-    def get_claim_tmp_options(self, claim_theme: str, part: str) -> Optional[List[str]]:
-        claim_tmp: Optional[dict] = self.get_claim_tmp(claim_theme)
-        options: Optional[List[str]] = None
-        if claim_tmp is not None and part in claim_tmp.keys() and "options" in claim_tmp[part].keys():
-            options = claim_tmp[part]["options"]
-        return options
-
-    def get_claim_tmp_actions(self, claim_theme: str, part: str) -> Optional[List[str]]:
-        claim_tmp: Optional[dict] = self.get_claim_tmp(claim_theme)
-        actions: Optional[List[str]] = None
-        if claim_tmp is not None and part in claim_tmp.keys() and "actions" in claim_tmp[part].keys():
-            actions = claim_tmp[part]["actions"]
-        return actions
-
-    def get_statistics(self, date: datetime) -> Optional[dict]:
-        with self._get_mongo_client() as client:
-            result = list(client[self.db_name]["statistics"].find({"date": date}))
-            # there can be only one :)
-            if len(result) == 1:
-                return result[0]
-            if len(result) == 0:
-                return None
-            if len(result) > 1:
-                # TODO: how to hande this? Take latest?
-                return result[0]
-
-    def get_statistics_slice(self, max_days: int = 30) -> List[dict]:
-        with self._get_mongo_client() as client:
-            result = list(client[self.db_name]["statistics"].find().sort("date", DESCENDING).limit(max_days))
-            return result
+    async def get_claim_tmp(self, claim_theme: str) -> Optional[dict]:
+        # templates almost never change, so they are read from the cache, which is warmed up in init_db.
+        # NOTE: the cached template is shared, don't modify it.
+        cached_tmp: Optional[CachedClaimTmp] = claim_tmp_cache.get(claim_theme)
+        if cached_tmp is not None:
+            return cached_tmp.claim_tmp
 
-    def is_collection(self, collection_name: str) -> bool:
-        with self._get_mongo_client() as client:
-            collections = list(client[self.db_name].list_collections())
-            collections_name = [c["name"] for c in collections]
-            return True if collection_name in collections_name else False
+        # the theme is unique, see db_indexes
+        claim_tmp: Optional[dict] = await self.db["claim-tmps"].find_one({"theme": claim_theme})
+        if claim_tmp is not None:
+            claim_tmp_cache.put(claim_tmp)
+        return claim_tmp
+
+    async def get_claim_tmp_history(self, claim_theme: str, version: str) -> Optional[dict]:
+        return await self.db["claim-tmps-history"].find_one({"theme": claim_theme, "version": version})
+
+    async def get_claim_tmp_examples(self, claim_theme: str, part: str) -> Optional[List[str]]:
+        claim_tmp: Optional[dict] = await self.get_claim_tmp(claim_theme)
+        return get_tmp_part_values(claim_tmp, part, "examples")
+
+    async def get_claim_tmp_options(self, claim_theme: str, part: str) -> Optional[List[str]]:
+        claim_tmp: Optional[dict] = await self.get_claim_tmp(claim_theme)
+        return get_tmp_part_values(claim_tmp, part, "options")
+
+    async def get_claim_tmp_actions(self, claim_theme: str, part: str) -> Optional[List[str]]:
+        claim_tmp: Optional[dict] = await self.get_claim_tmp(claim_theme)
+        return get_tmp_part_values(claim_tmp, part, "actions")
+
+    async def count_statistics_event(self, date: datetime, user_id_hash: str, event_name: str):
+        # the statistics are stored by the day and the user, so the documents don't grow with the number of users
+        await self.db["statistics"].update_one({"date": date, "user": user_id_hash},
+                                               {"$inc": {f"events.{event_name}": 1}}, upsert=True)
+
+    async def get_statistics_rollups(self, rollup_keys: List[Tuple[str, datetime]]) -> List[dict]:
+        # the rollups of the periods, which cover a dates range, are read by one query
+        dates: Dict[str, List[datetime]] = {}
+        for period, date in rollup_keys:
+            dates.setdefault(period, []).append(date)
+        if not any(dates):
+            return []
+
+        rollups: List[dict] = await self.db["statistics-rollups"].find(
+            {"$or": [{"period": period, "date": {"$in": period_dates}} for period, period_dates in dates.items()]},
+            {"_id": 0}).to_list(length=None)
+        for rollup in rollups:
+            if "packed_registers" in rollup.keys():
+                # the archived month, see statistics_retention
+                rollup["registers"] = {sketch_name: unpack_hll_registers(packed_registers)
+                                       for sketch_name, packed_registers in rollup.pop("packed_registers").items()}
+                continue
+
+            rollup["registers"] = {sketch_name: {int(index): rank for index, rank in registers.items()}
+                                   for sketch_name, registers in rollup.get("registers", {}).items()}
+        return rollups
+
+    async def get_statistics_dates(self) -> List[datetime]:
+        return await self.db["statistics"].distinct("date", {"user": {"$exists": True}})
+
+    async def get_rollup_dates(self, period: str) -> List[datetime]:
+        return await self.db["statistics-rollups"].distinct("date", {"period": period})
+
+    async def get_period_rollups(self, period: str, date_from: datetime, date_to: datetime) -> List[dict]:
+        return await self.get_statistics_rollups([(period, date_from + timedelta(days=days))
+                                                  for days in range((date_to - date_from).days + 1)])
+
+    async def get_day_statistics(self, date: datetime) -> List[dict]:
+        return await self.db["statistics"].find({"date": date, "user": {"$exists": True}},
+                                                {"_id": 0, "user": 1, "events": 1}).to_list(length=None)
+
+    async def iterate_statistics(self, date_from: datetime, date_to: datetime,
+                                 batch_size: int = 1000) -> AsyncIterator[dict]:
+        # the documents are fetched by batches, so any range can be read with bounded memory
+        cursor = self.db["statistics"].find({"date": {"$gte": date_from, "$lte": date_to}, "user": {"$exists": True}},
+                                            {"_id": 0, "date": 1, "user": 1, "events": 1}, batch_size=batch_size)
+        async for user_stats in cursor.sort([("date", ASCENDING), ("user", ASCENDING)]):
+            yield user_stats
+
+    async def get_last_packed_rollup_date(self) -> Optional[datetime]:
+        # the last compacted month, see statistics_retention
+        rollup: Optional[dict] = await self.db["statistics-rollups"].find_one(
+            {"period": "month", "packed_registers": {"$exists": True}}, {"_id": 0, "date": 1},
+            sort=[("date", DESCENDING)])
+        return rollup["date"] if rollup is not None else None
+
+    async def get_unpacked_rollups(self, period: str, date_to: datetime) -> List[dict]:
+        return await self.db["statistics-rollups"].find(
+            {"period": period, "date": {"$lt": date_to}, "packed_registers": {"$exists": False}}).to_list(length=None)
+
+    async def remove_items(self, collection_name: str, find_filter: dict) -> int:
+        result = await self.db[collection_name].delete_many(find_filter)
+        return result.deleted_count
+
+    async def get_collection_size(self, collection_name: str) -> int:
+        # the size of the documents without the indexes and the preallocated storage
+        collection_stats: dict = await self.db.command("collStats", collection_name)
+        return collection_stats.get("size", 0)
+
+    async def get_legacy_statistics(self) -> List[dict]:
+        # the day documents with all the users of the day, which were used before the statistics by the user
+        return await self.db["statistics"].find({"unique_users": {"$exists": True}}).to_list(length=None)
+
+    async def bulk_write(self, collection_name: str, requests: list, ordered: bool = False):
+        await self.db[collection_name].bulk_write(requests, ordered=ordered)
+
+    async def get_fsm_record(self, key: str) -> Optional[dict]:
+        return await self.db["fsm-states"].find_one({"_id": key})
+
+    async def get_seed_versions(self) -> Dict[str, str]:
+        seed_versions: List[dict] = await self.db["seed-versions"].find().to_list(length=None)
+        return {seed_version["_id"]: seed_version["version"] for seed_version in seed_versions}
+
+    async def create_indexes(self, collection_name: str, indexes: List[IndexModel]) -> List[str]:
+        return await self.db[collection_name].create_indexes(indexes)
+
+    async def get_index_names(self, collection_name: str) -> List[str]:
+        index_information: dict = await self.get_index_information(collection_name)
+        return list(index_information.keys())
+
+    async def get_index_information(self, collection_name: str) -> dict:
+        return await self.db[collection_name].index_information()
+
+    async def drop_index(self, collection_name: str, index_name: str):
+        await self.db[collection_name].drop_index(index_name)
+
+    async def explain_find(self, collection_name: str, find_filter: dict,
+                           sort: Optional[List[Tuple[str, int]]] = None) -> dict:
+        cursor = self.db[collection_name].find(find_filter)
+        if sort is not None:
+            cursor = cursor.sort(sort)
+        return await cursor.explain()
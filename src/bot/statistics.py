@@ -1,12 +1,28 @@
-from datetime import datetime
-from typing import Optional
+import asyncio
+import csv
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, Any, Dict, Tuple, Optional, Set, TextIO
 
 import pytz
 from hashlib import blake2b
 from aiogram import types
 from aiogram.dispatcher import FSMContext
+from pymongo import UpdateOne, DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError
 
-from repository import Repository
+import bot_config
+from common import get_hll_register, merge_hll_registers
+from repository import AsyncRepository
+
+# the statistics are rolled up by these periods, a rollup is stored by the first day of the period
+DAY_ROLLUP: str = "day"
+WEEK_ROLLUP: str = "week"
+MONTH_ROLLUP: str = "month"
+ROLLUP_PERIODS: List[str] = [DAY_ROLLUP, WEEK_ROLLUP, MONTH_ROLLUP]
+# the sketch of all the users of the period, the other sketches of the period are by the event name
+ALL_USERS_SKETCH: str = "*"
 
 
 def get_user_id_hash(user_id: int) -> str:
@@ -15,38 +31,297 @@ def get_user_id_hash(user_id: int) -> str:
     return h.hexdigest()
 
 
-def count_event(event_name: str, user_id: int):
-    repository: Repository = Repository()
+StatisticsEvent = namedtuple("StatisticsEvent", ["date", "user_id_hash", "event_name"])
+
+
+def get_statistics_requests(events: List[StatisticsEvent]) -> List[UpdateOne]:
+    # the events of the same user and day are written by one update
+    events_count: Dict[Tuple[datetime, str], Dict[str, int]] = {}
+    for event in events:
+        user_events_count: Dict[str, int] = events_count.setdefault((event.date, event.user_id_hash), {})
+        user_events_count[event.event_name] = user_events_count.get(event.event_name, 0) + 1
+
+    return [
+        UpdateOne({"date": date, "user": user_id_hash},
+                  {"$inc": {f"events.{event_name}": count for event_name, count in user_events_count.items()}},
+                  upsert=True)
+        for (date, user_id_hash), user_events_count in events_count.items()
+    ]
+
+
+def get_next_month(date: datetime) -> datetime:
+    return (date.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def get_rollup_dates(date: datetime) -> Dict[str, datetime]:
+    # the first days of the periods, which contain the date
+    return {
+        DAY_ROLLUP: date,
+        WEEK_ROLLUP: date - timedelta(days=date.weekday()),
+        MONTH_ROLLUP: date.replace(day=1)
+    }
+
+
+def get_rollup_requests(events: List[StatisticsEvent], periods: List[str] = ROLLUP_PERIODS) -> List[UpdateOne]:
+    # the events count and the unique users sketches of the periods are updated incrementally, see common.hyperloglog
+    updates: Dict[Tuple[str, datetime], Dict[str, Dict[str, int]]] = {}
+    for event in events:
+        index, rank = get_hll_register(event.user_id_hash)
+        for period, date in get_rollup_dates(event.date).items():
+            if period not in periods:
+                continue
+
+            update: Dict[str, Dict[str, int]] = updates.setdefault((period, date), {"$inc": {}, "$max": {}})
+            event_field: str = f"events.{event.event_name}"
+            update["$inc"][event_field] = update["$inc"].get(event_field, 0) + 1
+            for sketch_name in (ALL_USERS_SKETCH, event.event_name):
+                register_field: str = f"registers.{sketch_name}.{index}"
+                update["$max"][register_field] = max(update["$max"].get(register_field, 0), rank)
+
+    return [UpdateOne({"period": period, "date": date}, update, upsert=True)
+            for (period, date), update in updates.items()]
+
+
+def get_covering_rollup_keys(date_from: datetime, date_to: datetime) -> List[Tuple[str, datetime]]:
+    # the smallest number of the rollups, e.g. a year is covered by 12 months and a few weeks and days
+    rollup_keys: List[Tuple[str, datetime]] = []
+    date: datetime = date_from
+    while date <= date_to:
+        next_month: datetime = get_next_month(date)
+        if date.day == 1 and next_month - timedelta(days=1) <= date_to:
+            rollup_keys.append((MONTH_ROLLUP, date))
+            date = next_month
+        # the week, which overlaps the next whole month, is covered by days
+        elif date.weekday() == 0 and date + timedelta(days=6) <= date_to and \
+                (date + timedelta(days=6) < next_month or get_next_month(next_month) - timedelta(days=1) > date_to):
+            rollup_keys.append((WEEK_ROLLUP, date))
+            date += timedelta(days=7)
+        else:
+            rollup_keys.append((DAY_ROLLUP, date))
+            date += timedelta(days=1)
+    return rollup_keys
+
+
+def merge_rollups(rollups: List[dict]) -> Tuple[Dict[str, int], Dict[str, Dict[int, int]]]:
+    # returns the events count and the unique users sketches of the rollups together
+    events_count: Dict[str, int] = {}
+    sketches: Dict[str, Dict[int, int]] = {}
+    for rollup in rollups:
+        for event_name, count in rollup.get("events", {}).items():
+            events_count[event_name] = events_count.get(event_name, 0) + count
+        for sketch_name, registers in rollup.get("registers", {}).items():
+            sketches[sketch_name] = merge_hll_registers(sketches.get(sketch_name, {}), registers)
+    return events_count, sketches
+
+
+def get_rollup_document(period: str, date: datetime, rollups: List[dict]) -> dict:
+    events_count, sketches = merge_rollups(rollups)
+    return {
+        "period": period,
+        "date": date,
+        "events": events_count,
+        "registers": {sketch_name: {str(index): rank for index, rank in registers.items()}
+                      for sketch_name, registers in sketches.items()}
+    }
+
+
+# The events are queued by the handlers and written to the db in the background by one bulk write, when the flush
+# interval is passed or enough events are queued. If the queue is full, the events are dropped. The rollups of
+# the written events are updated by another bulk write, if it fails, the failed updates are retried by the next
+# flushes, because build_statistics_rollups never rebuilds a day, which already has a rollup.
+class StatisticsBuffer:
+    def __init__(self, max_size: int = 10000, flush_size: int = 500, flush_interval_sec: float = 5):
+        self.max_size: int = max_size
+        self.flush_size: int = flush_size
+        self.flush_interval_sec: float = flush_interval_sec
+        self.queue: Optional[asyncio.Queue] = None
+        self.flush_requested: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.rollup_requests: List[UpdateOne] = []
+        self.is_stopping: bool = False
+        self.logger = logging.getLogger("STATISTICS")
+        self.stats: Dict[str, int] = {
+            "queued": 0,
+            "dropped": 0,
+            "flushed": 0,
+            "failed": 0,
+            "flushes": 0,
+            "rollups_retried": 0,
+            "rollups_dropped": 0
+        }
+
+    @property
+    def is_started(self) -> bool:
+        return self.task is not None
+
+    def start(self):
+        if self.is_started:
+            return
+
+        self.queue = asyncio.Queue(self.max_size)
+        self.flush_requested = asyncio.Event()
+        self.is_stopping = False
+        self.task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if not self.is_started:
+            return
+
+        # the task isn't cancelled, so the flush in progress is completed
+        self.is_stopping = True
+        self.flush_requested.set()
+        await self.task
+        self.task = None
+        # the rest of the events must not be lost on shutdown
+        await self.flush()
+
+    def put(self, event: StatisticsEvent):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return
+
+        self.stats["queued"] += 1
+        if self.queue.qsize() >= self.flush_size:
+            self.flush_requested.set()
+
+    async def _run(self):
+        while not self.is_stopping:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), timeout=self.flush_interval_sec)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            await self.flush()
+
+    async def flush(self):
+        events: List[StatisticsEvent] = []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        if not any(events) and not any(self.rollup_requests):
+            return
+
+        repository: AsyncRepository = AsyncRepository()
+        if any(events):
+            try:
+                await repository.bulk_write("statistics", get_statistics_requests(events))
+            except Exception:
+                self.stats["failed"] += len(events)
+                self.logger.exception(f"Failed to write {len(events)} statistics events")
+                events = []
+            else:
+                self.stats["flushed"] += len(events)
+                self.stats["flushes"] += 1
+
+        rollup_requests: List[UpdateOne] = self.rollup_requests + get_rollup_requests(events)
+        self.rollup_requests = []
+        if not any(rollup_requests):
+            return
+
+        try:
+            await repository.bulk_write("statistics-rollups", rollup_requests)
+        except BulkWriteError as ex:
+            # the unordered bulk write applies all the requests but the failed ones, so only they are retried
+            self._retry_rollup_requests([rollup_requests[error["index"]]
+                                         for error in ex.details.get("writeErrors", [])])
+        except Exception:
+            self._retry_rollup_requests(rollup_requests)
+
+    def _retry_rollup_requests(self, rollup_requests: List[UpdateOne]):
+        self.logger.exception(f"Failed to update {len(rollup_requests)} statistics rollups")
+        # the retried requests are bounded as the queue, the oldest ones are dropped
+        dropped_count: int = max(len(rollup_requests) - self.max_size, 0)
+        self.rollup_requests = rollup_requests[dropped_count:]
+        self.stats["rollups_retried"] += len(self.rollup_requests)
+        self.stats["rollups_dropped"] += dropped_count
+
+
+statistics_buffer: StatisticsBuffer = StatisticsBuffer()
+
+
+def start_statistics_buffer():
+    statistics_buffer.max_size = bot_config.get_int("STATISTICS_QUEUE_SIZE", statistics_buffer.max_size)
+    statistics_buffer.flush_size = bot_config.get_int("STATISTICS_FLUSH_SIZE", statistics_buffer.flush_size)
+    statistics_buffer.flush_interval_sec = bot_config.get_int("STATISTICS_FLUSH_INTERVAL_SEC",
+                                                              statistics_buffer.flush_interval_sec)
+    statistics_buffer.start()
+
+
+async def count_event(event_name: str, user_id: int):
     current_date: datetime = datetime.utcnow().replace(tzinfo=pytz.UTC, hour=0, minute=0, second=0, microsecond=0)
-    current_stats: Optional[dict] = repository.get_statistics(current_date)
     user_id_hash: str = get_user_id_hash(user_id)
-    if current_stats is None:
-        new_stats = {
-            "date": current_date,
-            "unique_users": {
-                user_id_hash: {
-                    event_name: 1
-                }
-            }
-        }
-        repository.insert_item("statistics", new_stats)
+    if statistics_buffer.is_started:
+        statistics_buffer.put(StatisticsEvent(current_date, user_id_hash, event_name))
         return
 
-    stats_update: dict = {}
-    if "unique_users" in current_stats.keys():
-        if user_id_hash in current_stats["unique_users"].keys():
-            event_count = current_stats["unique_users"][user_id_hash].get(event_name, 0)
-            stats_update = {
-                f"unique_users.{user_id_hash}.{event_name}": event_count + 1
-            }
-        else:
-            stats_update = {
-                f"unique_users.{user_id_hash}": {
-                    event_name: 1
-                }
-            }
+    # e.g. in scripts the buffer isn't started and the event is written right away
+    repository: AsyncRepository = AsyncRepository()
+    await repository.count_statistics_event(current_date, user_id_hash, event_name)
+    await repository.bulk_write("statistics-rollups",
+                                get_rollup_requests([StatisticsEvent(current_date, user_id_hash, event_name)]))
+
+
+def get_legacy_statistics_requests(day_stats: dict) -> List[Any]:
+    # $max keeps the migration idempotent, the events of the day can't be counted before it's migrated
+    requests: List[Any] = [
+        UpdateOne({"date": day_stats["date"], "user": user_id_hash},
+                  {"$max": {f"events.{event_name}": count for event_name, count in events.items()}}, upsert=True)
+        for user_id_hash, events in day_stats["unique_users"].items() if any(events)
+    ]
+    requests.append(DeleteOne({"_id": day_stats["_id"]}))
+    return requests
+
+
+async def migrate_legacy_statistics(repository: AsyncRepository):
+    logger = logging.getLogger("STATISTICS")
+    for day_stats in await repository.get_legacy_statistics():
+        await repository.bulk_write("statistics", get_legacy_statistics_requests(day_stats), ordered=True)
+        logger.info(f"Statistics of {day_stats['date']} are migrated.")
+
+
+async def build_statistics_rollups(repository: AsyncRepository):
+    # The rollups of the days counted before them. Only the days without a rollup are aggregated, the past days are
+    # never aggregated again. The weeks and the months of these days are rebuilt from the day rollups.
+    logger = logging.getLogger("STATISTICS")
+    rollup_dates: List[datetime] = [date.replace(tzinfo=pytz.UTC)
+                                    for date in await repository.get_rollup_dates(DAY_ROLLUP)]
+    changed_rollup_keys: Set[Tuple[str, datetime]] = set()
+    for date in await repository.get_statistics_dates():
+        date = date.replace(tzinfo=pytz.UTC)
+        if date in rollup_dates:
+            continue
+
+        events: List[StatisticsEvent] = [StatisticsEvent(date, user_stats["user"], event_name)
+                                         for user_stats in await repository.get_day_statistics(date)
+                                         for event_name, count in user_stats.get("events", {}).items()
+                                         for _ in range(count)]
+        await repository.bulk_write("statistics-rollups", get_rollup_requests(events, [DAY_ROLLUP]))
+        changed_rollup_keys.update((period, period_date) for period, period_date in get_rollup_dates(date).items()
+                                   if period != DAY_ROLLUP)
+        logger.info(f"Statistics of {date} are rolled up.")
+
+    for period, date in changed_rollup_keys:
+        last_date: datetime = date + timedelta(days=6) if period == WEEK_ROLLUP else \
+            get_next_month(date) - timedelta(days=1)
+        day_rollups: List[dict] = await repository.get_period_rollups(DAY_ROLLUP, date, last_date)
+        await repository.bulk_write("statistics-rollups", [
+            ReplaceOne({"period": period, "date": date}, get_rollup_document(period, date, day_rollups), upsert=True)
+        ])
+
 
-    repository.update_record("statistics", current_stats["_id"], stats_update)
+async def export_statistics(repository: AsyncRepository, date_from: datetime, date_to: datetime,
+                            export_file: TextIO) -> int:
+    # the rows are written as they are read, returns the number of the rows
+    writer = csv.writer(export_file)
+    writer.writerow(["date", "user", "event", "count"])
+    rows_count: int = 0
+    async for user_stats in repository.iterate_statistics(date_from, date_to):
+        date: str = user_stats["date"].strftime("%Y-%m-%d")
+        for event_name, count in sorted(user_stats.get("events", {}).items()):
+            writer.writerow([date, user_stats["user"], event_name, count])
+            rows_count += 1
+    return rows_count
 
 
 def collect_statistic(event_name: str):
@@ -54,7 +329,7 @@ def collect_statistic(event_name: str):
         async def wrapper(message: types.Message, state: FSMContext):
             try:
                 user_id: int = message.from_user.id
-                count_event(event_name, user_id)
+                await count_event(event_name, user_id)
             except Exception as ex:
                 print(f"Error occurred while collection statistics: {ex}")
 
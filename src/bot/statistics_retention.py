@@ -0,0 +1,152 @@
+import asyncio
+import gzip
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+from pymongo import ReplaceOne
+
+import bot_config
+from common import estimate_hll_cardinality, pack_hll_registers
+from repository import AsyncRepository
+from statistics import DAY_ROLLUP, WEEK_ROLLUP, MONTH_ROLLUP, ALL_USERS_SKETCH, get_next_month, export_statistics
+
+STATISTICS_COLLECTIONS: List[str] = ["statistics", "statistics-rollups"]
+
+# progress of the statistics compaction, see compact_statistics
+retention_stats: Dict[str, int] = {
+    "runs": 0,
+    "packed_months": 0,
+    "removed_documents": 0,
+    "reclaimed_bytes": 0,
+    "failed": 0
+}
+
+_retention_task: Optional[asyncio.Task] = None
+
+
+def get_packed_rollup_document(rollup: dict) -> dict:
+    # the sketches of the month are stored as the compressed registers arrays, see common.hyperloglog
+    registers: Dict[str, Dict[int, int]] = {sketch_name: {int(index): rank for index, rank in sketch_registers.items()}
+                                            for sketch_name, sketch_registers in rollup.get("registers", {}).items()}
+    return {
+        "period": rollup["period"],
+        "date": rollup["date"],
+        "events": rollup.get("events", {}),
+        "unique_users": estimate_hll_cardinality(registers.get(ALL_USERS_SKETCH, {})),
+        "packed_registers": {sketch_name: pack_hll_registers(sketch_registers)
+                             for sketch_name, sketch_registers in registers.items()}
+    }
+
+
+def get_compacted_rollups_filter(compact_before: datetime) -> dict:
+    # The week, which starts in a compacted month and ends in the next one, is still used by /stats for the next month,
+    # so it's kept with the days from its start, which it's rebuilt from (see build_statistics_rollups). The weeks
+    # start on Monday, so the removed weeks are the ones, which end before the compacted months end.
+    keep_from: datetime = compact_before - timedelta(days=compact_before.weekday())
+    return {"period": {"$in": [DAY_ROLLUP, WEEK_ROLLUP]}, "date": {"$lt": keep_from}}
+
+
+async def get_compacted_before(repository: AsyncRepository) -> Optional[datetime]:
+    # the statistics before this date are kept only as the packed months
+    last_packed_date: Optional[datetime] = await repository.get_last_packed_rollup_date()
+    if last_packed_date is None:
+        return None
+    return get_next_month(last_packed_date.replace(tzinfo=pytz.UTC))
+
+
+def get_compacted_range(date_from: datetime, date_to: datetime, compacted_before: Optional[datetime]) -> \
+        Tuple[datetime, datetime]:
+    # The days and the weeks of the compacted months are removed, so a range is widened to the whole compacted months,
+    # which it touches. The compacted months end before compacted_before, so the widened range is covered by them.
+    if compacted_before is None:
+        return date_from, date_to
+
+    if date_from < compacted_before:
+        date_from = date_from.replace(day=1)
+    if date_to < compacted_before:
+        date_to = get_next_month(date_to) - timedelta(days=1)
+    return date_from, date_to
+
+
+async def archive_statistics(repository: AsyncRepository, date_from: datetime, date_to: datetime, archive_dir: str):
+    archive_path: str = os.path.join(archive_dir, f"statistics_{date_from.strftime('%Y%m')}.csv.gz")
+    with gzip.open(archive_path, "wt", newline="", encoding="utf-8") as archive_file:
+        await export_statistics(repository, date_from, date_to, archive_file)
+
+
+async def compact_statistics(repository: AsyncRepository, retention_days: int, archive_dir: Optional[str] = None):
+    # The months, all days of which are older than the retention, are kept only as the month rollups with the packed
+    # sketches. The statistics by the user and the day and week rollups of these months are removed (and archived
+    # to CSV files before, if the directory is set). The raw statistics are removed first, so an interrupted
+    # compaction never makes build_statistics_rollups rebuild a packed month from a part of its days.
+    logger = logging.getLogger("STATISTICS_RETENTION")
+    current_date: datetime = datetime.utcnow().replace(tzinfo=pytz.UTC, hour=0, minute=0, second=0, microsecond=0)
+    compact_before: datetime = (current_date - timedelta(days=retention_days)).replace(day=1)
+    size_before: int = 0
+    for collection_name in STATISTICS_COLLECTIONS:
+        size_before += await repository.get_collection_size(collection_name)
+
+    for rollup in await repository.get_unpacked_rollups(MONTH_ROLLUP, compact_before):
+        date_from: datetime = rollup["date"].replace(tzinfo=pytz.UTC)
+        if archive_dir is not None:
+            await archive_statistics(repository, date_from, get_next_month(date_from) - timedelta(days=1),
+                                     archive_dir)
+
+        await repository.bulk_write("statistics-rollups", [
+            ReplaceOne({"period": MONTH_ROLLUP, "date": rollup["date"]}, get_packed_rollup_document(rollup))
+        ])
+        retention_stats["packed_months"] += 1
+        logger.info(f"Statistics of the month {date_from.strftime('%m.%Y')} are packed.")
+
+    retention_stats["removed_documents"] += await repository.remove_items(
+        "statistics", {"date": {"$lt": compact_before}, "user": {"$exists": True}})
+    retention_stats["removed_documents"] += await repository.remove_items(
+        "statistics-rollups", get_compacted_rollups_filter(compact_before))
+
+    size_after: int = 0
+    for collection_name in STATISTICS_COLLECTIONS:
+        size_after += await repository.get_collection_size(collection_name)
+    retention_stats["reclaimed_bytes"] += max(size_before - size_after, 0)
+    retention_stats["runs"] += 1
+    logger.info(f"Statistics compaction is finished: {retention_stats}")
+
+
+async def run_statistics_retention(repository: AsyncRepository, retention_days: int, archive_dir: Optional[str],
+                                   interval_sec: float):
+    logger = logging.getLogger("STATISTICS_RETENTION")
+    while True:
+        try:
+            await compact_statistics(repository, retention_days, archive_dir)
+        except Exception:
+            # the next run continues from the same place
+            retention_stats["failed"] += 1
+            logger.exception("Failed to compact statistics")
+        await asyncio.sleep(interval_sec)
+
+
+def start_statistics_retention():
+    global _retention_task
+    retention_days: int = bot_config.get_int("STATISTICS_RETENTION_DAYS", 0)
+    if retention_days == 0 or _retention_task is not None:
+        return
+
+    archive_dir: Optional[str] = bot_config.get_config().get("STATISTICS_ARCHIVE_DIR") or None
+    interval_sec: int = bot_config.get_int("STATISTICS_RETENTION_INTERVAL_H", 24) * 3600
+    _retention_task = asyncio.ensure_future(run_statistics_retention(AsyncRepository(), retention_days, archive_dir,
+                                                                     interval_sec))
+
+
+async def stop_statistics_retention():
+    global _retention_task
+    if _retention_task is None:
+        return
+
+    _retention_task.cancel()
+    try:
+        await _retention_task
+    except asyncio.CancelledError:
+        pass
+    _retention_task = None
@@ -0,0 +1,48 @@
+from claim_funnel import ClaimFunnel, LatencyHistogram, format_latency, DOCUMENT_STEP
+
+
+def test_latency_histogram():
+    histogram: LatencyHistogram = LatencyHistogram()
+    assert histogram.get_percentile(0.5) is None
+    for latency_sec in [0.5, 3, 4, 50, 100000]:
+        histogram.add(latency_sec)
+    assert histogram.count == 5
+    assert histogram.get_percentile(0.5) == 5
+    assert histogram.get_percentile(0.7) == 60
+    assert histogram.get_percentile(0.9) == float("inf")
+    assert histogram.get_mean() == 100057.5 / 5
+
+
+def test_format_latency():
+    assert format_latency(None) == "-"
+    assert format_latency(30) == "30 с"
+    assert format_latency(600) == "10 мин"
+    assert format_latency(5400) == "1.5 ч"
+    assert format_latency(float("inf")) == "> 24 ч"
+
+
+def test_claim_funnel():
+    now: list = [0]
+    funnel: ClaimFunnel = ClaimFunnel(max_sessions=2, clock=lambda: now[0])
+    funnel.start_step(1, "head")
+    assert funnel.get_report() == {}
+
+    funnel.start_claim(1, "theme")
+    funnel.start_step(1, "head")
+    now[0] = 100
+    funnel.complete_step(1, "head")
+    # the part is saved again without the start
+    funnel.complete_step(1, "head")
+    funnel.start_step(1, "story")
+    now[0] = 400
+    funnel.finish_claim(1)
+
+    report = funnel.get_report()
+    assert [(step, started_count, histogram.count, histogram.total_sec)
+            for step, started_count, histogram in report["theme"]] == [
+        (DOCUMENT_STEP, 1, 1, 400), ("head", 1, 1, 100), ("story", 1, 0, 0)
+    ]
+
+    for user_id in [2, 3, 4]:
+        funnel.start_claim(user_id, "theme")
+    assert list(funnel.sessions.keys()) == [3, 4]
@@ -0,0 +1,27 @@
+from pymongo import UpdateOne
+
+from common.claim_progress import get_part_mask, get_update_progress_mask, get_claim_data_progress, \
+    get_progress_parts
+from repository import get_progress_backfill_request
+
+
+def test_update_progress_mask():
+    assert get_update_progress_mask({"claim_data.head": {}, "claim_data.claims": {}}) == \
+           get_part_mask("head") | get_part_mask("claims")
+    assert get_update_progress_mask({"chosen": 1, "claim_data.unknown": {}, "claim_data.head.user_name": ""}) == 0
+
+
+def test_progress_parts():
+    claim_data: dict = {"claim_data": {"head": {}, "story": {}}}
+    progress: int = get_claim_data_progress(claim_data)
+    assert get_progress_parts(progress) == {"head", "story"}
+    assert get_claim_data_progress({"claim_theme": "theme"}) == 0
+    assert get_progress_parts(0) == set()
+
+
+def test_progress_backfill_request():
+    # the claim created before the progress field, the sensitive fields are encrypted
+    legacy_claim: dict = {"_id": 1, "claim_data": {"head": {"_sealed": b"encrypted"}, "story": {"user_salary": "1"}}}
+    assert get_progress_backfill_request(legacy_claim) == \
+        UpdateOne({"_id": 1, "progress": {"$exists": False}},
+                  {"$set": {"progress": get_part_mask("head") | get_part_mask("story")}})
@@ -0,0 +1,82 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+import claim_session
+from claim_session import ClaimSession
+
+
+class FakeRepository:
+    def __init__(self):
+        self.round_trips: int = 0
+        self.writes: List[Tuple[str, dict]] = []
+
+    async def update_current_claim_data(self, user_id: int, new_value: dict) -> Optional[dict]:
+        self.writes.append(("current", new_value))
+        return {"claim_theme": "theme", "claim_data": {"head": {"user_name": "Иванов"}}}
+
+    async def update_claim_data(self, user_id: int, claim_theme: str, new_value: dict):
+        self.writes.append((claim_theme, new_value))
+
+
+def test_claim_session_write_behind(monkeypatch):
+    monkeypatch.setattr(claim_session, "AsyncRepository", FakeRepository)
+
+    async def run_session():
+        session: ClaimSession = ClaimSession(1, is_write_behind=True)
+        await session.update_claim_data({"claim_data.head.user_name": "Иванов"})
+        await session.update_claim_data({"claim_data.story.user_position": "инженер"})
+        assert session.repository.writes == []
+        # the claim is read, so the changes are written by the call, which returns it
+        assert await session.get_filled_parts() == {"head"}
+        assert len(session.repository.writes) == 1
+
+        await session.update_claim_data({"claim_data.story.user_salary": "50000"})
+        claim_data: dict = await session.get_claim_data()
+        assert claim_data["claim_data"]["story"]["user_salary"] == "50000"
+        await session.flush()
+        await session.flush()
+        return session.repository.writes
+
+    loop = asyncio.new_event_loop()
+    writes: List[Tuple[str, dict]] = loop.run_until_complete(run_session())
+    loop.close()
+    assert writes == [
+        ("current", {"claim_data.head.user_name": "Иванов", "claim_data.story.user_position": "инженер"}),
+        ("theme", {"claim_data.story.user_salary": "50000"})
+    ]
+
+
+def test_claim_session_standalone(monkeypatch):
+    monkeypatch.setattr(claim_session, "AsyncRepository", FakeRepository)
+
+    async def run_session():
+        session: ClaimSession = ClaimSession(1)
+        await session.update_claim_data({"claim_data.head.user_name": "Иванов"})
+        return session.repository.writes
+
+    loop = asyncio.new_event_loop()
+    writes: List[Tuple[str, dict]] = loop.run_until_complete(run_session())
+    loop.close()
+    assert writes == [("current", {"claim_data.head.user_name": "Иванов"})]
+
+
+class FailingRepository(FakeRepository):
+    async def update_current_claim_data(self, user_id: int, new_value: dict) -> Optional[dict]:
+        raise ConnectionError()
+
+
+def test_claim_session_save_failed(monkeypatch):
+    monkeypatch.setattr(claim_session, "AsyncRepository", FailingRepository)
+
+    async def run_session():
+        session: ClaimSession = ClaimSession(1, is_write_behind=True)
+        is_saved: bool = await session.save_claim_data({"claim_data.head.user_name": "Иванов"})
+        # nothing is left to be written in the end of the update
+        await session.flush()
+        return is_saved
+
+    loop = asyncio.new_event_loop()
+    failed_writes: int = claim_session.session_stats["failed_writes"]
+    assert loop.run_until_complete(run_session()) is False
+    loop.close()
+    assert claim_session.session_stats["failed_writes"] == failed_writes + 1
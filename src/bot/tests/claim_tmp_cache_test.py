@@ -0,0 +1,34 @@
+from claim_tmp_cache import ClaimTmpCache, get_claim_tmp_version
+
+
+def test_get_claim_tmp_version():
+    claim_tmp: dict = {"theme": "theme", "story": {"examples": ["example"]}}
+    assert get_claim_tmp_version(claim_tmp) == get_claim_tmp_version({"_id": 1, **claim_tmp})
+    assert get_claim_tmp_version(claim_tmp) != get_claim_tmp_version({"theme": "theme", "story": {}})
+    assert get_claim_tmp_version({"version": "v1", **claim_tmp}) == "v1"
+
+
+def test_cache_hit_and_invalidation():
+    cache: ClaimTmpCache = ClaimTmpCache()
+    assert cache.get("theme") is None
+
+    cache.put_all([{"theme": "theme"}, {"theme": "another theme"}])
+    assert cache.get_themes() == ["theme", "another theme"]
+    assert cache.get("theme").claim_tmp == {"theme": "theme"}
+
+    cache.invalidate("theme")
+    assert cache.get("theme") is None
+    assert cache.get("another theme") is not None
+    assert cache.get_themes() is None
+    assert cache.get_stats() == {"templates": 1, "hits": 2, "misses": 2}
+
+
+def test_cache_ttl():
+    cache: ClaimTmpCache = ClaimTmpCache(ttl_sec=60)
+    cache.put_all([{"theme": "theme"}])
+    assert cache.get("theme") is not None
+
+    cache.claim_tmps["theme"] = cache.claim_tmps["theme"]._replace(loaded_at=0)
+    cache.themes_loaded_at = 0
+    assert cache.get("theme") is None
+    assert cache.get_themes() is None
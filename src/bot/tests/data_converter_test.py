@@ -0,0 +1,13 @@
+from common.data_converter import get_chosen_options
+
+
+def test_get_chosen_options():
+    claim_data: dict = {"essence": {"chosen_options": [1, "own option", 0, 5]}}
+    tmp_options: dict = {"essence": ["first option", "second option"]}
+    assert get_chosen_options(claim_data, "essence", tmp_options) == ["second option", "own option", "first option"]
+
+
+def test_get_chosen_options_text():
+    # the claims saved before the options were stored as indexes
+    claim_data: dict = {"proofs": {"chosen_options": ["first option", "own option"]}}
+    assert get_chosen_options(claim_data, "proofs") == ["first option", "own option"]
@@ -0,0 +1,24 @@
+from db_indexes import get_plan_index_names
+
+
+def test_get_plan_index_names():
+    collection_scan: dict = {"stage": "COLLSCAN"}
+    assert get_plan_index_names(collection_scan) == []
+
+    index_scan: dict = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "IXSCAN",
+            "indexName": "user_id_claim_theme"
+        }
+    }
+    assert get_plan_index_names(index_scan) == ["user_id_claim_theme"]
+
+    index_or: dict = {
+        "stage": "SUBPLAN",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [{"stage": "IXSCAN", "indexName": "date"}, {"stage": "IXSCAN", "indexName": "post"}]
+        }
+    }
+    assert get_plan_index_names(index_or) == ["date", "post"]
@@ -0,0 +1,62 @@
+import asyncio
+import json
+from typing import Dict, List
+
+from pymongo import ReplaceOne, DeleteMany
+
+import db_seed
+from claim_tmp_cache import get_claim_tmp_version
+from db_seed import load_seed_file, get_claim_tmp_requests, get_regions_requests, seed_db
+
+
+def test_load_seed_file(tmp_path):
+    seed_path = tmp_path / "seed.json"
+    seed_path.write_text(json.dumps({"theme": "theme"}))
+    version, data = load_seed_file(str(seed_path))
+    assert data == {"theme": "theme"}
+    assert load_seed_file(str(seed_path))[0] == version
+
+    seed_path.write_text(json.dumps({"theme": "another theme"}))
+    assert load_seed_file(str(seed_path))[0] != version
+
+
+def test_seed_requests():
+    claim_tmp: dict = {"theme": "theme", "version": "v1"}
+    assert get_claim_tmp_requests([claim_tmp]) == [ReplaceOne({"theme": "theme"}, claim_tmp, upsert=True)]
+
+    region: dict = {"name": "region", "code": 1, "post": ["123"]}
+    assert get_regions_requests([region]) == [
+        ReplaceOne({"name": "region"}, region, upsert=True),
+        DeleteMany({"name": {"$nin": ["region"]}})
+    ]
+
+
+class FakeRepository:
+    def __init__(self, claim_tmps: List[dict]):
+        self.claim_tmps: List[dict] = claim_tmps
+        self.requests: Dict[str, list] = {}
+
+    async def get_seed_versions(self) -> Dict[str, str]:
+        return {}
+
+    async def get_claim_tmps(self) -> List[dict]:
+        return self.claim_tmps
+
+    async def bulk_write(self, collection_name: str, requests: list):
+        self.requests.setdefault(collection_name, []).extend(requests)
+
+
+def test_seed_db_keeps_stored_versions(tmp_path, monkeypatch):
+    (tmp_path / "theme.json").write_text(json.dumps({"theme": "theme", "claims": {"options": ["new option"]}}))
+    (tmp_path / "regions.json").write_text(json.dumps([]))
+    monkeypatch.setattr(db_seed, "CLAIM_TMPS_PATTERN", str(tmp_path / "theme.json"))
+    monkeypatch.setattr(db_seed, "REGIONS_FILE_PATH", str(tmp_path / "regions.json"))
+    # the template was stored before the history, the claims refer to the hash of its content
+    stored_claim_tmp: dict = {"theme": "theme", "claims": {"options": ["option"]}}
+    repository: FakeRepository = FakeRepository([stored_claim_tmp])
+
+    loop = asyncio.new_event_loop()
+    seeded_versions: Dict[str, str] = loop.run_until_complete(seed_db(repository))
+    loop.close()
+    history_versions: List[str] = [request._doc["version"] for request in repository.requests["claim-tmps-history"]]
+    assert history_versions == [get_claim_tmp_version(stored_claim_tmp), seeded_versions["claim_templates/theme.json"]]
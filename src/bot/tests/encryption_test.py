@@ -0,0 +1,118 @@
+import copy
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from encryption import DataEncryptor, ENVELOPE_MODE, FIELD_MODE, SEALED_FIELD
+from field_cipher import FERNET_CIPHER
+
+CLAIM_DATA: dict = {
+    "user_id": 1,
+    "claim_theme": "theme",
+    "claim_data": {
+        "head": {
+            "user_name": "Иванов Иван Иванович",
+            "user_post_code": "123456",
+            "chosen_city": "Москва",
+            "chosen_street": "Ленина",
+            "house_chosen": "1",
+            "apartment_chosen": "2",
+            "chosen_employer_name": "ООО Ромашка"
+        }
+    }
+}
+
+
+def generate_key() -> str:
+    return Fernet.generate_key().decode()
+
+
+@pytest.mark.parametrize("mode", [ENVELOPE_MODE, FIELD_MODE])
+def test_roundtrip(mode: str):
+    encryptor: DataEncryptor = DataEncryptor([generate_key()], mode)
+    encrypted_data: dict = encryptor.encrypt_data(copy.deepcopy(CLAIM_DATA))
+    assert encrypted_data["claim_data"]["head"]["chosen_employer_name"] == "ООО Ромашка"
+    assert "Москва" not in str(encrypted_data)
+    assert encryptor.decrypt_data(encrypted_data) == CLAIM_DATA
+
+
+def test_envelope_seals_section_once():
+    encryptor: DataEncryptor = DataEncryptor([generate_key()])
+    encrypted_data: dict = encryptor.encrypt_data(copy.deepcopy(CLAIM_DATA))
+    encrypted_head: dict = encrypted_data["claim_data"]["head"]
+    assert set(encrypted_head.keys()) == {"chosen_employer_name", SEALED_FIELD}
+    assert encryptor.crypto_calls == 1
+
+    encryptor.decrypt_data(encrypted_data)
+    assert encryptor.crypto_calls == 2
+
+
+def test_legacy_field_documents_are_readable():
+    key: str = generate_key()
+    legacy_data: dict = DataEncryptor([key], FIELD_MODE).encrypt_data(copy.deepcopy(CLAIM_DATA))
+    assert DataEncryptor([key], ENVELOPE_MODE).decrypt_data(legacy_data) == CLAIM_DATA
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        DataEncryptor([generate_key()], "unknown")
+
+
+def test_old_key_data_is_stale():
+    old_key: str = generate_key()
+    new_key: str = generate_key()
+    old_data: dict = DataEncryptor([old_key]).encrypt_data(copy.deepcopy(CLAIM_DATA))
+
+    encryptor: DataEncryptor = DataEncryptor([new_key, old_key])
+    decrypted_data: dict = copy.deepcopy(old_data)
+    assert encryptor.decrypt_and_check(decrypted_data) is True
+    assert decrypted_data == CLAIM_DATA
+
+    new_data: dict = encryptor.encrypt_data(copy.deepcopy(decrypted_data))
+    assert DataEncryptor([new_key]).decrypt_and_check(new_data) is False
+    with pytest.raises(InvalidToken):
+        DataEncryptor([old_key]).decrypt_data(copy.deepcopy(new_data))
+
+
+def test_other_mode_data_is_stale():
+    key: str = generate_key()
+    field_data: dict = DataEncryptor([key], FIELD_MODE).encrypt_data(copy.deepcopy(CLAIM_DATA))
+    assert DataEncryptor([key], FIELD_MODE).decrypt_and_check(copy.deepcopy(field_data)) is False
+    assert DataEncryptor([key], ENVELOPE_MODE).decrypt_and_check(copy.deepcopy(field_data)) is True
+
+
+@pytest.mark.parametrize("mode", [ENVELOPE_MODE, FIELD_MODE])
+def test_lazy_decryption(mode: str):
+    encryptor: DataEncryptor = DataEncryptor([generate_key()], mode)
+    encrypted_data: dict = encryptor.encrypt_data(copy.deepcopy(CLAIM_DATA))
+    assert encryptor.may_be_stale(encrypted_data) is False
+
+    claim_data = encryptor.decrypt_lazily(encrypted_data)
+    head = claim_data["claim_data"]["head"]
+    assert claim_data["claim_theme"] == "theme"
+    assert head["chosen_employer_name"] == "ООО Ромашка"
+    assert head.get("unknown") is None
+    assert encryptor.lazy_stats["decrypted"] == 0
+
+    assert head["user_name"] == "Иванов Иван Иванович"
+    assert dict(head) == CLAIM_DATA["claim_data"]["head"]
+    head["chosen_city"] = "Казань"
+    assert head["chosen_city"] == "Казань"
+    deferred_count: int = 1 if mode == ENVELOPE_MODE else 6
+    assert encryptor.get_lazy_stats() == {"deferred": deferred_count, "decrypted": deferred_count, "avoided": 0}
+
+
+def test_lazy_decryption_of_other_mode_data():
+    key: str = generate_key()
+    field_data: dict = DataEncryptor([key], FIELD_MODE).encrypt_data(copy.deepcopy(CLAIM_DATA))
+    assert DataEncryptor([key], ENVELOPE_MODE).may_be_stale(field_data) is True
+    assert DataEncryptor([key, generate_key()], FIELD_MODE).may_be_stale(field_data) is True
+
+
+def test_other_cipher_data_is_stale():
+    key: str = generate_key()
+    fernet_data: dict = DataEncryptor([key], cipher_name=FERNET_CIPHER).encrypt_data(copy.deepcopy(CLAIM_DATA))
+    encryptor: DataEncryptor = DataEncryptor([key])
+    assert encryptor.may_be_stale(fernet_data) is True
+    assert encryptor.decrypt_and_check(fernet_data) is True
+    assert fernet_data == CLAIM_DATA
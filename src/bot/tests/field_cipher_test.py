@@ -0,0 +1,32 @@
+import pytest
+from cryptography.fernet import Fernet, InvalidToken
+
+from field_cipher import FIELD_CIPHERS, FERNET_CIPHER, create_field_cipher
+
+
+@pytest.mark.parametrize("name", FIELD_CIPHERS.keys())
+def test_roundtrip(name: str):
+    key: str = Fernet.generate_key().decode()
+    cipher = create_field_cipher(name, key)
+    value = cipher.encrypt("Иванов".encode())
+    assert cipher.is_cipher_value(value)
+    assert cipher.decrypt(value).decode() == "Иванов"
+    assert cipher.encrypt(b"value") != cipher.encrypt(b"value")
+
+    another_key_cipher = create_field_cipher(name, Fernet.generate_key().decode())
+    with pytest.raises(InvalidToken):
+        another_key_cipher.decrypt(value)
+
+
+@pytest.mark.parametrize("name", FIELD_CIPHERS.keys() - {FERNET_CIPHER})
+def test_aead_value_is_authenticated(name: str):
+    cipher = create_field_cipher(name, Fernet.generate_key().decode())
+    value: bytes = cipher.encrypt(b"value")
+    assert not create_field_cipher(FERNET_CIPHER, Fernet.generate_key().decode()).is_cipher_value(value)
+    with pytest.raises(InvalidToken):
+        cipher.decrypt(value[:-1] + bytes([value[-1] ^ 1]))
+
+
+def test_unknown_cipher():
+    with pytest.raises(ValueError):
+        create_field_cipher("unknown", Fernet.generate_key().decode())
@@ -0,0 +1,134 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from cryptography.fernet import InvalidToken
+from pymongo import ReplaceOne, DeleteOne
+
+from common import CourtInfo
+from fsm_storage import MongoWriteBehindStorage, BoundedMemoryStorage, encode_fsm_value, decode_fsm_value, \
+    ENTRY_OVERHEAD_BYTES
+
+
+class FakeRepository:
+    def __init__(self):
+        self.documents: Dict[str, dict] = {}
+        self.requests: List[list] = []
+
+    def encrypt_data(self, data: dict) -> dict:
+        return data
+
+    def decrypt_data(self, data: dict) -> dict:
+        if "_sealed" in data.get("data", {}):
+            raise InvalidToken()
+        return data
+
+    async def get_fsm_record(self, key: str) -> Optional[dict]:
+        return self.documents.get(key)
+
+    async def bulk_write(self, collection_name: str, requests: list):
+        self.requests.append(requests)
+        for request in requests:
+            if isinstance(request, ReplaceOne):
+                self.documents[request._filter["_id"]] = request._doc
+            elif isinstance(request, DeleteOne):
+                self.documents.pop(request._filter["_id"], None)
+
+
+def test_encode_fsm_value():
+    court: CourtInfo = CourtInfo("Тверской районный суд", "Москва, ул. Цветной бульвар, 25А", "")
+    data: dict = {"courts": [court], "chosen_court": court, "head": {"user_name": "Иванов"}}
+    encoded_data: dict = encode_fsm_value(data)
+    assert encoded_data["chosen_court"] == {"_type": "CourtInfo", "_fields": list(court)}
+    assert decode_fsm_value(encoded_data) == data
+    assert isinstance(decode_fsm_value(encoded_data)["courts"][0], CourtInfo)
+
+
+def test_write_behind_storage():
+    repository: FakeRepository = FakeRepository()
+    court: CourtInfo = CourtInfo("Тверской районный суд", "Москва, ул. Цветной бульвар, 25А", "")
+
+    async def run_storage():
+        storage: MongoWriteBehindStorage = MongoWriteBehindStorage(flush_interval_sec=60, repository=repository)
+        for index in range(10):
+            await storage.set_state(chat=1, user=1, state=f"state_{index}")
+            await storage.update_data(chat=1, user=1, data={f"field_{index}": index, "court": court})
+        await storage.set_state(chat=2, user=2, state="state")
+        await storage.reset_state(chat=2, user=2)
+        assert repository.requests == []
+        await storage.close()
+
+        # the states are loaded from the db after a restart
+        storage = MongoWriteBehindStorage(repository=repository)
+        state: Optional[str] = await storage.get_state(chat=1, user=1)
+        data: dict = await storage.get_data(chat=1, user=1)
+        await storage.close()
+        return storage.stats, state, data
+
+    loop = asyncio.new_event_loop()
+    stats, state, data = loop.run_until_complete(run_storage())
+    loop.close()
+    # the changes of a user are written by one request, the reset state is removed
+    assert len(repository.requests) == 1
+    assert sorted(type(request).__name__ for request in repository.requests[0]) == ["DeleteOne", "ReplaceOne"]
+    assert list(repository.documents.keys()) == ["1:1"]
+    assert state == "state_9"
+    assert data == {**{f"field_{index}": index for index in range(10)}, "court": court}
+    assert stats["misses"] == 1 and stats["hits"] == 1
+
+
+def test_write_behind_storage_undecryptable():
+    repository: FakeRepository = FakeRepository()
+    repository.documents["1:1"] = {"_id": "1:1", "state": "state", "data": {"_sealed": b"old key"}, "bucket": {}}
+
+    async def run_storage():
+        storage: MongoWriteBehindStorage = MongoWriteBehindStorage(flush_interval_sec=60, repository=repository)
+        state: Optional[str] = await storage.get_state(chat=1, user=1)
+        data: dict = await storage.get_data(chat=1, user=1)
+        await storage.close()
+        return storage.stats, state, data
+
+    loop = asyncio.new_event_loop()
+    stats, state, data = loop.run_until_complete(run_storage())
+    loop.close()
+    # the chat is reset and the state is removed from the db
+    assert state is None and data == {}
+    assert stats["undecryptable"] == 1
+    assert repository.documents == {}
+
+
+def test_bounded_memory_storage():
+    now: List[float] = [0]
+    storage: BoundedMemoryStorage = BoundedMemoryStorage(ttl_sec=60, clock=lambda: now[0])
+    court: CourtInfo = CourtInfo("Тверской районный суд", "Москва, ул. Цветной бульвар, 25А", "")
+
+    async def run_storage():
+        await storage.set_state(chat=1, user=1, state="state")
+        await storage.update_data(chat=1, user=1, data={"court": court}, user_name="Иванов")
+        assert await storage.get_data(chat=1, user=1) == {"court": court, "user_name": "Иванов"}
+        # the reset state takes no memory
+        await storage.set_state(chat=2, user=2, state="state")
+        await storage.reset_state(chat=2, user=2)
+        assert storage.get_stats() == {"entries": 1, "bytes": storage.entries["1:1"].get_size(), "expired": 0,
+                                       "evicted": 0}
+
+        # the least recently used state is evicted over the size limit
+        storage.max_bytes = storage.get_stats()["bytes"] + 2 * (ENTRY_OVERHEAD_BYTES + len("state"))
+        now[0] = 10
+        for user_id in range(3, 6):
+            await storage.set_state(chat=user_id, user=user_id, state="state")
+            await storage.get_state(chat=1, user=1)
+        assert list(storage.entries.keys()) == ["4:4", "5:5", "1:1"]
+        assert storage.stats["evicted"] == 1
+
+        # the states, which aren't accessed for the TTL, are expired
+        now[0] = 30
+        await storage.get_state(chat=1, user=1)
+        now[0] = 80
+        assert await storage.get_state(chat=4, user=4) is None
+        assert await storage.get_state(chat=1, user=1) == "state"
+        assert storage.stats["expired"] == 2
+        assert storage.get_stats()["bytes"] == storage.entries["1:1"].get_size()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run_storage())
+    loop.close()
@@ -0,0 +1,41 @@
+import random
+from typing import Dict, List
+
+from common.hyperloglog import HLL_STANDARD_ERROR, get_hll_register, merge_hll_registers, estimate_hll_cardinality
+
+
+def get_registers(hashes: List[str]) -> Dict[int, int]:
+    registers: Dict[int, int] = {}
+    for hash_hex in hashes:
+        index, rank = get_hll_register(hash_hex)
+        registers[index] = max(registers.get(index, 0), rank)
+    return registers
+
+
+def get_random_hashes(count: int) -> List[str]:
+    return [f"{random.getrandbits(96):024x}" for _ in range(count)]
+
+
+def test_get_hll_register():
+    assert get_hll_register("fff" + "0" * 21) == (1023, 1)
+    assert get_hll_register("001" + "0" * 21) == (0, 2)
+    assert get_hll_register("0" * 24) == (0, 87)
+
+
+def test_estimate_small_cardinality():
+    random.seed(1)
+    assert estimate_hll_cardinality({}) == 0
+    hashes: List[str] = get_random_hashes(50)
+    assert abs(estimate_hll_cardinality(get_registers(hashes)) - 50) <= 2
+    # the repeated users aren't counted
+    assert estimate_hll_cardinality(get_registers(hashes * 3)) == estimate_hll_cardinality(get_registers(hashes))
+
+
+def test_estimate_merged_cardinality():
+    random.seed(2)
+    days_hashes: List[List[str]] = [get_random_hashes(5000) for _ in range(4)]
+    # the users of the first day come back every day
+    days_registers: List[Dict[int, int]] = [get_registers(hashes + days_hashes[0]) for hashes in days_hashes]
+    merged_registers: Dict[int, int] = merge_hll_registers(*days_registers)
+    assert merged_registers == get_registers([hash_hex for hashes in days_hashes for hash_hex in hashes])
+    assert abs(estimate_hll_cardinality(merged_registers) - 20000) <= 20000 * 3 * HLL_STANDARD_ERROR
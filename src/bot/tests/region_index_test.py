@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+from common.region_index import RegionIndex
+
+REGIONS_FILE_PATH: str = os.path.join(os.path.dirname(__file__), "..", "resources", "regions.json")
+
+
+@pytest.mark.parametrize("post_code, expected_code", [
+    ("153003", "37"),
+    ("450000", "2"),
+    ("667000", "17"),
+    ("000000", "-1"),
+])
+def test_get_region_code(post_code: str, expected_code: str):
+    region_index: RegionIndex = RegionIndex()
+    region_index.load([
+        {"name": "Республика Башкортостан", "code": 2, "post": ["450", "451"]},
+        {"name": "Республика Тыва", "code": 17, "post": ["667"]},
+        {"name": "Ивановская область", "code": 37, "post": ["153", "155"]},
+        {"name": "Дубликат", "code": 99, "post": ["667"]}
+    ])
+    assert expected_code == region_index.get_region_code(post_code)
+
+
+def test_load_file():
+    region_index: RegionIndex = RegionIndex()
+    region_index.load_file(REGIONS_FILE_PATH)
+    assert region_index.get_region_code("101000") != "-1"
@@ -0,0 +1,60 @@
+from datetime import datetime
+from typing import List, Tuple
+
+from common.hyperloglog import pack_hll_registers, unpack_hll_registers
+from statistics import get_covering_rollup_keys, MONTH_ROLLUP, WEEK_ROLLUP
+from statistics_retention import get_packed_rollup_document, get_compacted_rollups_filter, get_compacted_range
+
+
+def test_pack_hll_registers():
+    registers: dict = {0: 3, 17: 1, 1023: 87}
+    packed_registers: bytes = pack_hll_registers(registers)
+    assert unpack_hll_registers(packed_registers) == registers
+    assert len(packed_registers) < 100
+    assert unpack_hll_registers(pack_hll_registers({})) == {}
+
+
+def test_get_packed_rollup_document():
+    rollup: dict = {
+        "_id": 1,
+        "period": "month",
+        "date": datetime(2022, 2, 1),
+        "events": {"start:start_menu": 3},
+        "registers": {"*": {"0": 2, "5": 1}, "start:start_menu": {"0": 2, "5": 1}}
+    }
+    packed_rollup: dict = get_packed_rollup_document(rollup)
+    assert packed_rollup == {
+        "period": "month",
+        "date": datetime(2022, 2, 1),
+        "events": {"start:start_menu": 3},
+        "unique_users": 2,
+        "packed_registers": {
+            "*": pack_hll_registers({0: 2, 5: 1}),
+            "start:start_menu": pack_hll_registers({0: 2, 5: 1})
+        }
+    }
+
+
+def test_get_compacted_rollups_filter():
+    # February is compacted, the week of 28.02 - 06.03 is used for the last days of the period
+    rollups_filter: dict = get_compacted_rollups_filter(datetime(2022, 3, 1))
+    rollup_keys: List[Tuple[str, datetime]] = get_covering_rollup_keys(datetime(2022, 2, 28), datetime(2022, 3, 10))
+    assert (WEEK_ROLLUP, datetime(2022, 2, 28)) in rollup_keys
+    assert all(date >= rollups_filter["date"]["$lt"] for period, date in rollup_keys if period != MONTH_ROLLUP)
+    assert datetime(2022, 2, 21) < rollups_filter["date"]["$lt"]
+
+
+def test_get_compacted_range():
+    compacted_before: datetime = datetime(2022, 3, 1)
+    assert get_compacted_range(datetime(2022, 1, 15), datetime(2022, 3, 10), None) == \
+           (datetime(2022, 1, 15), datetime(2022, 3, 10))
+    # the days of January and February are removed, so the range is covered by these months
+    date_from, date_to = get_compacted_range(datetime(2022, 1, 15), datetime(2022, 3, 10), compacted_before)
+    assert (date_from, date_to) == (datetime(2022, 1, 1), datetime(2022, 3, 10))
+    rollups_filter: dict = get_compacted_rollups_filter(compacted_before)
+    assert all(period == MONTH_ROLLUP or date >= rollups_filter["date"]["$lt"]
+               for period, date in get_covering_rollup_keys(date_from, date_to))
+    assert get_compacted_range(datetime(2022, 2, 23), datetime(2022, 2, 23), compacted_before) == \
+           (datetime(2022, 2, 1), datetime(2022, 2, 28))
+    assert get_compacted_range(datetime(2022, 3, 2), datetime(2022, 3, 10), compacted_before) == \
+           (datetime(2022, 3, 2), datetime(2022, 3, 10))
@@ -0,0 +1,205 @@
+import asyncio
+from datetime import datetime
+from io import StringIO
+from typing import List
+
+from bson import ObjectId
+from pymongo import UpdateOne, DeleteOne
+
+import statistics
+from statistics import get_legacy_statistics_requests, get_user_id_hash, get_statistics_requests, get_rollup_requests, \
+    get_covering_rollup_keys, merge_rollups, export_statistics, StatisticsEvent, StatisticsBuffer
+
+
+def test_get_user_id_hash():
+    assert get_user_id_hash(1) == get_user_id_hash(1)
+    assert get_user_id_hash(1) != get_user_id_hash(2)
+
+
+def test_get_legacy_statistics_requests():
+    date: datetime = datetime(2022, 2, 23)
+    day_stats: dict = {
+        "_id": ObjectId(),
+        "date": date,
+        "unique_users": {
+            "user": {"start:start_menu": 2, "download_doc": 1},
+            "another user": {}
+        }
+    }
+    assert get_legacy_statistics_requests(day_stats) == [
+        UpdateOne({"date": date, "user": "user"},
+                  {"$max": {"events.start:start_menu": 2, "events.download_doc": 1}}, upsert=True),
+        DeleteOne({"_id": day_stats["_id"]})
+    ]
+
+
+def test_get_statistics_requests():
+    date: datetime = datetime(2022, 2, 23)
+    events: List[StatisticsEvent] = [
+        StatisticsEvent(date, "user", "start:start_menu"),
+        StatisticsEvent(date, "another user", "start:start_menu"),
+        StatisticsEvent(date, "user", "start:start_menu"),
+        StatisticsEvent(date, "user", "download_doc")
+    ]
+    assert get_statistics_requests(events) == [
+        UpdateOne({"date": date, "user": "user"},
+                  {"$inc": {"events.start:start_menu": 2, "events.download_doc": 1}}, upsert=True),
+        UpdateOne({"date": date, "user": "another user"}, {"$inc": {"events.start:start_menu": 1}}, upsert=True)
+    ]
+
+
+class FakeRepository:
+    requests: dict = {}
+
+    async def bulk_write(self, collection_name: str, requests: list):
+        FakeRepository.requests.setdefault(collection_name, []).extend(requests)
+
+
+def test_statistics_buffer(monkeypatch):
+    monkeypatch.setattr(statistics, "AsyncRepository", FakeRepository)
+    date: datetime = datetime(2022, 2, 23)
+
+    async def run_buffer():
+        buffer: StatisticsBuffer = StatisticsBuffer(max_size=3, flush_size=2, flush_interval_sec=60)
+        buffer.start()
+        for _ in range(2):
+            buffer.put(StatisticsEvent(date, get_user_id_hash(1), "start:start_menu"))
+        # the flush is requested by the size
+        await asyncio.sleep(0.01)
+        assert buffer.stats["flushed"] == 2
+
+        for _ in range(4):
+            buffer.put(StatisticsEvent(date, get_user_id_hash(1), "download_doc"))
+        await buffer.stop()
+        return buffer.stats
+
+    loop = asyncio.new_event_loop()
+    stats: dict = loop.run_until_complete(run_buffer())
+    loop.close()
+    assert stats == {"queued": 5, "dropped": 1, "flushed": 5, "failed": 0, "flushes": 2, "rollups_retried": 0,
+                     "rollups_dropped": 0}
+    assert len(FakeRepository.requests["statistics"]) == 2
+    # the day, the week and the month of every flush
+    assert len(FakeRepository.requests["statistics-rollups"]) == 6
+
+
+class FailingRollupsRepository:
+    requests: dict = {}
+    failures_count: int = 1
+
+    async def bulk_write(self, collection_name: str, requests: list):
+        if collection_name == "statistics-rollups" and FailingRollupsRepository.failures_count > 0:
+            FailingRollupsRepository.failures_count -= 1
+            raise ConnectionError()
+        FailingRollupsRepository.requests.setdefault(collection_name, []).extend(requests)
+
+
+def test_statistics_buffer_rollups_retry(monkeypatch):
+    monkeypatch.setattr(statistics, "AsyncRepository", FailingRollupsRepository)
+    date: datetime = datetime(2022, 2, 23)
+
+    async def run_buffer():
+        buffer: StatisticsBuffer = StatisticsBuffer(flush_interval_sec=60)
+        buffer.start()
+        buffer.put(StatisticsEvent(date, get_user_id_hash(1), "start:start_menu"))
+        await buffer.flush()
+        # the events are written, their rollups are retried by the next flush
+        assert len(FailingRollupsRepository.requests["statistics"]) == 1
+        assert "statistics-rollups" not in FailingRollupsRepository.requests
+        buffer.put(StatisticsEvent(date, get_user_id_hash(2), "download_doc"))
+        await buffer.stop()
+        return buffer.stats
+
+    loop = asyncio.new_event_loop()
+    stats: dict = loop.run_until_complete(run_buffer())
+    loop.close()
+    assert stats["flushed"] == 2 and stats["failed"] == 0 and stats["rollups_retried"] == 3
+    assert len(FailingRollupsRepository.requests["statistics-rollups"]) == 6
+
+
+def test_get_rollup_requests():
+    date: datetime = datetime(2022, 2, 23)
+    user_id_hash: str = "001" + "0" * 21
+    events: List[StatisticsEvent] = [
+        StatisticsEvent(date, user_id_hash, "start:start_menu"),
+        StatisticsEvent(date, "fff" + "0" * 21, "start:start_menu"),
+        StatisticsEvent(date, user_id_hash, "download_doc")
+    ]
+    update: dict = {
+        "$inc": {"events.start:start_menu": 2, "events.download_doc": 1},
+        "$max": {
+            "registers.*.0": 2,
+            "registers.start:start_menu.0": 2,
+            "registers.*.1023": 1,
+            "registers.start:start_menu.1023": 1,
+            "registers.download_doc.0": 2
+        }
+    }
+    assert get_rollup_requests(events) == [
+        UpdateOne({"period": "day", "date": date}, update, upsert=True),
+        UpdateOne({"period": "week", "date": datetime(2022, 2, 21)}, update, upsert=True),
+        UpdateOne({"period": "month", "date": datetime(2022, 2, 1)}, update, upsert=True)
+    ]
+    assert get_rollup_requests(events, ["day"]) == [UpdateOne({"period": "day", "date": date}, update, upsert=True)]
+
+
+def test_get_covering_rollup_keys():
+    assert get_covering_rollup_keys(datetime(2022, 2, 23), datetime(2022, 2, 23)) == [("day", datetime(2022, 2, 23))]
+    assert get_covering_rollup_keys(datetime(2022, 1, 29), datetime(2022, 3, 15)) == [
+        ("day", datetime(2022, 1, 29)),
+        ("day", datetime(2022, 1, 30)),
+        ("day", datetime(2022, 1, 31)),
+        ("month", datetime(2022, 2, 1)),
+        ("day", datetime(2022, 3, 1)),
+        ("day", datetime(2022, 3, 2)),
+        ("day", datetime(2022, 3, 3)),
+        ("day", datetime(2022, 3, 4)),
+        ("day", datetime(2022, 3, 5)),
+        ("day", datetime(2022, 3, 6)),
+        ("week", datetime(2022, 3, 7)),
+        ("day", datetime(2022, 3, 14)),
+        ("day", datetime(2022, 3, 15))
+    ]
+    # the week crosses the month, which isn't covered entirely
+    assert get_covering_rollup_keys(datetime(2022, 2, 28), datetime(2022, 3, 6)) == [("week", datetime(2022, 2, 28))]
+    assert len(get_covering_rollup_keys(datetime(2022, 1, 1), datetime(2022, 12, 31))) == 12
+
+
+def test_merge_rollups():
+    rollups: List[dict] = [
+        {"events": {"start:start_menu": 2}, "registers": {"*": {0: 2, 5: 1}, "start:start_menu": {0: 2, 5: 1}}},
+        {"events": {"start:start_menu": 1, "download_doc": 1},
+         "registers": {"*": {0: 3}, "start:start_menu": {0: 1}, "download_doc": {0: 3}}}
+    ]
+    assert merge_rollups(rollups) == (
+        {"start:start_menu": 3, "download_doc": 1},
+        {"*": {0: 3, 5: 1}, "start:start_menu": {0: 2, 5: 1}, "download_doc": {0: 3}}
+    )
+
+
+class FakeStatisticsRepository:
+    def __init__(self, statistics: List[dict]):
+        self.statistics: List[dict] = statistics
+
+    async def iterate_statistics(self, date_from: datetime, date_to: datetime):
+        for user_stats in self.statistics:
+            yield user_stats
+
+
+def test_export_statistics():
+    repository: FakeStatisticsRepository = FakeStatisticsRepository([
+        {"date": datetime(2022, 2, 23), "user": "user", "events": {"start:start_menu": 2, "download_doc": 1}},
+        {"date": datetime(2022, 2, 24), "user": "another user", "events": {"start:start_menu": 1}}
+    ])
+    export_file: StringIO = StringIO(newline="")
+    loop = asyncio.new_event_loop()
+    rows_count: int = loop.run_until_complete(export_statistics(repository, datetime(2022, 2, 23),
+                                                                datetime(2022, 2, 24), export_file))
+    loop.close()
+    assert rows_count == 3
+    assert export_file.getvalue().splitlines() == [
+        "date,user,event,count",
+        "2022-02-23,user,download_doc,1",
+        "2022-02-23,user,start:start_menu,2",
+        "2022-02-24,another user,start:start_menu,1"
+    ]
@@ -0,0 +1,62 @@
+import asyncio
+from typing import List
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+from aiohttp import web
+from aiohttp.test_utils import TestServer, TestClient
+
+from webhook import FastWebhookRequestHandler, WEBHOOK_SECRET_KEY, WEBHOOK_SECRET_HEADER, pending_updates, \
+    wait_pending_updates, webhook_stats
+
+UPDATE: dict = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "text": "привет",
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Иван"}
+    }
+}
+
+
+def test_webhook():
+    async def run_webhook():
+        dispatcher: Dispatcher = Dispatcher(Bot(token="123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11"))
+        handled_texts: List[str] = []
+        handler_released: asyncio.Event = asyncio.Event()
+
+        async def handle_message(message: types.Message):
+            await handler_released.wait()
+            handled_texts.append(message.text)
+
+        dispatcher.register_message_handler(handle_message)
+        web_app: web.Application = web.Application()
+        web_app[BOT_DISPATCHER_KEY] = dispatcher
+        web_app[WEBHOOK_SECRET_KEY] = "secret"
+        web_app.router.add_route("*", "/webhook", FastWebhookRequestHandler)
+
+        client: TestClient = TestClient(TestServer(web_app))
+        await client.start_server()
+        try:
+            response = await client.post("/webhook", json=UPDATE)
+            assert response.status == 403
+            response = await client.post("/webhook", data="{", headers={WEBHOOK_SECRET_HEADER: "secret"})
+            assert response.status == 400
+
+            # the response doesn't wait for the handler
+            response = await client.post("/webhook", json=UPDATE, headers={WEBHOOK_SECRET_HEADER: "secret"})
+            assert response.status == 200
+            assert len(pending_updates) == 1 and handled_texts == []
+
+            handler_released.set()
+            await wait_pending_updates(web_app)
+            assert handled_texts == ["привет"]
+        finally:
+            await client.close()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(run_webhook())
+    loop.close()
+    assert webhook_stats == {"received": 1, "rejected": 2, "failed": 0}
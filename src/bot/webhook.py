@@ -0,0 +1,95 @@
+import asyncio
+import hmac
+import logging
+from typing import Callable, Dict, Optional, Set
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+
+import bot_config
+
+WEBHOOK_SECRET_HEADER: str = "X-Telegram-Bot-Api-Secret-Token"
+WEBHOOK_SECRET_KEY: str = "WEBHOOK_SECRET_TOKEN"
+
+webhook_stats: Dict[str, int] = {
+    "received": 0,
+    "rejected": 0,
+    "failed": 0
+}
+
+# the updates in processing, they are awaited on shutdown
+pending_updates: Set[asyncio.Task] = set()
+
+
+async def process_webhook_update(dispatcher: Dispatcher, update: types.Update):
+    try:
+        await dispatcher.process_update(update)
+    except Exception:
+        # the errors handlers are already notified by the dispatcher, nobody waits for the result
+        webhook_stats["failed"] += 1
+        logging.getLogger("WEBHOOK").exception(f"Failed to process update {update.update_id}")
+
+
+# The update is only validated and scheduled, so Telegram gets the response at once and sends the next updates without
+# waiting for the handlers. The updates are processed concurrently, as with the polling. The replies are sent by
+# the bot requests, the webhook response isn't used for them.
+class FastWebhookRequestHandler(WebhookRequestHandler):
+    async def post(self):
+        self.validate_ip()
+        secret_token: Optional[str] = self.request.app.get(WEBHOOK_SECRET_KEY)
+        if secret_token is not None and \
+                not hmac.compare_digest(self.request.headers.get(WEBHOOK_SECRET_HEADER, ""), secret_token):
+            webhook_stats["rejected"] += 1
+            raise web.HTTPForbidden()
+
+        dispatcher: Dispatcher = self.get_dispatcher()
+        try:
+            update: types.Update = await self.parse_update(dispatcher.bot)
+        except (ValueError, TypeError):
+            webhook_stats["rejected"] += 1
+            raise web.HTTPBadRequest()
+
+        webhook_stats["received"] += 1
+        task: asyncio.Task = asyncio.ensure_future(process_webhook_update(dispatcher, update))
+        pending_updates.add(task)
+        task.add_done_callback(pending_updates.discard)
+        return web.Response(text="ok")
+
+
+async def wait_pending_updates(_: web.Application):
+    # the updates in processing must be finished before the storage and the db are closed
+    if any(pending_updates):
+        await asyncio.wait(list(pending_updates))
+
+
+def get_webhook_stats() -> Dict[str, int]:
+    return {**webhook_stats, "processing": len(pending_updates)}
+
+
+def start_webhook(dispatcher: Dispatcher, on_startup: Callable, on_shutdown: Callable):
+    config: dict = bot_config.get_config()
+    webhook_path: str = config.get("WEBHOOK_PATH") or "/webhook"
+    webhook_url: Optional[str] = config.get("WEBHOOK_URL")
+    secret_token: Optional[str] = config.get("WEBHOOK_SECRET_TOKEN") or None
+
+    async def set_bot_webhook(_: Dispatcher):
+        # without the url the updates are only received locally, e.g. for the recorded updates testing
+        if not webhook_url:
+            logging.warning("WEBHOOK_URL isn't set, the webhook isn't registered in Telegram.")
+            return
+
+        await dispatcher.bot.set_webhook(webhook_url.rstrip("/") + webhook_path, secret_token=secret_token,
+                                         drop_pending_updates=True)
+        logging.info(f"Webhook is set to {webhook_url.rstrip('/')}{webhook_path}.")
+
+    web_app: web.Application = web.Application()
+    web_app[WEBHOOK_SECRET_KEY] = secret_token
+    web_app.on_shutdown.append(wait_pending_updates)
+
+    bot_executor: Executor = Executor(dispatcher)
+    bot_executor.on_startup([set_bot_webhook, on_startup], polling=False)
+    bot_executor.on_shutdown(on_shutdown, polling=False)
+    bot_executor.set_webhook(webhook_path, request_handler=FastWebhookRequestHandler, web_app=web_app)
+    bot_executor.run_app(host=config.get("WEBHOOK_HOST") or "0.0.0.0", port=bot_config.get_int("WEBHOOK_PORT", 8080))
@@ -1,12 +1,56 @@
 import logging
 import os
+import random
 import sys
 from datetime import datetime, timedelta
-from time import sleep
+from time import sleep, monotonic
+from typing import List, Optional, Dict
 
 import pytz
 from dotenv import dotenv_values
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
+from pymongo.collection import Collection
+
+
+def get_int_env(name: str, default: int) -> int:
+    value_raw: Optional[str] = os.environ.get(name)
+    return default if (value_raw is None) or (value_raw.isdigit() is False) else int(value_raw)
+
+
+# the expiring collections with the date field, which is indexed by the bot, see db_indexes
+EXPIRING_COLLECTIONS: Dict[str, str] = {
+    "claim-data": "created",
+    # the FSM states of the abandoned sessions, see fsm_storage
+    "fsm-states": "updated"
+}
+
+
+def get_backlog_age(collection: Collection, date_threshold: datetime, date_field: str = "created") \
+        -> Optional[timedelta]:
+    # how long the oldest expired record is overdue
+    oldest_record: Optional[dict] = collection.find_one({date_field: {"$lt": date_threshold}},
+                                                        {"_id": 0, date_field: 1}, sort=[(date_field, ASCENDING)])
+    if oldest_record is None:
+        return None
+    return date_threshold - oldest_record[date_field].replace(tzinfo=pytz.UTC)
+
+
+def delete_expired_records(collection: Collection, date_threshold: datetime, batch_size: int,
+                           date_field: str = "created") -> int:
+    # Only the ids of a batch are read by the index on the date field and the batch is deleted by one request, so
+    # the memory doesn't depend on the number of the expired records.
+    deleted_count: int = 0
+    while True:
+        expired_records = collection.find({date_field: {"$lt": date_threshold}}, {"_id": 1}) \
+            .sort(date_field, ASCENDING).limit(batch_size)
+        expired_ids: List = [record["_id"] for record in expired_records]
+        if not any(expired_ids):
+            return deleted_count
+
+        deleted_count += collection.delete_many({"_id": {"$in": expired_ids}}).deleted_count
+        if len(expired_ids) < batch_size:
+            return deleted_count
+
 
 if __name__ == "__main__":
     config = dotenv_values(".env")
@@ -14,18 +58,16 @@ if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
 
     db_name: str = config["MONGO_INITDB_DATABASE"]
-    collection_name: str = "claim-data"
-    delay_sec_raw: str = os.environ.get("DELAY_SEC")
-    delay_sec: int = 60 * 60 * 2 \
-        if (delay_sec_raw is None) or (delay_sec_raw.isdigit() is False)\
-        else int(delay_sec_raw)
+    delay_sec: int = get_int_env("DELAY_SEC", 60 * 5)
     logger.info(f"Delay seconds: {delay_sec}")
+    # the random addition to the delay, so the daemon doesn't load the db at the same moments as other jobs
+    delay_jitter_sec: int = get_int_env("DELAY_JITTER_SEC", delay_sec // 10)
+    logger.info(f"Delay jitter seconds: {delay_jitter_sec}")
 
-    data_lifetime_h_raw: str = os.environ.get("DATA_LIFETIME_H")
-    data_lifetime_h: int = 2 \
-        if (data_lifetime_h_raw is None) or (data_lifetime_h_raw.isdigit() is False) \
-        else int(data_lifetime_h_raw)
+    data_lifetime_h: int = get_int_env("DATA_LIFETIME_H", 2)
     logger.info(f"Data lifetime: {data_lifetime_h}")
+    batch_size: int = get_int_env("BATCH_SIZE", 500)
+    logger.info(f"Batch size: {batch_size}")
 
     mongo_config: dict = {
         "host": config["MONGO_HOST"],
@@ -36,18 +78,24 @@ if __name__ == "__main__":
         "authMechanism": "SCRAM-SHA-256"
     }
 
-    while True:
-        logger.info("Start processing expired claim data.")
-        date_threshold: datetime = datetime.utcnow().replace(tzinfo=pytz.UTC) - timedelta(hours=data_lifetime_h)
-        logger.info(f"Date threshold: {date_threshold}.")
-
-        with MongoClient(**mongo_config) as mongo_client:
-            expired_records = list(mongo_client[db_name][collection_name] \
-                                   .find({"created": {'$lt': date_threshold}}))
+    with MongoClient(**mongo_config) as mongo_client:
+        for collection_name, date_field in EXPIRING_COLLECTIONS.items():
+            # the same index is created by the bot, see db_indexes
+            mongo_client[db_name][collection_name].create_index([(date_field, ASCENDING)], name=date_field)
 
-            logger.info(f"Found {len(expired_records)} expired records.")
-            for record in expired_records:
-                mongo_client[db_name][collection_name].delete_one({"_id": record["_id"]})
+        while True:
+            date_threshold: datetime = datetime.utcnow().replace(tzinfo=pytz.UTC) - timedelta(hours=data_lifetime_h)
+            for collection_name, date_field in EXPIRING_COLLECTIONS.items():
+                collection: Collection = mongo_client[db_name][collection_name]
+                try:
+                    backlog_age: Optional[timedelta] = get_backlog_age(collection, date_threshold, date_field)
+                    started_at: float = monotonic()
+                    deleted_count: int = delete_expired_records(collection, date_threshold, batch_size, date_field)
+                    logger.info(f"Deleted {deleted_count} records of '{collection_name}' expired before "
+                                f"{date_threshold} in {monotonic() - started_at:.3f} seconds, "
+                                f"backlog age: {backlog_age}.")
+                except Exception:
+                    # e.g. the db is temporarily unavailable, the records are deleted on the next iteration
+                    logger.exception(f"Failed to delete expired records of '{collection_name}'.")
 
-        logger.info(f"Sleep for {delay_sec} seconds until next iteration.")
-        sleep(delay_sec)
+            sleep(delay_sec + random.uniform(0, delay_jitter_sec))